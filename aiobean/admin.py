@@ -0,0 +1,266 @@
+"""
+Maintenance of big tubes, pipelined over one or more connections::
+
+    await purge_tube(conns, 'emails', states=[BURIED])
+    await drain_buried(conns, 'emails', archive)
+    await kick_ramp(conn, 'emails', rate=500, ramp=60, max_ready=10000)
+
+beanstalkd can only peek at the first job of a tube in each state, so
+going through jobs one peek at a time costs two round trips per job.
+Instead, job ids found with peeks are used as seeds: the ids around them
+are checked with pipelined ``stats-job``, and the jobs of the tube and
+state wanted are dealt with in pipelines too. Jobs put around the same
+time have neighbouring ids, so most of a scan hits; the size of the scan
+follows the share of hits.
+"""
+import asyncio
+import time
+from collections import namedtuple
+from aiobean.log import logger
+from aiobean.protocol import CommandFailed, Job
+
+READY = 'ready'
+DELAYED = 'delayed'
+BURIED = 'buried'
+STATES = (READY, DELAYED, BURIED)
+_PEEKS = {READY: 'peek-ready', DELAYED: 'peek-delayed',
+          BURIED: 'peek-buried'}
+
+Progress = namedtuple('Progress', 'done failed remaining elapsed')
+Progress.__doc__ = """
+jobs dealt with and failed so far, jobs of the tube left in the states
+concerned, and seconds elapsed
+"""
+
+
+class _Bulk:
+
+    def __init__(self, conns, tube, states, window, max_window, rate,
+                 progress, loop):
+        if not isinstance(conns, (list, tuple)):
+            conns = [conns]
+        for state in states:
+            if state not in STATES:
+                raise ValueError('unknown job state {!r}'.format(state))
+        self.conns = list(conns)
+        self.tube = tube
+        self.states = tuple(states)
+        self.window = window
+        self.max_window = max_window
+        self.rate = rate
+        self.loop = loop or asyncio.get_event_loop()
+        self._progress = progress
+        self._started = time.monotonic()
+        self.done = 0
+        self.failed = 0
+
+    async def run(self, command, ids):
+        """send `command` for each of `ids`, spread over the connections"""
+        ids = list(ids)
+        if not ids:
+            return {}
+        size = -(-len(ids) // len(self.conns))
+        chunks = [ids[start:start + size]
+                  for start in range(0, len(ids), size)]
+        pipes = []
+        for conn, chunk in zip(self.conns, chunks):
+            pipe = conn.pipeline()
+            for id in chunk:
+                pipe.execute(command, id)
+            pipes.append(pipe.send())
+        results = await asyncio.gather(*pipes, loop=self.loop)
+        return {id: result
+                for chunk, chunk_results in zip(chunks, results)
+                for id, result in zip(chunk, chunk_results)}
+
+    async def peek(self):
+        """
+        Seed ids, one per state, and the number of jobs left in these
+        states, from one pipeline on the first connection.
+        """
+        pipe = self.conns[0].pipeline()
+        pipe.use(self.tube)
+        pipe.stats_tube(self.tube)
+        for state in self.states:
+            pipe.execute(_PEEKS[state])
+        results = await pipe.send()
+        stats = results[1]
+        if isinstance(stats, CommandFailed):
+            return [], 0  # the tube is gone: it had no jobs left
+        if isinstance(stats, Exception):
+            raise stats
+        remaining = sum(stats['current-jobs-' + state]
+                        for state in self.states)
+        seeds = []
+        for result in results[2:]:
+            if isinstance(result, Exception):
+                raise result
+            if result is not None:  # None when the state has no job
+                seeds.append(result.id)
+        return seeds, remaining
+
+    async def scan(self, seeds, skip=()):
+        """ids around `seeds` of jobs in the tube and states wanted"""
+        candidates = set()
+        for seed in seeds:
+            candidates.update(range(max(1, seed - self.window),
+                                    seed + self.window))
+        candidates.difference_update(skip)
+        results = await self.run('stats-job', sorted(candidates))
+        found = [id for id, stats in results.items()
+                 if isinstance(stats, dict) and stats['tube'] == self.tube and
+                 stats['state'] in self.states]
+        # grow the scan while it mostly hits, shrink it when it mostly
+        # misses
+        if len(found) * 2 > len(candidates):
+            self.window = min(self.window * 2, self.max_window)
+        elif len(found) * 16 < len(candidates):
+            self.window = max(self.window // 2, 16)
+        return sorted(found)
+
+    def count(self, results):
+        for result in results.values():
+            if isinstance(result, Exception):
+                self.failed += 1
+            else:
+                self.done += 1
+
+    async def report(self, remaining):
+        progress = Progress(self.done, self.failed, remaining,
+                            time.monotonic() - self._started)
+        if self._progress is not None:
+            self._progress(progress)
+        if self.rate is not None:
+            # keep to the rate on average since the start
+            ahead = self.done / self.rate - progress.elapsed
+            if ahead > 0:
+                await asyncio.sleep(ahead, loop=self.loop)
+        return progress
+
+
+async def purge_tube(conns, tube, states=STATES, window=256,
+                     max_window=2 ** 16, rate=None, progress=None,
+                     loop=None):
+    """
+    Delete every job of `tube` in `states` (reserved jobs cannot be
+    deleted but by their reserver). Returns the final :class:`Progress`.
+
+    `conns` is a connection or a list of them; the first one is switched
+    to `tube` with ``use``. `window` is the initial number of ids scanned
+    on each side of a seed. With `rate`, no more than `rate` jobs are
+    deleted per second on average. `progress` is called with a
+    :class:`Progress` after every round.
+    """
+    bulk = _Bulk(conns, tube, states, window, max_window, rate, progress,
+                 loop)
+    while True:
+        seeds, remaining = await bulk.peek()
+        if not seeds:
+            return await bulk.report(remaining)
+        found = await bulk.scan(seeds)
+        results = await bulk.run('delete', found)
+        bulk.count(results)
+        await bulk.report(max(0, remaining - len(found)))
+
+
+async def drain_buried(conns, tube, handler, window=256, max_window=2 ** 16,
+                       rate=None, progress=None, loop=None):
+    """
+    Call coroutine `handler(job)` with every buried job of `tube` and
+    delete the job once the handler returns. A job whose handler raises
+    stays buried and counts as failed. Returns the final
+    :class:`Progress`.
+
+    The oldest buried job is the only one a peek finds, so once it has
+    failed, the rest are looked for by widening the scan around it up to
+    `max_window` ids; jobs further away are left, and count as
+    remaining. See :func:`purge_tube` for the other arguments.
+    """
+    bulk = _Bulk(conns, tube, [BURIED], window, max_window, rate, progress,
+                 loop)
+    failed = set()
+    while True:
+        seeds, remaining = await bulk.peek()
+        if not seeds:
+            return await bulk.report(remaining)
+        window = bulk.window
+        found = await bulk.scan(seeds, skip=failed)
+        if not found:
+            if window >= max_window:
+                logger.warning('admin: %d buried jobs left in %s',
+                               remaining, tube)
+                return await bulk.report(remaining)
+            bulk.window = min(window * 4, max_window)
+            continue
+        jobs = await bulk.run('peek', found)
+        jobs = [job for job in jobs.values() if isinstance(job, Job)]
+        outcomes = await asyncio.gather(
+            *[handler(job) for job in jobs], loop=bulk.loop,
+            return_exceptions=True)
+        handled = []
+        for job, outcome in zip(jobs, outcomes):
+            # a handler cancelled gives a CancelledError, no Exception
+            # since python 3.8
+            if isinstance(outcome, BaseException):
+                logger.error('admin: failed to drain job %s: %r',
+                             job.id, outcome)
+                failed.add(job.id)
+                bulk.failed += 1
+            else:
+                handled.append(job.id)
+        bulk.count(await bulk.run('delete', handled))
+        await bulk.report(max(0, remaining - len(jobs)))
+
+
+async def kick_ramp(conns, tube, rate, total=None, ramp=0, state=None,
+                    max_ready=None, interval=0.1, window=256,
+                    max_window=2 ** 16, progress=None, loop=None):
+    """
+    Kick up to `total` jobs of `tube` (all of them by default) back to
+    ready at `rate` jobs per second, starting from nothing and reaching
+    `rate` after `ramp` seconds, so consumers warm up gradually. Returns
+    the final :class:`Progress`.
+
+    Without `state`, ``kick`` takes buried jobs first, then delayed ones,
+    as beanstalkd does. With `state` (``'buried'`` or ``'delayed'``) only
+    jobs in that state are found, by scanning, and kicked with
+    ``kick-job``. With `max_ready`, kicking waits while the tube has that
+    many ready jobs, as ``stats-tube`` reports. Kicks go out every
+    `interval` seconds.
+    """
+    if state not in (None, BURIED, DELAYED):
+        raise ValueError('only buried or delayed jobs can be kicked')
+    states = [BURIED, DELAYED] if state is None else [state]
+    bulk = _Bulk(conns, tube, states, window, max_window, None, progress,
+                 loop)
+    conn = bulk.conns[0]
+    await conn.use(tube)
+    started = bulk.loop.time()
+    while total is None or bulk.done < total:
+        elapsed = bulk.loop.time() - started
+        if elapsed < ramp:
+            allowed = rate * elapsed * elapsed / (2 * ramp)
+        else:
+            allowed = rate * (elapsed - ramp / 2)
+        due = int(allowed) - bulk.done
+        if total is not None:
+            due = min(due, total - bulk.done)
+        stats = await conn.stats_tube(tube)
+        remaining = sum(stats['current-jobs-' + s] for s in states)
+        if not remaining:
+            break
+        if max_ready is not None:
+            due = min(due, max_ready - stats['current-jobs-ready'])
+        if due <= 0:
+            await asyncio.sleep(interval, loop=bulk.loop)
+            continue
+        if state is None:
+            bulk.done += await conn.kick(due)
+        else:
+            seeds, _ = await bulk.peek()
+            found = (await bulk.scan(seeds))[:due] if seeds else []
+            bulk.count(await bulk.run('kick-job', found))
+        await bulk.report(remaining)
+        await asyncio.sleep(interval, loop=bulk.loop)
+    stats = await conn.stats_tube(tube)
+    return await bulk.report(sum(stats['current-jobs-' + s] for s in states))
@@ -0,0 +1,300 @@
+"""
+Claim-check: big job bodies are kept out of beanstalkd, in a blob store,
+and the job only carries a reference to them::
+
+    claims = ClaimCheck(FileBlobStore('/mnt/shared/jobs'), threshold=65536)
+    conn = await create_connection(host, port, codec=claims)
+    await conn.put(big_body)  # written to the store, a reference is put
+
+    id, body = await conn.reserve()
+    data = await body.map()  # a memoryview of the blob, mapped in a thread
+    await conn.delete(id)  # deletes the blob too
+
+Producers and consumers have to share the store, e.g. through a network
+filesystem for :class:`FileBlobStore`.
+"""
+import asyncio
+import mmap
+import os
+import string
+import uuid
+from asyncio import CancelledError
+from collections import OrderedDict
+from functools import partial
+from aiobean.codec import CodecError
+from aiobean.connection import ConnectionClosedError, Pipeline
+from aiobean.log import logger
+from aiobean.protocol import CommandFailed
+
+REFERENCE = b'aiobean-claim:'
+DEFAULT_THRESHOLD = 2 ** 16
+# blob keys of jobs reserved or peeked, kept until they are deleted
+MAX_CLAIMS = 2 ** 16
+
+
+class FileBlobStore:
+    """
+    Blobs as files in `directory`, read through ``mmap``.
+
+    A blob store is any object with these three methods, all synchronous;
+    keys are ASCII strings.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        if not key or not all(c in string.hexdigits for c in key):
+            raise ValueError('invalid blob key {!r}'.format(key))
+        return os.path.join(self._directory, key)
+
+    def put(self, data):
+        """store `data` and return its key"""
+        key = uuid.uuid4().hex
+        path = self._path(key)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)  # never seen half written
+        return key
+
+    def open(self, key):
+        """a buffer of the blob's content"""
+        with open(self._path(key), 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return b''  # empty files cannot be mapped
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class LazyBody:
+    """
+    The body of a job whose content is in the blob store. Nothing is read
+    until :attr:`data` or :meth:`load` is used.
+    """
+
+    def __init__(self, store, key, codec=None):
+        self.key = key
+        self._store = store
+        self._codec = codec
+        self._buffer = None
+        self._view = None
+
+    @property
+    def data(self):
+        """the raw content, as a memoryview; blocks while mapping it"""
+        if self._view is None:
+            self._set_buffer(self._store.open(self.key))
+        return self._view
+
+    async def map(self, loop=None, executor=None):
+        """:attr:`data`, mapped in `executor` rather than on the loop"""
+        if self._view is None:
+            loop = loop or asyncio.get_event_loop()
+            buffer = await loop.run_in_executor(
+                executor, self._store.open, self.key)
+            if self._view is None:
+                self._set_buffer(buffer)
+            elif isinstance(buffer, mmap.mmap):
+                buffer.close()  # mapped meanwhile
+        return self._view
+
+    def _set_buffer(self, buffer):
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+
+    def load(self):
+        """the content decoded by the codec, or as bytes without one"""
+        if self._codec is None:
+            return bytes(self.data)
+        return self._codec.decode(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __bytes__(self):
+        return bytes(self.data)
+
+    def close(self):
+        """unmap the blob; it is mapped again if needed"""
+        if self._view is not None:
+            self._view.release()
+            if isinstance(self._buffer, mmap.mmap):
+                self._buffer.close()
+            self._view = self._buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __repr__(self):
+        return '<LazyBody {}>'.format(self.key)
+
+
+class ClaimCheck:
+    """
+    A connection codec putting bodies of `threshold` bytes or more in
+    `store`. With a :class:`~aiobean.codec.Codec` as `codec`, bodies are
+    encoded with it first, and :meth:`LazyBody.load` decodes them.
+
+    On a connection or a :class:`~aiobean.client.Client`, blobs are
+    written and deleted in `executor` (the loop's default one by
+    default), off the event loop; the ``put`` is queued when it is called
+    and written once its blob is stored, holding back the commands sent
+    after it, so commands keep their order. Pipelines, reconnecting
+    connections and blocking clients store the blob right away instead.
+    A blob whose put the server rejects is deleted. A put lost with its
+    connection may or may not have made a job, so its blob is kept and
+    logged.
+
+    Reserved and peeked jobs with a reference get a :class:`LazyBody`,
+    and the claim check remembers their blob keys, up to `max_claims` of
+    them. Deleting one of these jobs with ``delete`` removes its blob
+    once the server confirms it. Pipelined deletes do not; call
+    :meth:`discard` for those.
+    """
+
+    def __init__(self, store, threshold=DEFAULT_THRESHOLD, codec=None,
+                 executor=None, max_claims=MAX_CLAIMS):
+        self.store = store
+        self.threshold = threshold
+        self.codec = codec
+        self._executor = executor
+        self._max_claims = max_claims
+        self._claims = OrderedDict()  # id -> blob key
+
+    def encode(self, obj):
+        body = obj if self.codec is None else self.codec.encode(obj)
+        if len(body) < self.threshold:
+            return body
+        return REFERENCE + self.store.put(body).encode()
+
+    def decode(self, body):
+        if bytes(body[:len(REFERENCE)]) == REFERENCE:
+            key = bytes(body[len(REFERENCE):]).decode('ascii', 'replace')
+            return LazyBody(self.store, key, self.codec)
+        if self.codec is None:
+            return bytes(body)
+        return self.codec.decode(body)
+
+    def decode_job(self, id, body):
+        try:
+            body = self.decode(body)
+        except CodecError as e:
+            e.id = id
+            raise
+        if isinstance(body, LazyBody):
+            self._claims[id] = body.key
+            self._claims.move_to_end(id)
+            if len(self._claims) > self._max_claims:
+                self._claims.popitem(last=False)
+        return id, body
+
+    def put(self, conn, obj, pri, delay, ttr, deadline=None):
+        body = obj if self.codec is None else self.codec.encode(obj)
+        if len(body) < self.threshold:
+            return conn.execute('put', pri, delay, ttr, len(body), body=body,
+                                deadline=deadline)
+        if hasattr(conn, '_execute_later'):
+            # queued right away, so it keeps its place among the commands
+            # sent meanwhile, and written once the blob is stored
+            loop = conn._loop
+            upload = asyncio.ensure_future(
+                self._upload(body, pri, delay, ttr, loop), loop=loop)
+            fut = conn._execute_later('put', upload, deadline)
+            fut.add_done_callback(partial(self._put_done, upload, loop))
+            return fut
+        # pipelines need the index now, a blocking client waits anyway
+        key = self.store.put(body)
+        reference = REFERENCE + key.encode()
+        try:
+            return conn.execute('put', pri, delay, ttr, len(reference),
+                                body=reference, deadline=deadline)
+        except BaseException as e:
+            self._put_failed(key, e, isinstance(conn, Pipeline) or
+                             isinstance(e, ConnectionClosedError))
+            raise
+
+    async def _upload(self, body, pri, delay, ttr, loop):
+        """the arguments and body of the put of `body`, once stored"""
+        key = await loop.run_in_executor(self._executor, self.store.put, body)
+        reference = REFERENCE + key.encode()
+        return (pri, delay, ttr, len(reference)), reference
+
+    def _put_done(self, upload, loop, fut):
+        if not fut.cancelled() and fut.exception() is None:
+            return
+        if not upload.done():
+            # given up before the blob was stored: never sent
+            upload.add_done_callback(partial(self._stored, loop))
+            return
+        if upload.cancelled() or upload.exception() is not None:
+            return  # no blob
+        key = _key(upload.result()[1])
+        exc = CancelledError() if fut.cancelled() else fut.exception()
+        self._put_failed(key, exc, isinstance(exc, ConnectionClosedError),
+                         loop)
+
+    def _stored(self, loop, upload):
+        if not upload.cancelled() and upload.exception() is None:
+            self._remove(_key(upload.result()[1]), loop)
+
+    def _put_failed(self, key, exc, unsent, loop=None):
+        """delete the blob of a put that made no job"""
+        if unsent or isinstance(exc, CommandFailed) and \
+                exc.args != ('BURIED',):  # buried puts made a job
+            self._remove(key, loop)
+        else:
+            logger.warning('claim check: put lost with %r, keeping blob %s',
+                           exc, key)
+
+    def delete(self, conn, id, deadline=None):
+        if isinstance(conn, Pipeline):
+            return conn.execute('delete', id, deadline=deadline)
+        key = self._claims.get(id)
+        result = conn.execute('delete', id, deadline=deadline)
+        if key is not None:
+            del self._claims[id]
+            if isinstance(result, asyncio.Future):
+                result.add_done_callback(
+                    partial(self._deleted, key, conn._loop))
+            else:
+                self._store_delete(key)  # a blocking client: it is deleted
+        return result
+
+    def _deleted(self, key, loop, fut):
+        if not fut.cancelled() and fut.exception() is None:
+            self._remove(key, loop)
+
+    def _remove(self, key, loop=None):
+        """delete blob `key`, in the executor of `loop` if given"""
+        if loop is None:
+            self._store_delete(key)
+        else:
+            loop.run_in_executor(self._executor, self._store_delete, key)
+
+    def _store_delete(self, key):
+        try:
+            self.store.delete(key)
+        except Exception:
+            logger.exception('claim check: cannot delete blob %s', key)
+
+    def discard(self, body, loop=None):
+        """
+        delete the blob of `body`, a :class:`LazyBody`, in the executor of
+        `loop` if given
+        """
+        body.close()
+        self._remove(body.key, loop)
+
+
+def _key(reference):
+    return reference[len(REFERENCE):].decode()
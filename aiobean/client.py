@@ -0,0 +1,301 @@
+import asyncio
+from asyncio import CancelledError
+from collections import deque
+from functools import partial
+from aiobean.connection import ConnectionClosedError, create_connection
+from aiobean.log import logger
+from aiobean.protocol import PROTOCOL, CommandsMixin, InvalidCommand
+
+DEFAULT_TUBE = 'default'
+
+# commands on a job, which must go to the connection that reserved it
+JOB_COMMANDS = frozenset(['delete', 'release', 'bury', 'touch'])
+# commands changing the session of every connection
+SESSION_COMMANDS = frozenset(['use', 'watch', 'ignore'])
+
+
+async def create_client(host, port, shared=2, max_reserving=None,
+                        max_idle=2, loop=None, **kwargs):
+    """
+    Opens the `shared` connections; reserving ones are opened on demand.
+    Extra keyword arguments are passed on to `create_connection`.
+    """
+    if not loop:
+        loop = asyncio.get_event_loop()
+    client = Client(host, port, loop, max_reserving, max_idle, **kwargs)
+    try:
+        for _ in range(shared):
+            client._shared.append(await create_connection(
+                host, port, loop=loop, **kwargs))
+    except BaseException:
+        client.close()
+        raise
+    return client
+
+
+def _log_failure(fut):
+    if not fut.cancelled() and fut.exception() is not None:
+        logger.warning('client: session command failed: %r', fut.exception())
+
+
+async def _first(futs, loop):
+    return (await asyncio.gather(*futs, loop=loop))[0]
+
+
+class Client(CommandsMixin):
+    """
+    A connection that is really several, so a blocking ``reserve`` never
+    holds up other commands.
+
+    beanstalkd answers the commands of a connection in order, so a
+    ``reserve`` waiting for a job delays everything sent after it. The
+    client sends each blocking ``reserve`` (without a timeout, or with
+    one above zero) on a dedicated connection, opened when none is free,
+    up to `max_reserving`; beyond that reserves wait for a connection.
+    A dedicated connection is free again once its reserve returned and
+    the job it got is deleted, released or buried, which is sent on
+    that connection as beanstalkd requires. At most `max_idle` free ones
+    are kept open.
+
+    Every other command, ``reserve`` with a timeout of zero included, is
+    pipelined on the shared connection with the fewest commands in
+    flight. ``use`` is sent to all shared connections, ``watch`` and
+    ``ignore`` to all connections; a dedicated connection waiting on a
+    reserve applies them once it returns, and new ones get the tubes
+    watched.
+
+    A reserve cancelled or past its `deadline` closes its connection, as
+    it cannot be taken back; the server releases whatever job it
+    reserved.
+    """
+
+    def __init__(self, host, port, loop, max_reserving=None, max_idle=2,
+                 **kwargs):
+        self._address = (host, port)
+        self._loop = loop
+        self._conn_kwargs = kwargs
+        # bodies are encoded here and decoded by the connections
+        self.codec = kwargs.get('codec')
+        self._max_reserving = max_reserving
+        self._max_idle = max_idle
+        self._shared = []
+        self._dedicated = set()
+        self._connecting = 0
+        self._free = []  # dedicated connections with nothing to do
+        self._reserving = set()  # dedicated connections with a reserve out
+        self._held = {}  # dedicated connection -> ids of its jobs
+        self._owners = {}  # id -> the connection that reserved it
+        self._waiters = deque()
+        self._tube = DEFAULT_TUBE
+        self._watching = [DEFAULT_TUBE]
+        self._closed = False
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def reserving(self):
+        """number of dedicated connections open"""
+        return len(self._dedicated)
+
+    def execute(self, command, *args, body=None, deadline=None):
+        if self._closed:
+            raise ConnectionClosedError(
+                'cannot execute command because the connection is closed')
+        if command not in PROTOCOL:
+            raise InvalidCommand
+        if command == 'reserve' or \
+                command == 'reserve-with-timeout' and args[0] > 0:
+            return asyncio.ensure_future(
+                self._reserve(command, args, deadline), loop=self._loop)
+        if command in SESSION_COMMANDS:
+            return self._broadcast(command, args[0], deadline)
+        if command in JOB_COMMANDS:
+            conn = self._owners.get(args[0])
+            if conn is not None:
+                return self._ack(conn, command, args, deadline)
+        conn = self._pick()
+        fut = conn.execute(command, *args, body=body, deadline=deadline)
+        if command == 'reserve-with-timeout':
+            fut.add_done_callback(partial(self._reserved, conn))
+        return fut
+
+    def put_many(self, bodies, pri=CommandsMixin.DEFAULT_PRI, delay=0,
+                 ttr=CommandsMixin.DEFAULT_TTR):
+        """put all `bodies` in one write; resolves to a list of ids"""
+        return self._pick().put_many(bodies, pri, delay, ttr)
+
+    def _execute_later(self, command, ready, deadline=None):
+        if self._closed:
+            raise ConnectionClosedError(
+                'cannot execute command because the connection is closed')
+        return self._pick()._execute_later(command, ready, deadline)
+
+    def _pick(self):
+        conns = [conn for conn in self._shared if not conn.closed]
+        if not conns:
+            raise ConnectionClosedError('all shared connections are closed')
+        return min(conns, key=lambda conn: len(conn._queue))
+
+    def _reserved(self, conn, fut):
+        if fut.cancelled() or fut.exception() is not None:
+            return
+        job = fut.result()
+        if job is not None:  # None when the reserve timed out
+            self._owners[job.id] = conn
+            job.conn = self
+
+    def _ack(self, conn, command, args, deadline):
+        fut = conn.execute(command, *args, deadline=deadline)
+        if command != 'touch':
+            id = args[0]
+            del self._owners[id]
+            held = self._held.get(conn)  # None for shared connections
+            if held is not None:
+                held.discard(id)
+                if not held:
+                    fut.add_done_callback(lambda fut: self._settle(conn))
+        return fut
+
+    def _broadcast(self, command, tube, deadline):
+        # recorded first, so dedicated connections opened meanwhile agree
+        if command == 'use':
+            self._tube = tube
+        elif command == 'watch' and tube not in self._watching:
+            self._watching.append(tube)
+        elif command == 'ignore' and tube in self._watching:
+            self._watching.remove(tube)
+        futs = [conn.execute(command, tube, deadline=deadline)
+                for conn in self._shared if not conn.closed]
+        if command != 'use':
+            # not waited for: they may be stuck behind a reserve
+            for conn in self._dedicated:
+                conn.execute(command, tube).add_done_callback(_log_failure)
+        return asyncio.ensure_future(
+            _first(futs, self._loop), loop=self._loop)
+
+    def _session(self):
+        commands = [('watch', (tube,), None) for tube in self._watching
+                    if tube != DEFAULT_TUBE]
+        if DEFAULT_TUBE not in self._watching:
+            commands.append(('ignore', (DEFAULT_TUBE,), None))
+        return commands
+
+    async def _connect(self):
+        self._connecting += 1
+        try:
+            conn = await create_connection(
+                *self._address, loop=self._loop, **self._conn_kwargs)
+        finally:
+            self._connecting -= 1
+        if self._closed:
+            conn.close()
+            raise ConnectionClosedError('the client is closed')
+        self._dedicated.add(conn)
+        self._held[conn] = set()
+        logger.debug('client: %d dedicated connections', len(self._dedicated))
+        session = self._session()
+        if session:
+            try:
+                await asyncio.gather(
+                    *conn._execute_many(session), loop=self._loop)
+            except BaseException:
+                self._drop(conn)
+                raise
+        return conn
+
+    async def _acquire(self):
+        while True:
+            if self._closed:
+                raise ConnectionClosedError('the client is closed')
+            while self._free:
+                conn = self._free.pop()
+                if not conn.closed:
+                    return conn
+                self._drop(conn)
+            if self._max_reserving is None or \
+                    len(self._dedicated) + self._connecting < \
+                    self._max_reserving:
+                return await self._connect()
+            waiter = self._loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    self._wakeup()  # pass the wakeup on to someone else
+                else:
+                    waiter.cancel()
+                raise
+
+    def _wakeup(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    async def _reserve(self, command, args, deadline):
+        if deadline is not None:
+            deadline += self._loop.time()
+            conn = await asyncio.wait_for(
+                self._acquire(), deadline - self._loop.time(),
+                loop=self._loop)
+            deadline = max(0, deadline - self._loop.time())
+        else:
+            conn = await self._acquire()
+        self._reserving.add(conn)
+        try:
+            job = await conn.execute(command, *args, deadline=deadline)
+        except (CancelledError, asyncio.TimeoutError):
+            # the reserve is still out and nothing can take it back
+            self._drop(conn)
+            raise
+        except BaseException:
+            self._reserving.discard(conn)
+            self._settle(conn)
+            raise
+        self._reserving.discard(conn)
+        if job is None:  # timed out
+            self._settle(conn)
+            return None
+        self._owners[job.id] = conn
+        self._held[conn].add(job.id)
+        job.conn = self  # acks have to come back here
+        return job
+
+    def _settle(self, conn):
+        """put `conn` back with the free ones if it has nothing to do"""
+        if conn in self._reserving or self._held.get(conn):
+            return
+        if conn.closed or self._closed or \
+                len(self._free) >= self._max_idle:
+            self._drop(conn)
+        elif conn not in self._free:
+            self._free.append(conn)
+            self._wakeup()
+
+    def _drop(self, conn):
+        """close dedicated `conn` and forget its jobs"""
+        conn.close()
+        self._dedicated.discard(conn)
+        self._reserving.discard(conn)
+        if conn in self._free:
+            self._free.remove(conn)
+        for id in self._held.pop(conn, ()):
+            self._owners.pop(id, None)
+        self._wakeup()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        while self._waiters:
+            self._waiters.popleft().cancel()
+        for conn in self._shared + list(self._dedicated):
+            conn.close()
+
+    async def wait_closed(self):
+        for conn in self._shared + list(self._dedicated):
+            await conn.wait_closed()
@@ -0,0 +1,140 @@
+"""
+Job bodies carrying a 7 byte header that says how they were made::
+
+    MAGIC VERSION FORMAT PAYLOAD
+
+``MAGIC`` is 5 bytes, starting with a NUL so that text bodies put by
+other clients are not taken for encoded ones. ``FORMAT`` holds the
+serializer in its low 4 bits and the compression in the high ones, so a
+consumer decodes whatever a producer chose.
+"""
+import json
+import pickle
+import zlib
+from importlib.util import find_spec
+from aiobean.exc import BeanstalkException
+
+HAVE_MSGPACK = find_spec('msgpack') is not None
+
+MAGIC = b'\x00aiob'
+VERSION = 1
+_PREFIX = MAGIC + bytes([VERSION])
+HEADER_SIZE = len(_PREFIX) + 1
+RAW = 'raw'
+JSON = 'json'
+PICKLE = 'pickle'
+MSGPACK = 'msgpack'
+_SERIALIZERS = {RAW: 0, JSON: 1, PICKLE: 2, MSGPACK: 3}
+_NAMES = {value: key for key, value in _SERIALIZERS.items()}
+_ZLIB = 1 << 4
+_BYTES_LIKE = (bytes, bytearray, memoryview)
+
+
+class CodecError(BeanstalkException):
+    # id of the job that failed to decode, once known
+    id = None
+
+
+def _dumps(serializer, obj):
+    if serializer == RAW:
+        if not isinstance(obj, _BYTES_LIKE):
+            raise TypeError('raw job body must be a byte-like object')
+        return obj
+    if serializer == JSON:
+        return json.dumps(obj, separators=(',', ':')).encode()
+    if serializer == PICKLE:
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    import msgpack
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def _loads(serializer, data):
+    if serializer == RAW:
+        return bytes(data)
+    if serializer == JSON:
+        return json.loads(bytes(data).decode())
+    if serializer == PICKLE:
+        return pickle.loads(data)
+    import msgpack
+    return msgpack.unpackb(data, raw=False)
+
+
+class Codec:
+    """
+    Turns objects into job bodies and back::
+
+        codec = Codec('json', compress_threshold=1024)
+        conn = await create_connection(host, port, codec=codec)
+        await conn.put({'user': 42})
+        id, job = await conn.reserve()  # job == {'user': 42}
+
+    `serializer` is one of ``'raw'`` (bytes as they are), ``'json'``,
+    ``'pickle'`` or ``'msgpack'`` (needs the msgpack package). Payloads of
+    `compress_threshold` bytes or more are zlib compressed at `level`,
+    unless that does not make them smaller.
+
+    Decoding follows the header, so any codec reads bodies written with
+    any other. Bodies without the header are returned as bytes; those
+    with the magic but another version raise :class:`CodecError`. Only
+    use pickle between services that trust each other.
+    """
+
+    def __init__(self, serializer=JSON, compress_threshold=1024, level=6):
+        if serializer not in _SERIALIZERS:
+            raise ValueError('unknown serializer {!r}'.format(serializer))
+        if serializer == MSGPACK and not HAVE_MSGPACK:
+            raise ValueError('msgpack is not installed')
+        self.serializer = serializer
+        self.compress_threshold = compress_threshold
+        self.level = level
+        self._header = _PREFIX + bytes([_SERIALIZERS[serializer]])
+        self._zlib_header = _PREFIX + bytes(
+            [_SERIALIZERS[serializer] | _ZLIB])
+
+    def encode(self, obj):
+        payload = _dumps(self.serializer, obj)
+        if self.compress_threshold is not None and \
+                len(payload) >= self.compress_threshold:
+            compressed = zlib.compress(payload, self.level)
+            if len(compressed) < len(payload):
+                return self._zlib_header + compressed
+        return self._header + payload
+
+    def decode(self, body):
+        if len(body) < HEADER_SIZE or body[:len(MAGIC)] != MAGIC:
+            return bytes(body)
+        if body[len(MAGIC)] != VERSION:
+            raise CodecError('unknown codec version {}'.format(
+                body[len(MAGIC)]))
+        format = body[HEADER_SIZE - 1]
+        serializer = _NAMES.get(format & 0x0f)
+        if serializer is None or format & ~(0x0f | _ZLIB):
+            raise CodecError('unknown body format {:#x}'.format(format))
+        payload = memoryview(body)[HEADER_SIZE:]
+        try:
+            if format & _ZLIB:
+                payload = zlib.decompress(payload)
+            return _loads(serializer, payload)
+        except Exception as e:
+            raise CodecError('cannot decode a {} body: {!r}'.format(
+                serializer, e)) from e
+
+    # the hooks connections call
+
+    def put(self, conn, obj, pri, delay, ttr, deadline=None):
+        """send ``put`` for `obj`, encoded, over `conn`"""
+        body = self.encode(obj)
+        return conn.execute('put', pri, delay, ttr, len(body), body=body,
+                            deadline=deadline)
+
+    def decode_job(self, id, body):
+        """(id, body) of a reserved or peeked job, with `body` decoded"""
+        try:
+            return id, self.decode(body)
+        except CodecError as e:
+            e.id = id  # the job may be reserved, and has to be dealt with
+            raise
+
+    def delete(self, conn, id, deadline=None):
+        """send ``delete`` for job `id` over `conn`"""
+        return conn.execute('delete', id, deadline=deadline)
@@ -1,31 +1,101 @@
 import asyncio
-from asyncio import CancelledError, IncompleteReadError
+import logging
+from asyncio import CancelledError
+from asyncio.streams import FlowControlMixin
 from collections import deque
 from aiobean.exc import BeanstalkException
 from aiobean.log import logger
 from aiobean.protocol import (
-    CommandsMixin, encode_command, handle_head, handle_response
+    DEFAULT_BUFFER_SIZE, ENCODERS, PROTOCOL, CommandsMixin, InvalidCommand,
+    ProtocolParser, handle_response,
 )
 
 
+# asyncio.BufferedProtocol is new in python 3.7; older versions fall back to
+# copying each chunk from data_received into the same buffer
+BUFFERED_PROTOCOL = hasattr(asyncio, 'BufferedProtocol')
+_BufferedProtocol = getattr(asyncio, 'BufferedProtocol', asyncio.Protocol)
+
+
+# commands responding with a job body
+BODY_COMMANDS = frozenset([
+    'reserve', 'reserve-with-timeout', 'peek', 'peek-ready', 'peek-delayed',
+    'peek-buried',
+])
+
+
 class ConnectionClosedError(BeanstalkException):
     pass
 
 
-async def create_connection(host, port, loop=None):
+def _expire(waiter, command):
+    if not waiter.done():
+        waiter.set_exception(asyncio.TimeoutError(
+            'no response to {} before the deadline'.format(command)))
+
+
+def _set_deadline(loop, waiter, command, deadline):
+    """fail `waiter` with ``asyncio.TimeoutError`` after `deadline` seconds"""
+    timer = loop.call_later(deadline, _expire, waiter, command)
+    waiter.add_done_callback(lambda waiter: timer.cancel())
+
+
+async def create_connection(host, port, loop=None, buffered=False, **kwargs):
+    """
+    With `buffered`, responses are parsed by :class:`ResponseProtocol`
+    instead of an ``asyncio.StreamReader``.
+    """
     if not loop:
         loop = asyncio.get_event_loop()
+    if buffered:
+        metrics = kwargs.get('metrics')
+        transport, protocol = await loop.create_connection(
+            lambda: ResponseProtocol(loop, metrics=metrics), host, port)
+        writer = asyncio.StreamWriter(transport, protocol, None, loop)
+        return BufferedConnection(protocol, writer, loop, **kwargs)
     reader, writer = await asyncio.open_connection(host, port, loop=loop)
-    return Connection(reader, writer, loop)
+    return Connection(reader, writer, loop, **kwargs)
 
 
 class Connection(CommandsMixin):
+    """
+    Commands are pipelined: :meth:`execute` writes right away and returns a
+    future of the response, so it never waits for anything.
+
+    For flow control, pass `max_inflight` (how many commands may wait for
+    a response) and/or `write_limit` (high-water mark of the write buffer,
+    in bytes) and send through :meth:`send`, which suspends until the
+    connection is below both limits.
+
+    `metrics` is told about every command sent and response received,
+    see :class:`~aiobean.metrics.Metrics`.
+
+    With a :class:`~aiobean.codec.Codec` as `codec`, ``put`` takes any
+    object the codec can encode, and reserved or peeked job bodies are
+    decoded.
 
-    def __init__(self, reader, writer, loop):
+    A command whose future is cancelled or misses its `deadline` still
+    gets its response, which is dropped. A job reserved that way is
+    released with its priority, so it does not wait for its TTR.
+    """
+
+    def __init__(self, reader, writer, loop, max_inflight=None,
+                 write_limit=None, metrics=None, codec=None):
         self._reader = reader
         self._writer = writer
         self._loop = loop
         self._queue = deque()
+        self._metrics = metrics
+        self._sent_at = deque()  # only used with metrics
+        self.codec = codec
+        self._max_inflight = max_inflight
+        self._writable_waiters = deque()
+        self._draining = None  # the drain every blocked writer waits on
+        # commands queued by _execute_later and not written yet: (command,
+        # waiter, ready, parts written after it)
+        self._holds = deque()
+        if write_limit is not None:
+            writer.transport.set_write_buffer_limits(high=write_limit)
         self._close_waiter = loop.create_future()
         self._read_task = asyncio.ensure_future(
             self._read_loop(), loop=loop)
@@ -59,53 +129,436 @@ class Connection(CommandsMixin):
         self._writer = None
         self._closing = False
         self._closed = True
+        if self._metrics is not None:
+            self._metrics.connection_closed(len(self._queue))
+            self._sent_at.clear()
+        while self._holds:
+            _, waiter, _, _ = self._holds.popleft()
+            if not waiter.done():
+                waiter.set_exception(ConnectionClosedError(
+                    'the connection closed before the command was sent'))
         while self._queue:
             command, waiter = self._queue.popleft()
+            if waiter.done():
+                continue
             logger.debug('cancelling waiter %r', (command, waiter))
             if exc is None:
                 waiter.cancel()
             else:
                 waiter.set_exception(exc)
+        while self._writable_waiters:
+            waiter = self._writable_waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(
+                    ConnectionClosedError('the connection is closed'))
 
     async def wait_closed(self):
         return await asyncio.shield(self._close_waiter, loop=self._loop)
 
-    def execute(self, command, *args, body=None):
+    def execute(self, command, *args, body=None, deadline=None):
         if self.closed:
             raise ConnectionClosedError(
                 'cannot execute command because the connection is closed')
+        try:
+            encode = ENCODERS[command]
+        except KeyError:
+            raise InvalidCommand
+        parts = encode(*args, body=body)
         waiter = self._loop.create_future()
+        if deadline is not None:
+            _set_deadline(self._loop, waiter, command, deadline)
         self._queue.append((command, waiter))
-        for part in encode_command(command, *args, body=body):
-            self._writer.write(part)
-            logger.debug('scheduled to write %s', part[:30])
+        self._write(parts)
+        if self._metrics is not None:
+            self._sent_at.append(self._loop.time())
+            self._metrics.command_sent(command, sum(map(len, parts)))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('scheduled to write %s', parts[0][:30])
         return waiter
 
+    def _execute_later(self, command, ready, deadline=None):
+        """
+        Queue `command` now, and write it once the future `ready` gives
+        its ``(args, body)``; the commands executed meanwhile are written
+        after it. It is not written if `ready` fails, which fails it too,
+        or if it is cancelled or misses its `deadline` meanwhile; the
+        connection closing first fails it with
+        :class:`ConnectionClosedError`.
+        """
+        if self.closed:
+            raise ConnectionClosedError(
+                'cannot execute command because the connection is closed')
+        if command not in ENCODERS:
+            raise InvalidCommand
+        waiter = self._loop.create_future()
+        if deadline is not None:
+            _set_deadline(self._loop, waiter, command, deadline)
+        self._queue.append((command, waiter))
+        if self._metrics is not None:
+            self._sent_at.append(self._loop.time())
+        self._holds.append((command, waiter, ready, []))
+        ready.add_done_callback(self._release_holds)
+        return waiter
+
+    def _write(self, parts):
+        if self._holds:
+            self._holds[-1][3].extend(parts)  # kept in order behind it
+        else:
+            self._writer.writelines(parts)
+
+    def _release_holds(self, fut=None):
+        while self._holds and self._holds[0][2].done():
+            command, waiter, ready, after = self._holds.popleft()
+            parts = []
+            if not waiter.done():
+                try:
+                    args, body = ready.result()
+                    parts = ENCODERS[command](*args, body=body)
+                except BaseException as e:
+                    if isinstance(e, CancelledError):
+                        waiter.cancel()
+                    else:
+                        waiter.set_exception(e)
+            if parts:
+                if self._metrics is not None:
+                    self._metrics.command_sent(command, sum(map(len, parts)))
+            else:
+                self._unqueue(waiter)
+            self._writer.writelines(parts + after)
+
+    def _unqueue(self, waiter):
+        """forget the command of `waiter`, which was never written"""
+        for index, (_, queued) in enumerate(self._queue):
+            if queued is waiter:
+                del self._queue[index]
+                if self._metrics is not None:
+                    del self._sent_at[index]
+                return
+
+    def _room(self):
+        """how many more commands can be sent before `max_inflight`"""
+        if self._max_inflight is None:
+            return None
+        return self._max_inflight - len(self._queue)
+
+    async def wait_writable(self):
+        """
+        Suspends while `max_inflight` commands are waiting for responses or
+        the write buffer is above its high-water mark. Both are checked
+        again after every wakeup, and nothing is awaited once they pass,
+        so the caller can write right away.
+        """
+        while True:
+            if self.closed:
+                raise ConnectionClosedError('the connection is closed')
+            room = self._room()
+            if room is not None and room <= 0:
+                await self._wait_room()
+            elif self._buffer_full():
+                await self._drain()
+            else:
+                return
+
+    async def _wait_room(self):
+        waiter = self._loop.create_future()
+        self._writable_waiters.append(waiter)
+        try:
+            await waiter
+        except CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._wakeup_writer()  # pass the slot on
+            raise
+
+    def _buffer_full(self):
+        transport = self._writer.transport
+        return transport.get_write_buffer_size() > \
+            transport.get_write_buffer_limits()[1]
+
+    async def _drain(self):
+        # before python 3.10, the stream protocol takes a single drain
+        # waiter, so all blocked writers share one drain
+        if self._draining is None:
+            self._draining = asyncio.ensure_future(
+                self._writer.drain(), loop=self._loop)
+            self._draining.add_done_callback(self._drained)
+        await asyncio.shield(self._draining, loop=self._loop)
+
+    def _drained(self, fut):
+        self._draining = None
+        if not fut.cancelled():
+            fut.exception()  # retrieved: the writers waiting get it
+
+    def _wakeup_writer(self):
+        while self._writable_waiters:
+            waiter = self._writable_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    async def send(self, command, *args, body=None):
+        """like :meth:`execute`, but waits for the connection to be writable"""
+        await self.wait_writable()
+        return await self.execute(command, *args, body=body)
+
+    def pipeline(self):
+        return Pipeline(self)
+
+    def put_many(self, bodies, pri=CommandsMixin.DEFAULT_PRI, delay=0,
+                 ttr=CommandsMixin.DEFAULT_TTR):
+        """put all `bodies` in one write; resolves to a list of ids"""
+        pipe = self.pipeline()
+        for body in bodies:
+            pipe.put(body, pri, delay, ttr)
+        return pipe.send()
+
+    def delete_many(self, ids):
+        pipe = self.pipeline()
+        for id in ids:
+            pipe.delete(id)
+        return pipe.send()
+
+    def _execute_many(self, commands):
+        """
+        Write a batch of ``(command, args, body)`` with a single
+        ``writelines`` and return the waiters, in order.
+        """
+        if self.closed:
+            raise ConnectionClosedError(
+                'cannot execute command because the connection is closed')
+        parts = []
+        waiters = []
+        sizes = []
+        metrics = self._metrics
+        create_future = self._loop.create_future
+        for command, args, body in commands:
+            encoded = ENCODERS[command](*args, body=body)
+            parts.extend(encoded)
+            waiters.append(create_future())
+            if metrics is not None:
+                sizes.append(sum(map(len, encoded)))
+        # only register waiters once the whole batch encoded fine
+        self._queue.extend(
+            (command[0], waiter) for command, waiter in zip(commands, waiters))
+        self._write(parts)
+        if metrics is not None:
+            now = self._loop.time()
+            for (command, _, _), size in zip(commands, sizes):
+                self._sent_at.append(now)
+                metrics.command_sent(command, size)
+        logger.debug('scheduled to write %d commands', len(commands))
+        return waiters
+
+    def _handle_response(self, status, headers, body):
+        command, waiter = self._queue.popleft()
+        if self._metrics is not None:
+            self._metrics.response_received(
+                command, status, status == PROTOCOL[command][0],
+                self._loop.time() - self._sent_at.popleft())
+        if waiter.done():
+            # cancelled or past its deadline: nobody wants the response
+            self._drop_response(command, status, headers)
+        else:
+            self._resolve(command, waiter, status, headers, body)
+        if self._writable_waiters:
+            self._wakeup_writer()
+
+    def _resolve(self, command, waiter, status, headers, body):
+        try:
+            result = handle_response(command, status, headers, body)
+            if result is not None and command in BODY_COMMANDS:
+                result.conn = self
+                if self.codec is not None:
+                    result.id, result.body = self.codec.decode_job(
+                        result.id, result.body)
+        except Exception as e:
+            waiter.set_exception(e)
+        else:
+            waiter.set_result(result)
+
+    def _drop_response(self, command, status, headers):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('dropping the late response to %s', command)
+        if status == b'RESERVED':
+            self._abandon(int(headers[0]))
+
+    def _abandon(self, id):
+        """
+        Release job `id`, reserved by this connection but wanted by
+        nobody, with the priority it had.
+        """
+        return asyncio.ensure_future(self._release_orphan(id), loop=self._loop)
+
+    async def _release_orphan(self, id):
+        try:
+            stats = await self.execute('stats-job', id)
+            await self.execute('release', id, stats['pri'], 0)
+        except (BeanstalkException, CancelledError):
+            # the connection closed, and the server released the job
+            return
+        logger.info('released job %s, reserved after its waiter left', id)
+
     async def _read_loop(self):
         exc = None
+        parser = ProtocolParser()
         try:
             while not self._reader.at_eof():
-                head = await self._reader.readline()
-                logger.debug('read: head %s', head)
-                if head == b'' or self._reader.at_eof():
+                data = await self._reader.read(DEFAULT_BUFFER_SIZE)
+                if not data:
                     break
-                status, headers, body_len = handle_head(head)
-                if body_len:
-                    body = await self._reader.readexactly(body_len)
-                    await self._reader.readexactly(2)  # crlf
-                    logger.debug('read: body %s', body[:30])
-                else:
-                    body = None
-                # handler response
-                try:
-                    command, waiter = self._queue.popleft()
-                    result = handle_response(command, status, headers, body)
-                except Exception as e:
-                    waiter.set_exception(e)
-                else:
-                    waiter.set_result(result)
+                if self._metrics is not None:
+                    self._metrics.data_received(len(data))
+                debug = logger.isEnabledFor(logging.DEBUG)
+                for status, headers, body in parser.feed(data):
+                    if debug:
+                        logger.debug('read: %s %s', status, headers)
+                    self._handle_response(status, headers, body)
         except Exception as e:
-            if not isinstance(e, (CancelledError, IncompleteReadError)):
+            if not isinstance(e, CancelledError):
                 exc = e
         self._closing = True
         self._do_close(exc)
+
+
+class ResponseProtocol(FlowControlMixin, _BufferedProtocol):
+    """
+    Receives responses straight into the buffer of a
+    :class:`~aiobean.protocol.ProtocolParser` and hands every complete
+    response to the connection synchronously from ``buffer_updated``.
+    """
+
+    def __init__(self, loop, buffer_size=DEFAULT_BUFFER_SIZE, metrics=None):
+        super().__init__(loop=loop)
+        self._parser = ProtocolParser(buffer_size)
+        self._metrics = metrics
+        self._handler = None
+        self._eof = False
+        self._lost = loop.create_future()
+        self.transport = None
+
+    def connection_made(self, transport):
+        # closed from here when a response cannot be handled
+        self.transport = transport
+
+    def set_handler(self, handler):
+        """`handler(status, headers, body)` is called for every response"""
+        self._handler = handler
+
+    def at_eof(self):
+        return self._eof
+
+    def wait_lost(self):
+        """a future of the exception the connection was lost with, if any"""
+        return self._lost
+
+    def _lose(self, exc):
+        self._eof = True
+        if not self._lost.done():
+            self._lost.set_result(exc)
+
+    def eof_received(self):
+        self._eof = True
+
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        self._lose(exc)
+
+    def get_buffer(self, sizehint):
+        return self._parser.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        if self._metrics is not None:
+            self._metrics.data_received(nbytes)
+        try:
+            for response in self._parser.buffer_updated(nbytes):
+                self._handler(*response)
+        except Exception as e:
+            logger.exception('failed to handle a response')
+            self._lose(e)
+            self.transport.close()
+
+    def data_received(self, data):
+        # only called on python < 3.7
+        if self._metrics is not None:
+            self._metrics.data_received(len(data))
+        try:
+            for response in self._parser.feed(data):
+                self._handler(*response)
+        except Exception as e:
+            logger.exception('failed to handle a response')
+            self._lose(e)
+            self.transport.close()
+
+
+class BufferedConnection(Connection):
+    """A :class:`Connection` reading through :class:`ResponseProtocol`."""
+
+    def __init__(self, protocol, writer, loop, **kwargs):
+        protocol.set_handler(self._handle_response)
+        super().__init__(protocol, writer, loop, **kwargs)
+
+    async def _read_loop(self):
+        try:
+            exc = await self._reader.wait_lost()
+        except CancelledError:
+            exc = None
+        self._closing = True
+        self._do_close(exc)
+
+
+class Pipeline(CommandsMixin):
+    """
+    Collects commands and sends them to the server in one write::
+
+        pipe = conn.pipeline()
+        for body in bodies:
+            pipe.put(body)
+        ids = await pipe.send()
+
+    Every command method returns the position of its result in the list
+    :meth:`send` resolves to. A command that fails has its exception
+    at that position instead of raising, a :class:`ConnectionClosedError`
+    for one left without a response by the connection closing.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._commands = []
+        self.codec = conn.codec
+
+    def __len__(self):
+        return len(self._commands)
+
+    def execute(self, command, *args, body=None, deadline=None):
+        if command not in PROTOCOL:
+            raise InvalidCommand
+        if deadline is not None:
+            raise ValueError('pipelined commands have no deadline of their '
+                             'own; put one around send()')
+        self._commands.append((command, args, body))
+        return len(self._commands) - 1
+
+    async def send(self):
+        commands, self._commands = self._commands, []
+        if not commands:
+            return []
+        conn = self._conn
+        waiters = []
+        while len(waiters) < len(commands):
+            # with `max_inflight` set, write the batch in chunks that fit
+            await conn.wait_writable()
+            start = len(waiters)
+            room = conn._room()
+            end = len(commands) if room is None else start + room
+            waiters.extend(conn._execute_many(commands[start:end]))
+        # not just the last one: over a reconnecting connection, commands
+        # lost with the connection fail right away or are sent again later
+        await asyncio.wait(waiters, loop=conn._loop)
+        return [_outcome(waiter) for waiter in waiters]
+
+
+def _outcome(waiter):
+    """the result or exception of a pipelined command"""
+    if waiter.cancelled():  # by close
+        return ConnectionClosedError(
+            'the connection closed before the response arrived')
+    return waiter.exception() or waiter.result()
@@ -0,0 +1,507 @@
+"""
+Puts from many processes over one connection: producers write their jobs
+into shared memory, and a single :class:`Funnel` sends them on, pipelined,
+and writes the ids back::
+
+    # in one process per host
+    funnel = Funnel(conn, '/dev/shm/aiobean-funnel', loop=loop)
+    funnel.start()
+
+    # in each of the others, e.g. pre-forked web workers
+    producer = FunnelProducer('/dev/shm/aiobean-funnel')
+    id = producer.put(b'hi', tube='emails')
+
+or as a process of its own::
+
+    python -m aiobean.funnel -H 127.0.0.1 -p 11300 --path /dev/shm/funnel
+
+The memory is a file mapped by every process, with a slot per producer:
+a ring of put requests written by the producer alone, and a ring of
+responses written by the funnel alone. Each side only ever moves its own
+counters, so no lock is needed; a producer claims its slot with a lock
+on a byte of the file, which goes away with the process.
+
+The funnel holds a lock too, and the header names it. A funnel started
+again on the file of one that died carries on with the same slots, so
+producers stay attached; one that stops cleanly marks the file closed,
+which producers notice.
+"""
+import argparse
+import asyncio
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import time
+from asyncio import CancelledError
+from aiobean.connection import create_connection
+from aiobean.exc import BeanstalkException
+from aiobean.log import logger
+from aiobean.protocol import CommandFailed, CommandsMixin
+
+MAGIC = b'aiobfnl2'
+# magic, producers, ring size, responses per slot; then the generation,
+# counting funnels started on the file, and the pid of the funnel, 0 once
+# it closed
+HEADER = struct.Struct('<8sIII')
+OWNER = struct.Struct('<QI')
+OWNER_OFFSET = HEADER.size
+HEADER_SIZE = 64
+# the byte the funnel locks, far from the producers' slot bytes
+OWNER_LOCK = 2 ** 48
+# producer owned: bytes and requests published; funnel owned: bytes read,
+# responses written and requests read
+COUNTERS = struct.Struct('<QQQQQ')
+SLOT_HEADER_SIZE = 64
+# length, pri, delay, ttr, length of the tube name; then tube and body
+REQUEST = struct.Struct('<IQIIH')
+WRAP = 0xffffffff  # the rest of the ring is unused, start over at 0
+# status and id
+RESPONSE = struct.Struct('<qq')
+# statuses other than 0 (inserted), by index
+ERRORS = (None, 'BURIED', 'EXPECTED_CRLF', 'JOB_TOO_BIG', 'DRAINING')
+ERROR_OTHER = len(ERRORS)
+# taken by a funnel that stopped before answering
+ERROR_LOST = ERROR_OTHER + 1
+# seconds a producer waits for room or a response by default
+DEFAULT_TIMEOUT = 60
+
+DEFAULT_PATH = os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+    'aiobean-funnel')
+
+# (path, slot) taken in this process, slot None for a funnel: its locks do
+# not exclude each other
+_claimed = set()
+
+
+class FunnelError(BeanstalkException):
+    pass
+
+
+def _align(size):
+    return (size + 7) & ~7
+
+
+def _layout(producers, ring_size, responses):
+    slot_size = SLOT_HEADER_SIZE + ring_size + responses * RESPONSE.size
+    return slot_size, HEADER_SIZE + producers * slot_size
+
+
+class Funnel:
+    """
+    Sends the puts of up to `producers` :class:`FunnelProducer` over
+    `conn`, creating the shared file at `path`.
+
+    Every round, it takes all the requests waiting in every slot and
+    sends them in one pipeline, switching tubes with ``use`` only when
+    consecutive jobs need it. `ring_size` bytes of requests and
+    `responses` requests may be waiting per producer; while idle, slots
+    are polled up to every `poll_interval` seconds.
+
+    Only one funnel may run on a file. The file of a funnel that died is
+    taken over as it is if the layout matches: requests it had taken but
+    not answered fail with :class:`FunnelError`, and the others are sent.
+    Otherwise it is marked closed and replaced.
+
+    Bodies are sent as they are: give `conn` no codec, producers encode.
+    """
+
+    def __init__(self, conn, path=DEFAULT_PATH, producers=64,
+                 ring_size=2 ** 16, responses=256, poll_interval=0.001,
+                 loop=None):
+        if ring_size % 8:
+            raise ValueError('ring_size must be a multiple of 8')
+        self.path = path
+        self._conn = conn
+        self._producers = producers
+        self._ring_size = ring_size
+        self._responses = responses
+        self._poll_interval = poll_interval
+        self._loop = loop or asyncio.get_event_loop()
+        self._slot_size, size = _layout(producers, ring_size, responses)
+        self._key = (os.path.realpath(path), None)
+        if self._key in _claimed:
+            raise FunnelError('a funnel already runs on {}'.format(path))
+        header = (MAGIC, producers, ring_size, responses)
+        self._fd, self._map = self._open(path, size, header)
+        _claimed.add(self._key)
+        generation, _ = OWNER.unpack_from(self._map, OWNER_OFFSET)
+        self.generation = generation + 1
+        OWNER.pack_into(self._map, OWNER_OFFSET, self.generation, os.getpid())
+        if generation:
+            logger.info('funnel: taking over %s', path)
+            for slot in range(producers):
+                self._fail_lost(slot)
+        self._tube = None  # unknown until the first use
+        self._task = None
+        self._closing = False
+
+    @staticmethod
+    def _open(path, size, header):
+        """the locked descriptor and map of the file, created as needed"""
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                try:
+                    fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1,
+                                OWNER_LOCK)
+                except OSError:
+                    raise FunnelError(
+                        'a funnel already runs on {}'.format(path))
+                stat = os.fstat(fd)
+                if stat.st_nlink == 0:
+                    continue  # replaced meanwhile
+                if stat.st_size == 0:
+                    os.ftruncate(fd, size)
+                    data = mmap.mmap(fd, size)
+                    HEADER.pack_into(data, 0, *header)
+                    fd, owned = None, fd
+                    return owned, data
+                data = mmap.mmap(fd, stat.st_size)
+                if stat.st_size == size and \
+                        HEADER.unpack_from(data, 0) == header:
+                    fd, owned = None, fd
+                    return owned, data
+                # not ours to reuse: tell whoever still maps it, and start
+                # over on a new file
+                if stat.st_size >= HEADER_SIZE and \
+                        data[:len(MAGIC)] == MAGIC:
+                    generation, _ = OWNER.unpack_from(data, OWNER_OFFSET)
+                    OWNER.pack_into(data, OWNER_OFFSET, generation, 0)
+                data.close()
+                os.unlink(path)
+            finally:
+                if fd is not None:
+                    os.close(fd)
+
+    def _fail_lost(self, slot):
+        """answer the requests a funnel that died took but did not send"""
+        base = HEADER_SIZE + slot * self._slot_size
+        _, _, _, written, read = COUNTERS.unpack_from(self._map, base)
+        for _ in range(read - written):
+            self._respond(slot, None)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run(), loop=self._loop)
+
+    def close(self):
+        """stop taking requests and remove the file"""
+        self._closing = True
+        if self._task is not None:
+            self._task.cancel()
+
+    async def wait_closed(self):
+        if self._task is not None:
+            await asyncio.wait([self._task], loop=self._loop)
+        if not self._map.closed:
+            # producers still attached stop waiting
+            OWNER.pack_into(self._map, OWNER_OFFSET, self.generation, 0)
+            self._map.close()
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            os.close(self._fd)
+            _claimed.discard(self._key)
+
+    async def _run(self):
+        idle = 0
+        while not self._closing:
+            batch = []
+            for slot in range(self._producers):
+                self._collect(slot, batch)
+            if not batch:
+                idle = min(idle + 1, 10)
+                await asyncio.sleep(
+                    min(self._poll_interval, 1e-5 * 2 ** idle),
+                    loop=self._loop)
+                continue
+            idle = 0
+            results = await self._send(batch)
+            for (slot, _, _, _, _, _), result in zip(batch, results):
+                self._respond(slot, result)
+
+    def _collect(self, slot, batch):
+        base = HEADER_SIZE + slot * self._slot_size
+        ring = base + SLOT_HEADER_SIZE
+        head, _, tail, _, read = COUNTERS.unpack_from(self._map, base)
+        if tail == head:
+            return
+        data = self._map
+        while tail < head:
+            pos = tail % self._ring_size
+            if struct.unpack_from('<I', data, ring + pos)[0] == WRAP:
+                tail += self._ring_size - pos
+                continue
+            length, pri, delay, ttr, tube_size = \
+                REQUEST.unpack_from(data, ring + pos)
+            start = ring + pos + REQUEST.size
+            tube = data[start:start + tube_size].decode()
+            body = data[start + tube_size:ring + pos + length]
+            batch.append((slot, tube, pri, delay, ttr, body))
+            tail += _align(length)
+            read += 1
+        # the ring space is free again once the bodies are copied
+        struct.pack_into('<Q', data, base + 16, tail)
+        struct.pack_into('<Q', data, base + 32, read)
+
+    async def _send(self, batch):
+        pipe = self._conn.pipeline()
+        puts = []
+        for _, tube, pri, delay, ttr, body in batch:
+            if tube != self._tube:
+                pipe.use(tube)
+                self._tube = tube
+            puts.append(pipe.put(body, pri, delay, ttr))
+        try:
+            results = await pipe.send()
+        except (Exception, CancelledError) as e:
+            if self._closing:
+                raise
+            logger.error('funnel: cannot send %d puts: %r', len(batch), e)
+            self._tube = None
+            return [e] * len(batch)
+        return [results[index] for index in puts]
+
+    def _respond(self, slot, result):
+        base = HEADER_SIZE + slot * self._slot_size
+        responses = base + SLOT_HEADER_SIZE + self._ring_size
+        count = struct.unpack_from('<Q', self._map, base + 24)[0]
+        if result is None:
+            status, id = ERROR_LOST, 0
+        elif isinstance(result, int):
+            status, id = 0, result
+        elif isinstance(result, CommandFailed) and result.args and \
+                result.args[0] in ERRORS:
+            status, id = ERRORS.index(result.args[0]), 0
+        else:
+            status, id = ERROR_OTHER, 0
+        RESPONSE.pack_into(
+            self._map, responses + count % self._responses * RESPONSE.size,
+            status, id)
+        # published after the response itself
+        struct.pack_into('<Q', self._map, base + 24, count + 1)
+
+
+class FunnelProducer:
+    """
+    The producing side of a :class:`Funnel`, for one process.
+
+    It takes the first free slot, or `slot`. :meth:`put` blocks until the
+    funnel returns the id; `timeout` bounds the wait for room in the
+    ring and for the response, raising :class:`FunnelError`, as does the
+    funnel closing meanwhile. A funnel that dies is waited for, up to
+    `timeout`, to be started again.
+
+    Create it after forking, as locks are not inherited, and use one per
+    process: a process closing any of its producers drops the locks of
+    all of them. It is not thread-safe.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, slot=None, poll_interval=0.001):
+        self._poll_interval = poll_interval
+        # the slot locks are held by this descriptor until it is closed
+        self._path = os.path.realpath(path)
+        self.slot = None
+        self._fd = os.open(path, os.O_RDWR)
+        try:
+            self._map = mmap.mmap(self._fd, 0)
+            magic, producers, self._ring_size, self._responses = \
+                HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC:
+                raise FunnelError('{} is not a funnel'.format(path))
+            if self._closed():
+                raise FunnelError('the funnel on {} is closed'.format(path))
+            self._slot_size, _ = _layout(
+                producers, self._ring_size, self._responses)
+            slots = range(producers) if slot is None else [slot]
+            for index in slots:
+                if self._lock(index):
+                    self.slot = index
+                    break
+            else:
+                raise FunnelError('no free producer slot')
+        except BaseException:
+            os.close(self._fd)
+            raise
+        self._base = HEADER_SIZE + self.slot * self._slot_size
+        self._ring = self._base + SLOT_HEADER_SIZE
+        # requests a previous owner left are still answered, to nobody
+        self._head, self._count, _, _, _ = COUNTERS.unpack_from(
+            self._map, self._base)
+        self._read = self._count  # responses copied into _answers
+        self._answers = {}  # seq -> (status, id)
+        self._abandoned = set()  # seqs timed out waiting for an answer
+
+    def _lock(self, slot):
+        if (self._path, slot) in _claimed:
+            return False
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, slot)
+        except OSError:
+            return False
+        _claimed.add((self._path, slot))
+        return True
+
+    def _counter(self, offset):
+        return struct.unpack_from('<Q', self._map, self._base + offset)[0]
+
+    def _closed(self):
+        _, pid = OWNER.unpack_from(self._map, OWNER_OFFSET)
+        return pid == 0
+
+    def _wait(self, ready, deadline, what):
+        idle = 0
+        while not ready():
+            if self._closed() and not ready():
+                raise FunnelError('the funnel closed')
+            if deadline is not None and time.monotonic() > deadline:
+                raise FunnelError('timed out waiting for {}'.format(what))
+            idle = min(idle + 1, 10)
+            time.sleep(min(self._poll_interval, 1e-6 * 2 ** idle))
+
+    def _publish(self, body, tube, pri, delay, ttr, deadline):
+        tube = tube.encode()
+        length = REQUEST.size + len(tube) + len(body)
+        if _align(length) > self._ring_size:
+            raise ValueError('job body too big for the ring')
+        pos = self._head % self._ring_size
+        wrap = self._ring_size - pos < _align(length)
+        needed = _align(length) + (self._ring_size - pos if wrap else 0)
+
+        def room():
+            self._harvest()
+            return self._head + needed - self._counter(16) <= \
+                self._ring_size and self._count - self._read < self._responses
+        self._wait(room, deadline, 'room in the ring')
+        if wrap:
+            struct.pack_into('<I', self._map, self._ring + pos, WRAP)
+            self._head += self._ring_size - pos
+            pos = 0
+        start = self._ring + pos
+        REQUEST.pack_into(self._map, start, length, pri, delay, ttr,
+                          len(tube))
+        start += REQUEST.size
+        self._map[start:start + len(tube)] = tube
+        start += len(tube)
+        self._map[start:start + len(body)] = body
+        self._head += _align(length)
+        seq = self._count
+        self._count += 1
+        # published after the request itself
+        struct.pack_into('<QQ', self._map, self._base, self._head,
+                         self._count)
+        return seq
+
+    def _harvest(self):
+        """copy the responses out, freeing their place in the ring"""
+        written = self._counter(24)
+        while self._read < written:
+            offset = self._ring + self._ring_size + \
+                self._read % self._responses * RESPONSE.size
+            if self._read in self._abandoned:
+                self._abandoned.remove(self._read)
+            else:
+                self._answers[self._read] = RESPONSE.unpack_from(
+                    self._map, offset)
+            self._read += 1
+
+    def _answered(self, seq):
+        self._harvest()
+        return seq in self._answers
+
+    def _result(self, seq, deadline):
+        try:
+            self._wait(lambda: self._answered(seq), deadline, 'the funnel')
+        except FunnelError:
+            self._abandoned.add(seq)
+            raise
+        status, id = self._answers.pop(seq)
+        if status == 0:
+            return id
+        if status < len(ERRORS):
+            raise CommandFailed(ERRORS[status])
+        if status == ERROR_LOST:
+            raise FunnelError('the funnel stopped before sending the job')
+        raise FunnelError('the funnel could not put the job')
+
+    def put(self, body, pri=CommandsMixin.DEFAULT_PRI, delay=0,
+            ttr=CommandsMixin.DEFAULT_TTR, tube='default',
+            timeout=DEFAULT_TIMEOUT):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        seq = self._publish(body, tube, pri, delay, ttr, deadline)
+        return self._result(seq, deadline)
+
+    def put_many(self, bodies, pri=CommandsMixin.DEFAULT_PRI, delay=0,
+                 ttr=CommandsMixin.DEFAULT_TTR, tube='default',
+                 timeout=DEFAULT_TIMEOUT):
+        """
+        Put all `bodies` before waiting for any response; returns the ids,
+        or the exception of each job that failed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        seqs = [self._publish(body, tube, pri, delay, ttr, deadline)
+                for body in bodies]
+        results = []
+        for index, seq in enumerate(seqs):
+            try:
+                results.append(self._result(seq, deadline))
+            except CommandFailed as e:
+                results.append(e)
+            except FunnelError:
+                self._abandoned.update(seqs[index + 1:])
+                raise
+        return results
+
+    def close(self):
+        """give the slot up"""
+        if self._map.closed:
+            return
+        self._map.close()
+        os.close(self._fd)
+        _claimed.discard((self._path, self.slot))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='send the puts of many processes over one connection')
+    parser.add_argument('-H', dest='host', default='127.0.0.1',
+                        help='beanstalkd host')
+    parser.add_argument('-p', dest='port', type=int, default=11300,
+                        help='beanstalkd port')
+    parser.add_argument('--path', default=DEFAULT_PATH,
+                        help='file shared with the producers')
+    parser.add_argument('--producers', type=int, default=64,
+                        help='number of producer slots')
+    parser.add_argument('--ring-size', type=int, default=2 ** 16,
+                        help='bytes of requests per producer')
+    args = parser.parse_args(argv)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    conn = loop.run_until_complete(
+        create_connection(args.host, args.port, loop=loop))
+    funnel = Funnel(conn, args.path, args.producers, args.ring_size,
+                    loop=loop)
+    funnel.start()
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        funnel.close()
+        loop.run_until_complete(funnel.wait_closed())
+        conn.close()
+        loop.run_until_complete(conn.wait_closed())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import asyncio
+import heapq
+import itertools
+from collections import defaultdict
+from asyncio import CancelledError
+from aiobean.log import logger
+from aiobean.protocol import CommandFailed
+
+# leases due this close to each other are touched in the same batch
+BATCH_WINDOW = 1.0
+
+
+class _Lease:
+    __slots__ = ('conn', 'id', 'ttr', 'due')
+
+    def __init__(self, conn, id, ttr):
+        self.conn = conn
+        self.id = id
+        self.ttr = ttr
+        self.due = None
+
+
+class LeaseManager:
+    """
+    Keeps reserved jobs alive by touching them before their TTR runs out.
+
+    Every lease lives in one heap ordered by when it is due, and a single
+    timer fires for the earliest one, so there is no task per job. Leases
+    falling due together are touched in one pipeline per connection::
+
+        leases = LeaseManager(loop=loop)
+        id, body = await conn.reserve()
+        leases.add(conn, id, ttr=60)
+        ...  # as long as it takes
+        leases.remove(conn, id)
+        await conn.delete(id)
+
+    A job is touched once `ratio` of its TTR has passed since it was
+    reserved or last touched.
+    """
+
+    def __init__(self, ratio=0.5, loop=None):
+        self._ratio = ratio
+        self._loop = loop or asyncio.get_event_loop()
+        self._leases = {}  # (conn, id) -> _Lease
+        self._pending = set()  # (conn, id) waiting for stats-job
+        self._heap = []  # (due, seq, lease); stale entries are skipped
+        self._seq = itertools.count()
+        self._timer = None
+        self._timer_at = None
+        self._closed = False
+
+    def __len__(self):
+        return len(self._leases)
+
+    def __contains__(self, key):
+        return key in self._leases
+
+    def add(self, conn, id, ttr, time_left=None):
+        """
+        Keep job `id`, reserved on `conn`, alive. `time_left` defaults to
+        the whole `ttr`, i.e. the job has just been reserved.
+        """
+        lease = _Lease(conn, id, ttr)
+        self._leases[(conn, id)] = lease
+        if time_left is None:
+            time_left = ttr
+        deadline = self._loop.time() + time_left
+        self._schedule(lease, deadline - ttr * (1 - self._ratio))
+
+    def track(self, conn, id):
+        """
+        Like :meth:`add`, reading the TTR and time left from ``stats-job``.
+        The command is written right away, ahead of anything sent on `conn`
+        later. Returns a future resolved once the lease is in place.
+        """
+        stats = conn.stats_job(id)
+        self._pending.add((conn, id))
+        return asyncio.ensure_future(
+            self._track(conn, id, stats), loop=self._loop)
+
+    async def _track(self, conn, id, stats):
+        try:
+            stats = await stats
+        except Exception as e:
+            logger.warning('leases: cannot track job %s: %r', id, e)
+            self._pending.discard((conn, id))
+            return
+        if (conn, id) in self._pending:  # not removed meanwhile
+            self._pending.discard((conn, id))
+            self.add(conn, id, stats['ttr'], stats['time-left'])
+
+    def remove(self, conn, id):
+        """stop touching job `id`; returns whether it was leased"""
+        key = (conn, id)
+        if key in self._pending:
+            self._pending.discard(key)
+            return True
+        return self._leases.pop(key, None) is not None
+
+    async def deadline_soon(self, conn):
+        """
+        Touch every job leased on `conn` now, e.g. after a reserve on it
+        failed with :class:`~aiobean.protocol.DeadlineSoon`.
+        """
+        leases = [lease for lease in self._leases.values()
+                  if lease.conn is conn]
+        if leases:
+            await self._touch(conn, leases)
+
+    def close(self):
+        self._closed = True
+        self._leases.clear()
+        self._pending.clear()
+        self._heap.clear()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = self._timer_at = None
+
+    def _schedule(self, lease, due):
+        lease.due = due
+        heapq.heappush(self._heap, (due, next(self._seq), lease))
+        if self._timer_at is None or due < self._timer_at:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer_at = due
+            self._timer = self._loop.call_at(due, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = self._timer_at = None
+        horizon = self._loop.time() + BATCH_WINDOW
+        heap = self._heap
+        batches = defaultdict(list)
+        while heap and heap[0][0] <= horizon:
+            due, _, lease = heapq.heappop(heap)
+            if lease.due != due or \
+                    self._leases.get((lease.conn, lease.id)) is not lease:
+                continue  # rescheduled or removed meanwhile
+            lease.due = None
+            batches[lease.conn].append(lease)
+        for conn, leases in batches.items():
+            asyncio.ensure_future(self._touch(conn, leases), loop=self._loop)
+        if heap:
+            self._timer_at = heap[0][0]
+            self._timer = self._loop.call_at(self._timer_at, self._on_timer)
+
+    async def _touch(self, conn, leases):
+        sent_at = self._loop.time()
+        pipe = conn.pipeline()
+        for lease in leases:
+            pipe.touch(lease.id)
+        try:
+            results = await pipe.send()
+        except (Exception, CancelledError) as e:
+            # handled here: nobody awaits the task touching on a timer
+            if conn.closed:
+                logger.warning('leases: connection lost, dropping %d '
+                               'leases: %r', len(leases), e)
+                for key in [key for key in self._leases if key[0] is conn]:
+                    del self._leases[key]
+            elif isinstance(e, CancelledError):
+                raise
+            else:
+                logger.error('leases: failed to touch %d jobs, retrying: %r',
+                             len(leases), e)
+                self._retry(leases)
+            return
+        for lease, result in zip(leases, results):
+            key = (lease.conn, lease.id)
+            if self._closed or self._leases.get(key) is not lease:
+                continue
+            if isinstance(result, CommandFailed):
+                # not reserved by this connection any more
+                logger.warning('leases: lost job %s: %r', lease.id, result)
+                del self._leases[key]
+            elif isinstance(result, Exception):
+                logger.error('leases: failed to touch job %s: %r',
+                             lease.id, result)
+                self._retry([lease])
+            else:
+                self._schedule(
+                    lease, sent_at + lease.ttr * self._ratio)
+
+    def _retry(self, leases):
+        for lease in leases:
+            if not self._closed and \
+                    self._leases.get((lease.conn, lease.id)) is lease:
+                self._schedule(lease, self._loop.time() + 1)
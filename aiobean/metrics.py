@@ -0,0 +1,142 @@
+import math
+from array import array
+from collections import defaultdict
+
+
+class Histogram:
+    """
+    Counts samples in fixed buckets, each twice as wide as the previous
+    one: bucket 0 holds samples up to `low`, bucket i those up to
+    ``low * 2**i`` and the last one everything above. Recording a sample
+    only bumps counters.
+    """
+
+    __slots__ = ('low', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, low=1e-5, buckets=24):
+        self.low = low
+        self.counts = array('L', [0]) * buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if value > self.low:
+            # value / low == mantissa * 2**index, mantissa in [0.5, 1): a
+            # power of two is the upper bound of the bucket below
+            mantissa, index = math.frexp(value / self.low)
+            if mantissa == 0.5:
+                index -= 1
+        else:
+            index = 0
+        if index >= len(self.counts):
+            index = len(self.counts) - 1
+        self.counts[index] += 1
+
+    def upper_bound(self, index):
+        if index == len(self.counts) - 1:
+            return math.inf
+        return self.low * 2 ** index
+
+    def percentile(self, q):
+        """
+        Upper bound of the bucket holding the `q` (0 to 1) quantile, which
+        over-estimates it by up to 2x; 0 without samples.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.upper_bound(index), self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'p999': self.percentile(0.999),
+            'buckets': [(self.upper_bound(index), count)
+                        for index, count in enumerate(self.counts) if count],
+        }
+
+
+class Metrics:
+    """
+    Collects what connections report when created with it::
+
+        metrics = Metrics()
+        conn = await create_connection(host, port, metrics=metrics)
+        ...
+        metrics.snapshot()
+
+    One instance can be shared by any number of connections, including
+    those of a pool or a worker (pass ``metrics=`` along with the other
+    connection arguments).
+
+    Connections only call the methods below, so any object providing them
+    works as a hook, e.g. one forwarding to statsd. Without one,
+    connections skip all of it.
+    """
+
+    def __init__(self):
+        self.latency = defaultdict(Histogram)  # command -> seconds
+        self.statuses = defaultdict(int)  # unexpected response statuses
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.inflight = 0  # commands waiting for a response
+        self.inflight_max = 0
+        self.lost = 0  # commands without a response when closed
+        self.reconnects = 0
+
+    def command_sent(self, command, nbytes):
+        self.bytes_sent += nbytes
+        self.inflight += 1
+        if self.inflight > self.inflight_max:
+            self.inflight_max = self.inflight
+
+    def response_received(self, command, status, ok, latency):
+        """`ok` tells whether `status` is the command's success status"""
+        self.inflight -= 1
+        self.latency[command].record(latency)
+        if not ok:
+            self.statuses[status.decode()] += 1
+
+    def data_received(self, nbytes):
+        self.bytes_received += nbytes
+
+    def connection_closed(self, pending):
+        self.inflight -= pending
+        self.lost += pending
+
+    def reconnected(self):
+        self.reconnects += 1
+
+    def snapshot(self, reset=False):
+        """the current numbers as plain dicts; `reset` starts over"""
+        snapshot = {
+            'latency': {command: histogram.snapshot()
+                        for command, histogram in self.latency.items()},
+            'statuses': dict(self.statuses),
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'inflight': self.inflight,
+            'inflight_max': self.inflight_max,
+            'lost': self.lost,
+            'reconnects': self.reconnects,
+        }
+        if reset:
+            inflight = self.inflight
+            self.__init__()
+            self.inflight = self.inflight_max = inflight
+        return snapshot
@@ -0,0 +1,106 @@
+import asyncio
+from asyncio import CancelledError
+from functools import partial
+from aiobean.log import logger
+
+
+class StatsMonitor:
+    """
+    Shares ``stats``, ``stats-tube`` and ``list-tubes`` results between any
+    number of callers::
+
+        monitor = StatsMonitor(conn, ttl=2, loop=loop)
+        monitor.start(interval=5)  # optional
+        ready = (await monitor.stats_tube('emails'))['current-jobs-ready']
+
+    Results are cached for `ttl` seconds. Concurrent requests for the same
+    key wait for a single command (single-flight) instead of sending their
+    own. With :meth:`start`, every tube's stats are refreshed in the
+    background, all ``stats-tube`` commands of a round in one pipeline.
+
+    The returned dicts and lists are shared; treat them as read-only.
+    """
+
+    def __init__(self, conn, ttl=1.0, loop=None):
+        self._conn = conn
+        self._ttl = ttl
+        self._loop = loop or asyncio.get_event_loop()
+        self._cache = {}  # key -> (expires_at, value)
+        self._inflight = {}  # key -> future of the command
+        self._refresh_task = None
+
+    def stats(self):
+        return self._get(('stats',), self._conn.stats)
+
+    def stats_tube(self, tube='default'):
+        return self._get(
+            ('stats-tube', tube), partial(self._conn.stats_tube, tube))
+
+    def tubes(self):
+        return self._get(('list-tubes',), self._conn.tubes)
+
+    def all_tube_stats(self):
+        """{tube: stats} of every tube still cached"""
+        now = self._loop.time()
+        return {
+            key[1]: value for key, (expires_at, value) in self._cache.items()
+            if key[0] == 'stats-tube' and expires_at > now
+        }
+
+    def invalidate(self):
+        self._cache.clear()
+
+    async def _get(self, key, execute):
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > self._loop.time():
+            return entry[1]
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = self._inflight[key] = execute()
+            fut.add_done_callback(partial(self._done, key))
+        # a caller giving up must not cancel the command others wait for
+        return await asyncio.shield(fut, loop=self._loop)
+
+    def _done(self, key, fut):
+        self._inflight.pop(key, None)
+        if not fut.cancelled() and fut.exception() is None:
+            self._store(key, fut.result(), self._ttl)
+
+    def _store(self, key, value, ttl):
+        self._cache[key] = (self._loop.time() + ttl, value)
+
+    def start(self, interval=5.0):
+        """refresh the stats of every tube each `interval` seconds"""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(
+                self._refresh_loop(interval), loop=self._loop)
+
+    def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    async def refresh(self, ttl=None):
+        """fetch the stats of every tube, pipelined, into the cache"""
+        ttl = self._ttl if ttl is None else ttl
+        tubes = await self._conn.tubes()
+        self._store(('list-tubes',), tubes, ttl)
+        pipe = self._conn.pipeline()
+        for tube in tubes:
+            pipe.stats_tube(tube)
+        for tube, stats in zip(tubes, await pipe.send()):
+            if isinstance(stats, Exception):  # e.g. removed since listed
+                self._cache.pop(('stats-tube', tube), None)
+            else:
+                self._store(('stats-tube', tube), stats, ttl)
+
+    async def _refresh_loop(self, interval):
+        while True:
+            try:
+                # keep the results until the next round is in
+                await self.refresh(ttl=max(self._ttl, interval * 2))
+            except CancelledError:
+                raise
+            except Exception:
+                logger.exception('monitor: refresh failed')
+            await asyncio.sleep(interval, loop=self._loop)
@@ -0,0 +1,212 @@
+import asyncio
+from collections import deque
+from aiobean.connection import create_connection
+from aiobean.exc import BeanstalkException
+from aiobean.log import logger
+from aiobean.protocol import CommandsMixin
+
+DEFAULT_TUBE = 'default'
+
+
+class PoolClosedError(BeanstalkException):
+    pass
+
+
+async def create_pool(host, port, size=4, loop=None, **kwargs):
+    """extra keyword arguments are passed on to `create_connection`"""
+    if not loop:
+        loop = asyncio.get_event_loop()
+    pool = Pool(host, port, size, loop, **kwargs)
+    await pool._fill()
+    return pool
+
+
+class Pool:
+    """
+    A fixed size set of connections to one beanstalkd server.
+
+    ``use`` is per connection state in beanstalkd, so the pool remembers
+    the tube each connection is using and prefers a connection that
+    already matches. ``use`` is only sent when a connection has to switch.
+
+    Connections are either handed out exclusively with :meth:`get` /
+    :meth:`acquire`, or shared by many coroutines with :meth:`put`.
+    Do not send ``use`` on a pooled connection yourself; ask the pool for
+    the tube instead, or it will lose track of it.
+    """
+
+    def __init__(self, host, port, size, loop, **kwargs):
+        self._address = (host, port)
+        self._size = size
+        self._loop = loop
+        self._conn_kwargs = kwargs
+        self._conns = []
+        self._tubes = {}  # connection -> the tube it is using
+        self._held = set()  # connections handed out exclusively
+        self._connecting = 0  # connections being opened
+        self._waiters = deque()
+        self._closed = False
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def closed(self):
+        return self._closed
+
+    async def _fill(self):
+        for conn in [c for c in self._conns if c.closed]:
+            self._conns.remove(conn)
+            self._tubes.pop(conn, None)
+            self._held.discard(conn)
+        # counting those other coroutines are opening, so the pool never
+        # grows past its size
+        while len(self._conns) + self._connecting < self._size:
+            self._connecting += 1
+            try:
+                conn = await create_connection(
+                    *self._address, loop=self._loop, **self._conn_kwargs)
+            finally:
+                self._connecting -= 1
+            if self._closed:
+                conn.close()
+                raise PoolClosedError('pool is closed')
+            self._conns.append(conn)
+            self._tubes[conn] = DEFAULT_TUBE
+            self._wakeup()
+
+    def _pick(self, tube):
+        """
+        Choose a connection that is not held, preferring one that already
+        uses `tube` and then the one with the fewest commands in flight.
+        """
+        best = None
+        best_key = None
+        for conn in self._conns:
+            if conn in self._held or conn.closed:
+                continue
+            key = (self._tubes[conn] != tube, len(conn._queue))
+            if best is None or key < best_key:
+                best, best_key = conn, key
+        return best
+
+    def _use(self, conn, tube):
+        """
+        Switch `conn` to `tube` if needed. Returns the future of the `use`
+        command, or None if the connection already uses the tube.
+        """
+        if self._tubes[conn] == tube:
+            return None
+        logger.debug('pool: switching %r to tube %s', conn, tube)
+        self._tubes[conn] = tube
+        return conn.use(tube)
+
+    async def _select(self, tube):
+        while True:
+            if self._closed:
+                raise PoolClosedError('pool is closed')
+            if any(conn.closed for conn in self._conns):
+                await self._fill()
+            conn = self._pick(tube)
+            if conn is not None:
+                return conn
+            waiter = self._loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    self._wakeup()  # pass the wakeup on to someone else
+                else:
+                    waiter.cancel()
+                raise
+
+    def _wakeup(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    async def acquire(self, tube=DEFAULT_TUBE):
+        """
+        Take a connection for exclusive use, already using `tube`.
+        It must be given back with :meth:`release`.
+        """
+        conn = await self._select(tube)
+        self._held.add(conn)
+        use = self._use(conn, tube)
+        if use is not None:
+            try:
+                await use
+            except BaseException:
+                self.release(conn)
+                raise
+        return conn
+
+    def release(self, conn):
+        self._held.discard(conn)
+        self._wakeup()
+
+    def get(self, tube=DEFAULT_TUBE):
+        """
+        Returns an async context manager holding a connection using
+        `tube`::
+
+            async with pool.get('emails') as conn:
+                await conn.put(b'hi')
+                await conn.peek_ready()
+        """
+        return _ConnectionContext(self, tube)
+
+    async def put(self, body, tube=DEFAULT_TUBE,
+                  pri=CommandsMixin.DEFAULT_PRI, delay=0,
+                  ttr=CommandsMixin.DEFAULT_TTR):
+        """
+        Put a job into `tube` over a shared connection.
+
+        Any number of coroutines can put concurrently: the commands are
+        pipelined on connections nobody holds. If a `use` is needed it is
+        written right before the `put`, so both cost one round trip.
+        Honours the connections' flow control limits.
+        """
+        while True:
+            conn = await self._select(tube)
+            await conn.wait_writable()
+            if conn not in self._held:  # may have been taken meanwhile
+                break
+        use = self._use(conn, tube)
+        fut = conn.put(body, pri, delay, ttr)
+        if use is not None:
+            await use
+        return await fut
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        while self._waiters:
+            self._waiters.popleft().cancel()
+        for conn in self._conns:
+            conn.close()
+
+    async def wait_closed(self):
+        for conn in self._conns:
+            await conn.wait_closed()
+
+
+class _ConnectionContext:
+
+    def __init__(self, pool, tube):
+        self._pool = pool
+        self._tube = tube
+        self._conn = None
+
+    async def __aenter__(self):
+        self._conn = await self._pool.acquire(self._tube)
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        conn, self._conn = self._conn, None
+        self._pool.release(conn)
@@ -0,0 +1,252 @@
+import asyncio
+from asyncio import CancelledError
+from collections import defaultdict, deque
+from aiobean.log import logger
+from aiobean.protocol import CommandsMixin, DeadlineSoon
+
+_DEADLINE_SOON_BACKOFF = 0.1
+# seconds of a job's TTR kept for the handler to ack it
+DEFAULT_TTR_MARGIN = 1
+
+
+class Prefetcher:
+    """
+    Reserves jobs ahead of time so that handlers get the next one without
+    a round trip::
+
+        prefetcher = Prefetcher([conn1, conn2], size=64, loop=loop)
+        prefetcher.start()
+        while True:
+            id, body = await prefetcher.get()
+            ...
+            await prefetcher.delete(id)
+
+    Up to `depth` reserves are pipelined per connection; at most `size`
+    jobs are reserved and not yet handed out at any time, counting the
+    reserves in flight. While jobs come back, the reserves are
+    ``reserve-with-timeout 0``, so acks sent on the same connection never
+    wait behind them. Once a tube runs dry, a connection sends a single
+    reserve waiting up to `poll_interval` seconds.
+
+    Reserved jobs spend their TTR in the buffer, so each batch of reserves
+    is followed by pipelined ``stats-job`` to learn the jobs' TTR. A job
+    still buffered `ttr_margin` seconds (at most half its TTR) before its
+    TTR runs out, counted from when its reserve was sent, is given back
+    rather than left to time out and go to another worker. `max_age`
+    optionally gives jobs back sooner. Keep `size` to what the handlers
+    get through well within the TTR.
+
+    Jobs given back, and those still buffered on :meth:`close`, are
+    released with the priority they had. The connections are meant for
+    the prefetcher alone; it does not close them.
+    """
+
+    def __init__(self, connections, size=16, depth=8, max_age=None,
+                 poll_interval=1, ttr_margin=DEFAULT_TTR_MARGIN, loop=None):
+        self._conns = list(connections)
+        self._size = size
+        self._depth = depth
+        self._max_age = max_age
+        self._poll_interval = poll_interval
+        self._ttr_margin = ttr_margin
+        self._loop = loop or asyncio.get_event_loop()
+        self._jobs = deque()  # (conn, id, body, expires)
+        self._timers = {}  # id of a buffered job -> timer giving it back
+        self._owners = {}  # id -> connection it is reserved on
+        self._inflight = 0
+        self._getters = deque()
+        self._space = asyncio.Event(loop=self._loop)
+        self._tasks = []
+        self._give_backs = set()
+        self._closing = False
+
+    def __len__(self):
+        """number of jobs waiting in the buffer"""
+        return len(self._jobs)
+
+    def start(self):
+        self._tasks = [
+            asyncio.ensure_future(self._fill(conn), loop=self._loop)
+            for conn in self._conns
+        ]
+
+    def close(self):
+        """stop reserving; :meth:`wait_closed` gives the buffer back"""
+        self._closing = True
+        self._space.set()
+        while self._getters:
+            waiter = self._getters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def wait_closed(self):
+        if self._tasks:
+            await asyncio.wait(self._tasks, loop=self._loop)
+        jobs, self._jobs = list(self._jobs), deque()
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        if jobs:
+            logger.info('prefetch: giving back %d jobs', len(jobs))
+            self._give_back(jobs)
+        if self._give_backs:
+            await asyncio.wait(self._give_backs, loop=self._loop)
+
+    async def get(self):
+        """
+        The next (id, body). Returns None once the prefetcher is closing;
+        the jobs still buffered are given back.
+        """
+        while True:
+            if self._closing:
+                return None
+            if not self._jobs:
+                waiter = self._loop.create_future()
+                self._getters.append(waiter)
+                try:
+                    await waiter
+                except CancelledError:
+                    if waiter.done() and not waiter.cancelled():
+                        self._wakeup_getter()  # pass the job on
+                    raise
+                continue
+            job = self._jobs.popleft()
+            conn, id, body, expires = job
+            self._timers.pop(id).cancel()
+            self._space.set()
+            if self._loop.time() >= expires:
+                logger.warning('prefetch: job %s waited too long', id)
+                self._give_back([job])
+                continue
+            return id, body
+
+    def _expire(self, job):
+        """give back `job`, still buffered when its time is up"""
+        del self._timers[job[1]]
+        self._jobs.remove(job)
+        self._space.set()
+        logger.warning('prefetch: job %s waited too long', job[1])
+        self._give_back([job])
+
+    def _wakeup_getter(self):
+        while self._getters:
+            waiter = self._getters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def delete(self, id):
+        return self._owners.pop(id).delete(id)
+
+    def release(self, id, pri=CommandsMixin.DEFAULT_PRI, delay=0):
+        return self._owners.pop(id).release(id, pri, delay)
+
+    def bury(self, id, pri=CommandsMixin.DEFAULT_PRI):
+        return self._owners.pop(id).bury(id, pri)
+
+    def touch(self, id):
+        return self._owners[id].touch(id)
+
+    def _room(self):
+        return self._size - len(self._jobs) - self._inflight
+
+    async def _fill(self, conn):
+        idle = False
+        while not self._closing:
+            room = self._room()
+            if room <= 0:
+                self._space.clear()
+                await self._space.wait()
+                continue
+            if idle:
+                count, timeout = 1, self._poll_interval
+            else:
+                count, timeout = min(room, self._depth), 0
+            pipe = conn.pipeline()
+            for _ in range(count):
+                pipe.reserve(timeout)
+            self._inflight += count
+            # the TTR of the jobs starts after this
+            sent_at = self._loop.time()
+            try:
+                results = await pipe.send()
+                jobs = [result for result in results
+                        if result is not None and
+                        not isinstance(result, Exception)]
+                if jobs:
+                    pipe = conn.pipeline()
+                    for id, _ in jobs:
+                        pipe.stats_job(id)
+                    stats = dict(zip((id for id, _ in jobs),
+                                     await pipe.send()))
+            except Exception:
+                if conn.closed:
+                    logger.warning('prefetch: connection closed')
+                    return
+                raise
+            finally:
+                self._inflight -= count
+            idle = True
+            for result in results:
+                if isinstance(result, DeadlineSoon):
+                    # a job handed out is about to time out; leave some
+                    # time to ack it
+                    await asyncio.sleep(
+                        _DEADLINE_SOON_BACKOFF, loop=self._loop)
+                elif isinstance(result, Exception):
+                    if conn.closed:
+                        logger.warning('prefetch: connection closed')
+                        return
+                    logger.error('prefetch: reserve failed: %r', result)
+                elif result is not None:
+                    idle = False
+                    id, body = result
+                    self._owners[id] = conn
+                    job = (conn, id, body,
+                           self._expires(sent_at, stats[id]))
+                    if self._closing:
+                        self._give_back([job])
+                        continue
+                    self._jobs.append(job)
+                    self._timers[id] = self._loop.call_at(
+                        job[3], self._expire, job)
+                    self._wakeup_getter()
+
+    def _expires(self, sent_at, stats):
+        """when a job reserved at `sent_at` has to be handed out by"""
+        if isinstance(stats, Exception):
+            logger.warning('prefetch: no TTR for a job: %r', stats)
+            return sent_at  # given back right away
+        ttr = stats['ttr']
+        expires = sent_at + ttr - min(self._ttr_margin, ttr / 2)
+        if self._max_age is not None:
+            expires = min(expires, sent_at + self._max_age)
+        return expires
+
+    def _give_back(self, jobs):
+        by_conn = defaultdict(list)
+        for conn, id, _, _ in jobs:
+            self._owners.pop(id, None)
+            by_conn[conn].append(id)
+        for conn, ids in by_conn.items():
+            task = asyncio.ensure_future(
+                self._release(conn, ids), loop=self._loop)
+            self._give_backs.add(task)
+            task.add_done_callback(self._give_backs.discard)
+
+    async def _release(self, conn, ids):
+        """release jobs with their own priority"""
+        try:
+            pipe = conn.pipeline()
+            for id in ids:
+                pipe.stats_job(id)
+            stats = await pipe.send()
+            pipe = conn.pipeline()
+            for id, job_stats in zip(ids, stats):
+                if not isinstance(job_stats, Exception):
+                    pipe.release(id, job_stats['pri'])
+            for result in await pipe.send():
+                if isinstance(result, Exception):
+                    logger.warning('prefetch: cannot release: %r', result)
+        except Exception:
+            logger.exception('prefetch: cannot release %d jobs', len(ids))
@@ -11,23 +11,12 @@ For example::
 
 """
 from aiobean.exc import BeanstalkException
-from functools import partial
+from importlib.util import find_spec
+import math
 import typing
-try:
-    from yaml import load as load_yaml
-except ImportError:
-    PYYAML = False
-    # without yaml, we just decode it
-
-    def load_yaml(body, **kwargs):
-        return body.decode()
-else:  # try to use libyaml
-    PYYAML = True
-    try:
-        from yaml import CLoader as Loader
-    except ImportError:
-        from yaml import Loader
-load_yaml = partial(load_yaml, Loader=Loader)
+
+# PyYAML is only imported if a body is not in the subset parse_yaml knows
+PYYAML = find_spec('yaml') is not None
 
 
 class ProtocolException(BeanstalkException):
@@ -62,7 +51,7 @@ def _parse_int(headers, body=None):
 
 
 def _parse_body(headers, body=None):
-    return (int(headers[0]), body)
+    return Job(int(headers[0]), body)
 
 
 def _parse_str(headers, body=None):
@@ -70,7 +59,64 @@ def _parse_str(headers, body=None):
 
 
 def _parse_yml(headers, body=None):
-    return load_yaml(body)
+    return parse_yaml(body)
+
+
+def load_yaml(text):
+    """load `text` with PyYAML; without it, `text` is returned as is"""
+    if not PYYAML:
+        return text
+    import yaml
+    try:
+        from yaml import CLoader as Loader
+    except ImportError:
+        from yaml import Loader
+    return yaml.load(text, Loader=Loader)
+
+
+def _scalar(value):
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    if value[:1] == '"' and value[-1:] == '"':
+        return value[1:-1]
+    if value == 'true' or value == 'false':
+        return value == 'true'
+    if value[:1] in '-+.0123456789':
+        try:
+            return int(value)
+        except ValueError:
+            pass
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return value
+
+
+def parse_yaml(body):
+    """
+    Parse the YAML subset beanstalkd emits: a flat map of ``key: value``
+    lines or a list of ``- item`` lines, with int, float, bool and string
+    scalars. Anything else is handed to :func:`load_yaml`.
+    """
+    text = str(body, 'utf-8')
+    mapping = {}
+    items = []
+    for line in text.splitlines():
+        if line[:2] == '- ':
+            items.append(_scalar(line[2:].strip()))
+            continue
+        key, sep, value = line.partition(':')
+        if sep and key and key[0] not in ' \t#-' \
+                and (not value or value[0] == ' '):
+            mapping[key] = _scalar(value.strip())
+        elif line.strip() and line != '---':
+            return load_yaml(text)
+    if mapping and items:
+        return load_yaml(text)
+    return items if items else mapping
 
 
 CRLF = '\r\n'
@@ -88,78 +134,172 @@ _a_none = typing.Awaitable[None]
 
 
 class CommandsMixin:
+    """
+    Every command takes a `deadline`: the number of seconds to wait for
+    its response before failing with ``asyncio.TimeoutError``. The
+    connection stays usable; the late response is dropped.
+    """
     DEFAULT_PRI = 2**32
     DEFAULT_TTR = 300
+    # encodes the bodies put, e.g. an aiobean.codec.Codec
+    codec = None
 
     def put(self, body, pri: int=DEFAULT_PRI, delay: int=0,
-            ttr: int=DEFAULT_TTR) -> _a_int:
-        return self.execute('put', pri, delay, ttr, len(body), body=body)
+            ttr: int=DEFAULT_TTR, deadline: float=None) -> _a_int:
+        if self.codec is not None:
+            return self.codec.put(self, body, pri, delay, ttr, deadline)
+        return self.execute('put', pri, delay, ttr, len(body), body=body,
+                            deadline=deadline)
 
-    def use(self, tube: str) -> _a_str:
-        return self.execute('use', tube)
+    def use(self, tube: str, deadline: float=None) -> _a_str:
+        return self.execute('use', tube, deadline=deadline)
 
-    def reserve(self, timeout: int=None) -> _a_job:
+    def reserve(self, timeout: float=None, deadline: float=None) -> _a_job:
         if timeout is None:
-            return self.execute('reserve')
+            return self.execute('reserve', deadline=deadline)
         else:
-            return self.execute('reserve-with-timeout', timeout)
+            # beanstalkd only takes whole seconds: wait at least as long as
+            # asked rather than not at all
+            return self.execute('reserve-with-timeout', math.ceil(timeout),
+                                deadline=deadline)
+
+    def delete(self, id: int, deadline: float=None) -> None:
+        if self.codec is not None:
+            return self.codec.delete(self, id, deadline)
+        return self.execute('delete', id, deadline=deadline)
+
+    def release(self, id: int, pri: int=DEFAULT_PRI, delay: int=0,
+                deadline: float=None) -> _a_none:
+        return self.execute('release', id, pri, delay, deadline=deadline)
+
+    def bury(self, id: int, pri: int=DEFAULT_PRI,
+             deadline: float=None) -> _a_none:
+        return self.execute('bury', id, pri, deadline=deadline)
+
+    def touch(self, id: int, deadline: float=None) -> _a_none:
+        return self.execute('touch', id, deadline=deadline)
+
+    def watch(self, tube: str, deadline: float=None) -> _a_int:
+        return self.execute('watch', tube, deadline=deadline)
+
+    def ignore(self, tube: str, deadline: float=None) -> _a_int:
+        return self.execute('ignore', tube, deadline=deadline)
+
+    def peek(self, id: int, deadline: float=None) -> _a_job:
+        return self.execute('peek', id, deadline=deadline)
+
+    def peek_ready(self, deadline: float=None) -> _a_job:
+        return self.execute('peek-ready', deadline=deadline)
+
+    def peek_delayed(self, deadline: float=None) -> _a_job:
+        return self.execute('peek-delayed', deadline=deadline)
+
+    def peek_buried(self, deadline: float=None) -> _a_job:
+        return self.execute('peek-buried', deadline=deadline)
+
+    def kick(self, count: int=1, deadline: float=None) -> _a_int:
+        return self.execute('kick', count, deadline=deadline)
+
+    def kick_job(self, id: int, deadline: float=None) -> _a_job:
+        return self.execute('kick-job', id, deadline=deadline)
+
+    def stats_job(self, id: int, deadline: float=None) -> _a_dict:
+        return self.execute('stats-job', id, deadline=deadline)
+
+    def stats_tube(self, tube: str='default', deadline: float=None) -> _a_dict:
+        return self.execute('stats-tube', tube, deadline=deadline)
+
+    def stats(self, deadline: float=None) -> _a_dict:
+        return self.execute('stats', deadline=deadline)
+
+    def tubes(self, deadline: float=None) -> _a_list_str:
+        return self.execute('list-tubes', deadline=deadline)
+
+    def used(self, deadline: float=None) -> _a_str:
+        return self.execute('list-tube-used', deadline=deadline)
 
-    def delete(self, id: int) -> None:
-        return self.execute('delete', id)
+    def watched(self, deadline: float=None) -> _a_list_str:
+        return self.execute('list-tubes-watched', deadline=deadline)
 
-    def release(self, id: int, pri: int=DEFAULT_PRI, delay: int=0) -> _a_none:
-        return self.execute('release', id, pri, delay)
+    def pause_tube(self, tube: str, delay: int,
+                   deadline: float=None) -> _a_none:
+        return self.execute('pause-tube', tube, delay, deadline=deadline)
 
-    def bury(self, id: int, pri: int=DEFAULT_PRI) -> _a_none:
-        return self.execute('bury', id, pri)
 
-    def touch(self, id: int) -> _a_none:
-        return self.execute('touch', id)
+class Job:
+    """
+    A reserved or peeked job. It unpacks and compares like the
+    ``(id, body)`` tuple it stands for, and acks itself on the connection
+    it came from::
 
-    def watch(self, tube: str) -> _a_int:
-        return self.execute('watch', tube)
+        job = await conn.reserve()
+        if (await job.stats())['releases'] > 3:
+            await job.bury()
+        else:
+            await job.delete()
 
-    def ignore(self, tube: str) -> _a_int:
-        return self.execute('ignore', tube)
+    `body` is the body as parsed, not copied. Jobs are not hashable; key
+    on ``job.id`` instead. :meth:`stats` asks the server once and keeps
+    the answer, until the job is acked. Like the connection's commands,
+    the methods return awaitables, or results on an
+    :class:`aiobean.sync.Client`.
+    """
+    __slots__ = ('id', 'body', 'conn', '_stats')
 
-    def peek(self, id: int) -> _a_job:
-        return self.execute('peek', id)
+    def __init__(self, id, body, conn=None):
+        self.id = id
+        self.body = body
+        self.conn = conn
+        self._stats = None
 
-    def peek_ready(self) -> _a_job:
-        return self.execute('peek-ready')
+    def __iter__(self):
+        return iter((self.id, self.body))
 
-    def peek_delayed(self) -> _a_job:
-        return self.execute('peek-delayed')
+    def __len__(self):
+        return 2
 
-    def peek_buried(self) -> _a_job:
-        return self.execute('peek-buried')
+    def __getitem__(self, index):
+        return (self.id, self.body)[index]
 
-    def kick(self, count: int=1) -> _a_int:
-        return self.execute('kick', count)
+    def __eq__(self, other):
+        if isinstance(other, (Job, tuple)):
+            return (self.id, self.body) == tuple(other)
+        return NotImplemented
 
-    def kick_job(self, id: int) -> _a_job:
-        return self.execute('kick-job', id)
+    # mutable, and bodies may be unhashable memoryviews
+    __hash__ = None
 
-    def stats_job(self, id: int) -> _a_dict:
-        return self.execute('stats-job', id)
+    def __repr__(self):
+        return '<Job {}>'.format(self.id)
 
-    def stats_tube(self, tube: str='default') -> _a_dict:
-        return self.execute('stats-tube', tube)
+    def delete(self):
+        self._stats = None
+        return self.conn.delete(self.id)
 
-    def stats(self) -> _a_dict:
-        return self.execute('stats')
+    def release(self, pri=CommandsMixin.DEFAULT_PRI, delay=0):
+        self._stats = None
+        return self.conn.release(self.id, pri, delay)
 
-    def tubes(self) -> _a_list_str:
-        return self.execute('list-tubes')
+    def bury(self, pri=CommandsMixin.DEFAULT_PRI):
+        self._stats = None
+        return self.conn.bury(self.id, pri)
 
-    def used(self) -> _a_str:
-        return self.execute('list-tube-used')
+    def touch(self):
+        self._stats = None
+        return self.conn.touch(self.id)
 
-    def watched(self) -> _a_list_str:
-        return self.execute('list-tubes-watched')
+    def stats(self, refresh=False):
+        """the job's ``stats-job``, asked for once unless `refresh`"""
+        if self._stats is None or refresh:
+            self._stats = self.conn.stats_job(self.id)
+            if hasattr(self._stats, 'add_done_callback'):
+                self._stats.add_done_callback(self._forget_failure)
+        return self._stats
 
-    def pause_tube(self, tube: str, delay: int) -> _a_none:
-        return self.execute('pause-tube', tube, delay)
+    def _forget_failure(self, fut):
+        if self._stats is fut and (
+                fut.cancelled() or fut.exception() is not None):
+            self._stats = None
 
 
 PROTOCOL = {
@@ -209,6 +349,83 @@ def encode_command(command, *args, body=None):
         yield B_CRLF
 
 
+# formats of the arguments of each command: 'd' for an integer and
+# 's' for a tube name
+ARGUMENTS = {
+    'put': 'dddd',
+    'use': 's',
+    'reserve-with-timeout': 'd',
+    'delete': 'd',
+    'release': 'ddd',
+    'bury': 'dd',
+    'touch': 'd',
+    'watch': 's',
+    'ignore': 's',
+    'peek': 'd',
+    'kick': 'd',
+    'kick-job': 'd',
+    'stats-job': 'd',
+    'stats-tube': 's',
+    'pause-tube': 'sd',
+}
+_BYTES_LIKE = (bytes, bytearray, memoryview)
+
+
+def _compile_encoder(command, formats):
+    """
+    Build the encoder of `command`. It takes the command's arguments and
+    an optional body and returns a list of parts for ``writelines``: the
+    head line, formatted from a precompiled bytes template, then the body
+    as is and a CRLF.
+
+    Arguments that do not fit `formats` (e.g. an id passed as a string)
+    go through the generic :func:`encode_command`.
+    """
+    template = ' '.join(
+        [command] + ['%d' if f == 'd' else '%b' for f in formats]
+    ).encode() + B_CRLF
+    strings = [i for i, f in enumerate(formats) if f == 's']
+
+    if not formats:
+        def encode(body=None):
+            return [template]
+        return encode
+
+    def encode(*args, body=None):
+        try:
+            if strings:
+                args = tuple(
+                    arg.encode() if i in strings else arg
+                    for i, arg in enumerate(args))
+            head = template % args
+        except (TypeError, AttributeError):
+            return list(encode_command(command, *args, body=body))
+        if body is None:
+            return [head]
+        if not isinstance(body, _BYTES_LIKE):
+            raise TypeError('job body must be a byte-like object')
+        return [head, body, B_CRLF]
+    return encode
+
+
+ENCODERS = {
+    command: _compile_encoder(command, ARGUMENTS.get(command, ''))
+    for command in PROTOCOL
+}
+
+
+def encode(command, *args, body=None):
+    """
+    Encode a command with its precompiled encoder; returns a list of parts
+    to write with ``writelines``.
+    """
+    try:
+        encoder = ENCODERS[command]
+    except KeyError:
+        raise InvalidCommand
+    return encoder(*args, body=body)
+
+
 def handle_head(line):
     """
     returns a tuple like (status, headers, body_length).
@@ -222,6 +439,119 @@ def handle_head(line):
     return (status, headers, body_len)
 
 
+DEFAULT_BUFFER_SIZE = 2 ** 16
+_MIN_FREE = 2 ** 12  # compact the buffer when less than this is left
+
+
+class ProtocolParser:
+    """
+    An incremental, IO free parser of server responses.
+
+    Feed it chunks of bytes as they arrive; it returns the responses
+    completed so far as ``(status, headers, body)`` tuples. Heads and bodies
+    may be split anywhere, and a chunk may hold many responses::
+
+        parser = ProtocolParser()
+        for status, headers, body in parser.feed(data):
+            ...
+
+    Data is kept in one preallocated buffer and every byte is scanned once.
+    Instead of :meth:`feed`, an IO layer can receive straight into the
+    buffer with :meth:`get_buffer` and :meth:`buffer_updated`, the same
+    way ``asyncio.BufferedProtocol`` does.
+
+    Bodies that fit in the buffer are sliced out of it once, as ``bytes``.
+    A body bigger than the buffer is received into its own ``bytearray``
+    and returned as a ``memoryview`` of it, without any copy.
+    """
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE):
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._min_free = min(_MIN_FREE, buffer_size // 4)
+        self._start = 0  # first byte not parsed yet
+        self._end = 0  # end of the received data
+        self._scan = 0  # where to resume looking for the end of a head
+        self._head = None  # (status, headers, body_len) waiting for a body
+        self._big = None  # dedicated buffer of a body bigger than _buffer
+        self._big_end = 0
+
+    def feed(self, data):
+        events = []
+        data = memoryview(data)
+        while data:
+            buf = self.get_buffer(len(data))
+            size = min(len(buf), len(data))
+            buf[:size] = data[:size]
+            events.extend(self.buffer_updated(size))
+            data = data[size:]
+        return events
+
+    def get_buffer(self, sizehint=-1):
+        """a writable memoryview to receive the next bytes into"""
+        if self._big is not None:
+            return memoryview(self._big)[self._big_end:]
+        if len(self._buffer) - self._end < self._min_free and self._start:
+            # move what is left to the front; nothing else holds a slice
+            size = self._end - self._start
+            self._buffer[:size] = self._buffer[self._start:self._end]
+            self._scan -= self._start
+            self._start, self._end = 0, size
+        if self._end == len(self._buffer):  # a head longer than the buffer
+            self._buffer = self._buffer + bytearray(len(self._buffer))
+            self._view = memoryview(self._buffer)
+        return self._view[self._end:]
+
+    def buffer_updated(self, nbytes):
+        """`nbytes` were written into the last buffer; returns responses"""
+        if self._big is not None:
+            self._big_end += nbytes
+            if self._big_end < len(self._big):
+                return []
+            status, headers, body_len = self._head
+            body = memoryview(self._big)[:body_len]
+            self._head = self._big = None
+            return [(status, headers, body)]
+        self._end += nbytes
+        return self._parse()
+
+    def _parse(self):
+        events = []
+        buf = self._buffer
+        while True:
+            if self._head is None:
+                eol = buf.find(B_CRLF, self._scan, self._end)
+                if eol < 0:
+                    self._scan = max(self._start, self._end - 1)
+                    break
+                status, headers, body_len = handle_head(
+                    bytes(buf[self._start:eol]))
+                self._start = self._scan = eol + 2
+                # a job may be empty: only the status says if a body follows
+                if status not in RESP_WITH_BODY:
+                    events.append((status, headers, None))
+                    continue
+                self._head = (status, headers, body_len)
+            status, headers, body_len = self._head
+            available = self._end - self._start
+            if available >= body_len + 2:
+                body = bytes(self._view[self._start:self._start + body_len])
+                self._start = self._scan = self._start + body_len + 2
+                self._head = None
+                events.append((status, headers, body))
+            elif body_len + 2 > len(buf) - self._min_free:
+                self._big = bytearray(body_len + 2)
+                self._big[:available] = self._view[self._start:self._end]
+                self._big_end = available
+                self._start = self._end
+                break
+            else:
+                break
+        if self._start == self._end:
+            self._start = self._end = self._scan = 0
+        return events
+
+
 def handle_response(command, status, headers, body):
     expected_ok, expected_errors, parse = PROTOCOL[command]
     if status == expected_ok:
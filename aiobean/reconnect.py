@@ -0,0 +1,265 @@
+import asyncio
+import random
+from asyncio import CancelledError
+from functools import partial
+from aiobean.connection import (
+    Connection, ConnectionClosedError, _set_deadline, create_connection,
+)
+from aiobean.exc import BeanstalkException
+from aiobean.log import logger
+from aiobean.protocol import PROTOCOL, CommandsMixin, InvalidCommand, Job
+
+DEFAULT_TUBE = 'default'
+
+# commands that may be sent again when the connection is lost before their
+# response arrives. Jobs reserved by a connection go back to the ready
+# queue when it closes, so a reserve is safe to repeat too.
+SAFE_COMMANDS = frozenset([
+    'use', 'watch', 'ignore', 'reserve', 'reserve-with-timeout',
+    'peek', 'peek-ready', 'peek-delayed', 'peek-buried',
+    'stats', 'stats-job', 'stats-tube',
+    'list-tubes', 'list-tube-used', 'list-tubes-watched',
+])
+
+
+async def create_reconnecting_connection(host, port, loop=None,
+                                         retry_put=False, min_backoff=0.1,
+                                         max_backoff=10, **kwargs):
+    """
+    Extra keyword arguments are passed on to `create_connection`. The first
+    connection is made right away; failing it raises as usual.
+    """
+    if not loop:
+        loop = asyncio.get_event_loop()
+    conn = await create_connection(host, port, loop=loop, **kwargs)
+    return ReconnectingConnection(
+        conn, host, port, loop, retry_put, min_backoff, max_backoff, **kwargs)
+
+
+class ReconnectingConnection(CommandsMixin):
+    """
+    A connection that survives the server going away.
+
+    It remembers the tube in use and the tubes watched. When the socket
+    drops it reconnects, waiting a random delay of up to `min_backoff`,
+    doubled with every failed attempt up to `max_backoff` seconds, so a
+    fleet of clients does not stampede a restarted server. It then sends
+    ``use``/``watch``/``ignore`` to restore the session before anything
+    else, and carries on.
+
+    Commands issued while disconnected wait for the new connection.
+    Commands whose response was lost are sent again if that is harmless
+    (:data:`SAFE_COMMANDS`); the others fail with
+    :class:`~aiobean.connection.ConnectionClosedError`, as the server may
+    or may not have run them. beanstalkd has no way to deduplicate puts:
+    with `retry_put`, a lost ``put`` is sent again and may create a
+    duplicate job, so consumers have to be idempotent.
+
+    Jobs reserved over the lost connection are released by the server;
+    acks for them fail.
+    """
+
+    def __init__(self, conn, host, port, loop, retry_put=False,
+                 min_backoff=0.1, max_backoff=10, **kwargs):
+        self._address = (host, port)
+        self._loop = loop
+        self._conn_kwargs = kwargs
+        # bodies are encoded here and decoded by the connections
+        self.codec = kwargs.get('codec')
+        self._retry_put = retry_put
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._conn = conn
+        self._connected = asyncio.Event(loop=loop)
+        self._connected.set()
+        self._pending = []  # (command, args, body, waiter) to send
+        self._tube = DEFAULT_TUBE
+        self._watching = [DEFAULT_TUBE]
+        self._reconnects = 0
+        self._closed = False
+        self._task = asyncio.ensure_future(self._supervise(), loop=loop)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def connected(self):
+        return self._conn is not None and not self._conn.closed
+
+    @property
+    def reconnects(self):
+        """how many times the connection was made again"""
+        return self._reconnects
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._task.cancel()
+        if self._conn is not None:
+            self._conn.close()
+        pending, self._pending = self._pending, []
+        for entry in pending:
+            entry[3].cancel()
+        self._connected.set()  # wake up wait_writable
+
+    async def wait_closed(self):
+        await asyncio.wait([self._task], loop=self._loop)
+        if self._conn is not None:
+            await self._conn.wait_closed()
+
+    def execute(self, command, *args, body=None, deadline=None):
+        fut = self._execute_many([(command, args, body)])[0]
+        if deadline is not None:
+            # covers the time spent waiting for a new connection too
+            _set_deadline(self._loop, fut, command, deadline)
+        return fut
+
+    def _execute_many(self, commands):
+        if self._closed:
+            raise ConnectionClosedError(
+                'cannot execute command because the connection is closed')
+        for command, _, _ in commands:
+            if command not in PROTOCOL:
+                raise InvalidCommand
+        entries = [(command, args, body, self._loop.create_future())
+                   for command, args, body in commands]
+        if self._conn is None or self._pending:
+            self._pending.extend(entries)  # keep them in order
+        else:
+            self._send(entries)
+        return [entry[3] for entry in entries]
+
+    def _send(self, entries):
+        conn = self._conn
+        try:
+            waiters = conn._execute_many(
+                [entry[:3] for entry in entries])
+        except ConnectionClosedError:
+            # never written, so always safe to send again
+            self._pending.extend(entries)
+            return
+        for entry, waiter in zip(entries, waiters):
+            waiter.add_done_callback(partial(self._resolve, conn, entry))
+
+    def _resolve(self, conn, entry, waiter):
+        command, args, body, fut = entry
+        if waiter.cancelled() or (
+                conn.closed and
+                not isinstance(waiter.exception(), BeanstalkException)):
+            # lost with the connection
+            if fut.done():  # cancelled by the caller
+                return
+            if self._closed:
+                fut.cancel()
+            elif command in SAFE_COMMANDS or \
+                    (command == 'put' and self._retry_put):
+                logger.debug('reconnect: will retry %s', command)
+                self._pending.append(entry)
+            else:
+                fut.set_exception(ConnectionClosedError(
+                    'connection lost waiting for {} response'.format(command)))
+            return
+        if waiter.exception() is None:
+            # the session changed even if the caller stopped waiting
+            self._record(command, args, waiter.result())
+        if fut.done():
+            if command in ('reserve', 'reserve-with-timeout') and \
+                    waiter.exception() is None:
+                conn._abandon(waiter.result()[0])  # nobody wants the job
+            return
+        if waiter.exception() is not None:
+            fut.set_exception(waiter.exception())
+        else:
+            result = waiter.result()
+            if isinstance(result, Job):
+                result.conn = self  # acked over whichever connection is up
+            fut.set_result(result)
+
+    def _record(self, command, args, result):
+        if command == 'use':
+            self._tube = result
+        elif command == 'watch' and args[0] not in self._watching:
+            self._watching.append(args[0])
+        elif command == 'ignore' and args[0] in self._watching:
+            self._watching.remove(args[0])
+
+    async def wait_writable(self):
+        while True:
+            await self._connected.wait()
+            if self._closed:
+                raise ConnectionClosedError('the connection is closed')
+            conn = self._conn
+            try:
+                return await conn.wait_writable()
+            except ConnectionClosedError:
+                # lost; wait for the supervisor to notice
+                await conn.wait_closed()
+                await asyncio.sleep(0, loop=self._loop)
+
+    def _room(self):
+        return None if self._conn is None else self._conn._room()
+
+    pipeline = Connection.pipeline
+    put_many = Connection.put_many
+    delete_many = Connection.delete_many
+
+    async def _supervise(self):
+        while True:
+            await self._conn.wait_closed()
+            if self._closed:
+                return
+            logger.warning('reconnect: connection to %s:%s lost',
+                           *self._address)
+            self._conn = None
+            self._connected.clear()
+            self._conn = await self._reconnect()
+            self._reconnects += 1
+            if self._conn_kwargs.get('metrics') is not None:
+                self._conn_kwargs['metrics'].reconnected()
+            pending, self._pending = self._pending, []
+            pending = [entry for entry in pending if not entry[3].done()]
+            if pending:
+                self._send(pending)
+            self._connected.set()
+
+    def _session(self):
+        commands = []
+        if self._tube != DEFAULT_TUBE:
+            commands.append(('use', (self._tube,), None))
+        for tube in self._watching:
+            if tube != DEFAULT_TUBE:
+                commands.append(('watch', (tube,), None))
+        if DEFAULT_TUBE not in self._watching:
+            commands.append(('ignore', (DEFAULT_TUBE,), None))
+        return commands
+
+    async def _reconnect(self):
+        attempt = 0
+        while True:
+            delay = min(self._max_backoff, self._min_backoff * 2 ** attempt)
+            await asyncio.sleep(random.uniform(0, delay), loop=self._loop)
+            attempt += 1
+            try:
+                conn = await create_connection(
+                    *self._address, loop=self._loop, **self._conn_kwargs)
+            except OSError as e:
+                logger.warning('reconnect: attempt %d failed: %r', attempt, e)
+                continue
+            session = self._session()
+            if not session:
+                return conn
+            try:
+                waiters = conn._execute_many(session)
+                await asyncio.gather(*waiters, loop=self._loop)
+            except CancelledError:
+                conn.close()
+                raise
+            except Exception as e:
+                if conn.closed:
+                    logger.warning(
+                        'reconnect: lost restoring the session: %r', e)
+                    continue
+                logger.error('reconnect: cannot restore the session: %r', e)
+            return conn
@@ -0,0 +1,259 @@
+import asyncio
+import bisect
+import hashlib
+import itertools
+import math
+from collections import deque, namedtuple
+from functools import partial
+from aiobean.connection import create_connection, ConnectionClosedError
+from aiobean.protocol import CommandsMixin
+
+ROUND_ROBIN = 'round-robin'
+LEAST_LOADED = 'least-loaded'
+# points per server on the hash ring
+REPLICAS = 100
+
+JobId = namedtuple('JobId', 'shard id')
+JobId.__doc__ = 'a job id together with the index of the shard owning it'
+
+
+async def create_sharded_client(servers, balance=ROUND_ROBIN,
+                                replicas=REPLICAS, poll_interval=1,
+                                loop=None, **kwargs):
+    """
+    `servers` is a list of (host, port). Extra keyword arguments are passed
+    on to `create_connection`.
+    """
+    if not loop:
+        loop = asyncio.get_event_loop()
+    client = ShardedClient(servers, balance, replicas, poll_interval, loop)
+    try:
+        for host, port in servers:
+            # one connection to put on, one to reserve and ack on
+            for conns in (client._producers, client._consumers):
+                conns.append(await create_connection(
+                    host, port, loop=loop, **kwargs))
+    except BaseException:
+        client.close()
+        raise
+    return client
+
+
+class ShardedClient:
+    """
+    Spreads jobs over several independent beanstalkd servers::
+
+        client = await create_sharded_client(
+            [('10.0.0.1', 11300), ('10.0.0.2', 11300)], loop=loop)
+        await client.put(b'welcome', key='user:42')  # always the same shard
+        await client.put(b'resize')  # round-robin
+        job_id, body = await client.reserve()  # from any shard
+        await client.delete(job_id)  # on the shard that owns it
+
+    Job ids are only unique per server, so they are returned as
+    :class:`JobId` (shard, id) and the follow-up commands expect one.
+
+    Puts with a `key` go to the shard owning the key on a consistent hash
+    ring, so adding a server moves only about 1/n of the keys. Other puts
+    are spread `balance`: ``'round-robin'``, or ``'least-loaded'`` for the
+    shard with the fewest commands in flight.
+
+    :meth:`reserve` keeps one ``reserve-with-timeout`` of `poll_interval`
+    seconds in flight per shard and returns whichever job comes first.
+    Jobs the other shards hand out meanwhile are kept, reserved, for the
+    next calls, so at most one job per shard waits there; one nobody
+    takes within `poll_interval` seconds is released, so its TTR does not
+    run out meanwhile. Any number of calls may wait at once. Acks share a
+    connection with its shard's pending reserve and may wait up to
+    `poll_interval` seconds on an idle shard.
+    """
+
+    def __init__(self, servers, balance=ROUND_ROBIN, replicas=REPLICAS,
+                 poll_interval=1, loop=None):
+        if balance not in (ROUND_ROBIN, LEAST_LOADED):
+            raise ValueError('balance must be {!r} or {!r}'.format(
+                ROUND_ROBIN, LEAST_LOADED))
+        self._loop = loop or asyncio.get_event_loop()
+        self._balance = balance
+        self._poll_interval = poll_interval
+        self._producers = []
+        self._consumers = []
+        self._next = itertools.cycle(range(len(servers)))
+        self._ring = sorted(
+            (_hash('{}:{}-{}'.format(host, port, replica)), shard)
+            for shard, (host, port) in enumerate(servers)
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in self._ring]
+        self._reserving = {}  # shard -> its pending reserve
+        self._ready = deque()  # (JobId, body) reserved, not returned yet
+        self._expiry = {}  # JobId in _ready -> timer releasing it
+        self._errors = deque()
+        self._waiters = deque()  # one per reserve call waiting
+
+    @property
+    def shards(self):
+        """number of servers"""
+        return len(self._producers)
+
+    def shard_for(self, key):
+        """index of the shard owning `key` (str or bytes)"""
+        index = bisect.bisect(self._points, _hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+    def _pick(self):
+        if self._balance == LEAST_LOADED:
+            return min(range(self.shards),
+                       key=lambda shard: len(self._producers[shard]._queue))
+        return next(self._next)
+
+    async def put(self, body, pri=CommandsMixin.DEFAULT_PRI, delay=0,
+                  ttr=CommandsMixin.DEFAULT_TTR, key=None):
+        shard = self._pick() if key is None else self.shard_for(key)
+        id = await self._producers[shard].put(body, pri, delay, ttr)
+        return JobId(shard, id)
+
+    def use(self, tube):
+        return self._broadcast(self._producers, 'use', tube)
+
+    def watch(self, tube):
+        return self._broadcast(self._consumers, 'watch', tube)
+
+    def ignore(self, tube):
+        return self._broadcast(self._consumers, 'ignore', tube)
+
+    async def _broadcast(self, conns, command, *args):
+        results = await asyncio.gather(
+            *[getattr(conn, command)(*args) for conn in conns],
+            loop=self._loop)
+        return results[0]
+
+    def delete(self, job_id):
+        return self._consumers[job_id.shard].delete(job_id.id)
+
+    def release(self, job_id, pri=CommandsMixin.DEFAULT_PRI, delay=0):
+        return self._consumers[job_id.shard].release(job_id.id, pri, delay)
+
+    def bury(self, job_id, pri=CommandsMixin.DEFAULT_PRI):
+        return self._consumers[job_id.shard].bury(job_id.id, pri)
+
+    def touch(self, job_id):
+        return self._consumers[job_id.shard].touch(job_id.id)
+
+    def stats_job(self, job_id):
+        return self._producers[job_id.shard].stats_job(job_id.id)
+
+    async def reserve(self, timeout=None):
+        """
+        Returns (JobId, body) from the first shard that has a job, or None
+        if none has one within `timeout` seconds, rounded up to a whole
+        second.
+        """
+        deadline = None if timeout is None else self._loop.time() + timeout
+        mine = set()  # reserves sent by this call
+        first = True
+        while True:
+            if self._ready:
+                job = self._ready.popleft()
+                self._expiry.pop(job[0]).cancel()
+                return job
+            if self._errors:
+                raise self._errors.popleft()
+            if self._closed_shards() == self.shards:
+                raise ConnectionClosedError('all shards are closed')
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - self._loop.time())
+            if remaining is None or remaining > 0 or first:
+                mine.update(self._reserve_all(remaining))
+                first = False
+            elif mine.intersection(self._reserving):
+                remaining = None  # wait for the answers to our reserves
+            else:
+                return None
+            waiter = self._loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait(
+                    [waiter], timeout=remaining, loop=self._loop)
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    self._wakeup()  # pass the job on to another call
+                raise
+            finally:
+                waiter.cancel()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+
+    def _closed_shards(self):
+        return sum(1 for conn in self._consumers if conn.closed)
+
+    def _reserve_all(self, remaining):
+        poll = self._poll_interval
+        if remaining is not None:
+            # beanstalkd only takes whole seconds
+            poll = min(poll, math.ceil(remaining))
+        sent = []
+        for shard, conn in enumerate(self._consumers):
+            if shard in self._reserving or conn.closed:
+                continue
+            fut = self._reserving[shard] = conn.reserve(poll)
+            fut.add_done_callback(partial(self._reserved, shard))
+            sent.append(shard)
+        return sent
+
+    def _reserved(self, shard, fut):
+        del self._reserving[shard]
+        if fut.cancelled():
+            return
+        if fut.exception() is not None:
+            if not self._consumers[shard].closed:
+                self._errors.append(fut.exception())
+        elif fut.result() is not None:
+            id, body = fut.result()
+            job_id = JobId(shard, id)
+            self._ready.append((job_id, body))
+            self._expiry[job_id] = self._loop.call_later(
+                self._poll_interval, self._expire, job_id)
+            self._wakeup()
+            return
+        # no job: every call waiting may have to send its reserves again
+        while self._waiters:
+            self._wakeup()
+
+    def _wakeup(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def _expire(self, job_id):
+        del self._expiry[job_id]
+        self._ready = deque(job for job in self._ready if job[0] != job_id)
+        conn = self._consumers[job_id.shard]
+        if not conn.closed:
+            conn._abandon(job_id.id)
+
+    def close(self):
+        # reserved jobs go back to the ready queue with the connections
+        for conn in self._producers + self._consumers:
+            conn.close()
+        self._ready.clear()
+        for timer in self._expiry.values():
+            timer.cancel()
+        self._expiry.clear()
+        while self._waiters:
+            self._waiters.popleft().cancel()
+
+    async def wait_closed(self):
+        for conn in self._producers + self._consumers:
+            await conn.wait_closed()
+
+
+def _hash(key):
+    if isinstance(key, str):
+        key = key.encode()
+    return int.from_bytes(hashlib.md5(key).digest()[:8], 'big')
@@ -0,0 +1,256 @@
+"""
+Using more than one core: :class:`Supervisor` runs a
+:class:`~aiobean.worker.Worker` in each of several processes, and
+:class:`ProcessPoolHandler` keeps the reserving in one process and runs
+the handlers in a pool of others.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from aiobean.connection import create_connection
+from aiobean.log import logger
+from aiobean.worker import Worker
+
+HEARTBEAT_INTERVAL = 1.0
+
+
+def _child(handler, address, tubes, connections, connection_kwargs,
+           worker_kwargs, shutdown_timeout, heartbeat):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    executor = None
+    if not asyncio.iscoroutinefunction(handler):
+        # in threads, so the loop still beats and hears signals meanwhile
+        func = handler
+        executor = ThreadPoolExecutor(worker_kwargs.get('concurrency', 1))
+
+        def handler(id, body):
+            return loop.run_in_executor(executor, func, id, body)
+    conns = [
+        loop.run_until_complete(create_connection(
+            *address, loop=loop, **connection_kwargs))
+        for _ in range(connections)
+    ]
+    worker = Worker(handler, conns, tubes=tubes, loop=loop, **worker_kwargs)
+    loop.add_signal_handler(signal.SIGTERM, worker.close, shutdown_timeout)
+    loop.add_signal_handler(signal.SIGINT, worker.close, shutdown_timeout)
+
+    async def beat():
+        while True:
+            heartbeat.value = time.monotonic()
+            await asyncio.sleep(HEARTBEAT_INTERVAL, loop=loop)
+
+    beating = asyncio.ensure_future(beat(), loop=loop)
+    try:
+        loop.run_until_complete(worker.run())
+    finally:
+        beating.cancel()
+        for conn in conns:
+            conn.close()
+            loop.run_until_complete(conn.wait_closed())
+        loop.close()
+    if executor is not None:
+        # handlers still running were given up on and their jobs released;
+        # their threads must not keep the process around
+        executor.shutdown(wait=False)
+        logging.shutdown()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(0)
+
+
+class _Slot:
+    __slots__ = ('index', 'process', 'heartbeat', 'started', 'failures',
+                 'restart_at')
+
+    def __init__(self, index, heartbeat):
+        self.index = index
+        self.process = None
+        self.heartbeat = heartbeat
+        self.started = None
+        self.failures = 0
+        self.restart_at = None
+
+
+class Supervisor:
+    """
+    Runs `processes` worker processes, each with its own connections and
+    :class:`~aiobean.worker.Worker`::
+
+        def handler(id, body):  # or a coroutine function
+            ...
+
+        supervisor = Supervisor(handler, ('127.0.0.1', 11300),
+                                processes=32, tubes=['render'], loop=loop)
+        loop.add_signal_handler(signal.SIGTERM, supervisor.close)
+        await supervisor.run()
+
+    `handler` is sent to the processes, so it has to be picklable, i.e. a
+    module level function. It may be a plain, blocking function: it then
+    runs in threads of its process, up to the worker's `concurrency`.
+    `worker_kwargs` go to the :class:`~aiobean.worker.Worker` and
+    `connection_kwargs` to :func:`~aiobean.connection.create_connection`.
+
+    A process that dies is started again, after a delay doubling with each
+    crash in a row up to `max_backoff` seconds. A process that has not
+    beaten its heartbeat for `heartbeat_timeout` seconds, its event loop
+    being stuck, is killed and started again; None disables that.
+
+    :meth:`close` asks every process to stop: they stop reserving, give
+    their handlers `shutdown_timeout` seconds and release the jobs still
+    running. Processes still there after that are killed, and the server
+    releases their jobs.
+
+    Processes are started with `context`, ``'spawn'`` by default.
+    """
+
+    def __init__(self, handler, address, processes=None, tubes=('default',),
+                 connections=1, worker_kwargs=None, connection_kwargs=None,
+                 shutdown_timeout=10, heartbeat_timeout=60, min_backoff=0.1,
+                 max_backoff=30, check_interval=0.5, context='spawn',
+                 loop=None):
+        self._handler = handler
+        self._address = tuple(address)
+        self._processes = processes or multiprocessing.cpu_count()
+        self._tubes = list(tubes)
+        self._connections = connections
+        self._worker_kwargs = worker_kwargs or {}
+        self._connection_kwargs = connection_kwargs or {}
+        self._shutdown_timeout = shutdown_timeout
+        self._heartbeat_timeout = heartbeat_timeout
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._check_interval = check_interval
+        self._context = multiprocessing.get_context(context)
+        self._loop = loop or asyncio.get_event_loop()
+        self._slots = []
+        self._closing = False
+        self._wakeup = asyncio.Event(loop=self._loop)
+        self.restarts = 0
+
+    @property
+    def alive(self):
+        """number of worker processes running"""
+        return sum(1 for slot in self._slots
+                   if slot.process is not None and slot.process.is_alive())
+
+    def pids(self):
+        return [slot.process.pid for slot in self._slots
+                if slot.process is not None and slot.process.is_alive()]
+
+    async def run(self):
+        """supervise the processes until :meth:`close` is called"""
+        self._slots = [_Slot(index, self._context.Value('d', 0.0))
+                       for index in range(self._processes)]
+        for slot in self._slots:
+            self._start(slot)
+        try:
+            while not self._closing:
+                self._check()
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), self._check_interval,
+                        loop=self._loop)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self._stop()
+
+    def close(self):
+        self._closing = True
+        self._wakeup.set()
+
+    def _start(self, slot):
+        slot.heartbeat.value = time.monotonic()
+        slot.process = self._context.Process(
+            target=_child, name='aiobean-worker-{}'.format(slot.index),
+            args=(self._handler, self._address, self._tubes,
+                  self._connections, self._connection_kwargs,
+                  self._worker_kwargs, self._shutdown_timeout,
+                  slot.heartbeat),
+            daemon=True)
+        slot.process.start()
+        slot.started = self._loop.time()
+        slot.restart_at = None
+        logger.info('supervisor: started worker %d, pid %d',
+                    slot.index, slot.process.pid)
+
+    def _check(self):
+        now = self._loop.time()
+        for slot in self._slots:
+            process = slot.process
+            if slot.restart_at is not None:
+                if now >= slot.restart_at:
+                    self.restarts += 1
+                    self._start(slot)
+                continue
+            if not process.is_alive():
+                process.join()
+                if now - slot.started > self._max_backoff:
+                    slot.failures = 0  # it ran long enough
+                delay = min(self._max_backoff,
+                            self._min_backoff * 2 ** slot.failures)
+                slot.failures += 1
+                slot.restart_at = now + delay
+                logger.error('supervisor: worker %d exited with %s, '
+                             'restarting in %.1fs',
+                             slot.index, process.exitcode, delay)
+            elif self._heartbeat_timeout is not None and \
+                    time.monotonic() - slot.heartbeat.value > \
+                    self._heartbeat_timeout:
+                logger.error('supervisor: worker %d is not responding, '
+                             'killing it', slot.index)
+                os.kill(process.pid, signal.SIGKILL)
+
+    async def _stop(self):
+        processes = [slot.process for slot in self._slots
+                     if slot.process is not None and slot.process.is_alive()]
+        for process in processes:
+            process.terminate()  # SIGTERM: graceful shutdown
+        # the handlers' time, plus some for releasing and closing
+        deadline = self._loop.time() + self._shutdown_timeout + 5
+        while any(p.is_alive() for p in processes) and \
+                self._loop.time() < deadline:
+            await asyncio.sleep(0.05, loop=self._loop)
+        for process in processes:
+            if process.is_alive():
+                logger.warning('supervisor: killing worker pid %d',
+                               process.pid)
+                os.kill(process.pid, signal.SIGKILL)
+            process.join()
+
+
+class ProcessPoolHandler:
+    """
+    A :class:`~aiobean.worker.Worker` handler running `func(id, body)` in a
+    pool of `max_workers` processes, while reserving and acking stay on
+    the event loop::
+
+        handler = ProcessPoolHandler(render, max_workers=32, loop=loop)
+        worker = Worker(handler, conns, concurrency=32, loop=loop)
+        await worker.run()
+        handler.close()
+
+    `func` has to be picklable, and so do bodies, which are copied to
+    bytes first. Give the worker a `concurrency` of at least `max_workers`
+    to keep the pool busy.
+    """
+
+    def __init__(self, func, max_workers=None, executor=None, loop=None):
+        self._func = func
+        self._executor = executor or ProcessPoolExecutor(max_workers)
+        self._loop = loop or asyncio.get_event_loop()
+
+    def __call__(self, id, body):
+        if isinstance(body, (bytearray, memoryview)):
+            body = bytes(body)
+        return self._loop.run_in_executor(
+            self._executor, self._func, id, body)
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,149 @@
+"""
+A blocking client for threaded programs::
+
+    client = Client('127.0.0.1', 11300)
+    id = client.put(b'hi')  # from any thread
+    id, body = client.reserve()
+    client.delete(id)
+    client.close()
+
+It runs an event loop in a thread of its own, and commands from every
+thread are pipelined over the same few connections.
+"""
+import asyncio
+import threading
+from concurrent.futures import CancelledError, Future
+from functools import partial
+from aiobean.client import create_client
+from aiobean.connection import ConnectionClosedError
+from aiobean.protocol import CommandsMixin, Job
+
+
+def _copy_result(client, fut, waiter):
+    if waiter.cancelled():
+        fut.set_exception(CancelledError())
+    elif waiter.exception() is not None:
+        fut.set_exception(waiter.exception())
+    else:
+        result = waiter.result()
+        if isinstance(result, Job):
+            result.conn = client  # so its methods block too
+        fut.set_result(result)
+
+
+class Client(CommandsMixin):
+    """
+    The commands of :class:`~aiobean.protocol.CommandsMixin`, blocking
+    until their response arrives and safe to call from any thread.
+
+    Commands go through an :class:`aiobean.client.Client` with
+    `connections` shared connections: a thread blocked in ``reserve``
+    has a connection of its own and holds up nobody else. Extra keyword
+    arguments are passed on to :func:`aiobean.client.create_client`,
+    e.g. `max_reserving` to bound how many threads reserve at once.
+
+    `deadline` is the default for commands called without one, in
+    seconds; ``asyncio.TimeoutError`` is raised when it passes. A
+    command interrupted by :meth:`close` raises
+    ``concurrent.futures.CancelledError``.
+    """
+
+    def __init__(self, host, port, connections=2, deadline=None, **kwargs):
+        # bodies are encoded by the calling threads, decoded by the loop's
+        self.codec = kwargs.get('codec')
+        self._deadline = deadline
+        self._closed = False
+        # held while checking _closed and handing a command to the loop, so
+        # that close cannot stop the loop in between
+        self._lock = threading.Lock()
+        self._pending = set()  # futures of the commands not answered yet
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run_loop, name='aiobean-sync', daemon=True)
+        self._thread.start()
+        try:
+            self._client = self._run(create_client(
+                host, port, shared=connections, loop=self._loop, **kwargs))
+        except BaseException:
+            self._stop()
+            raise
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _call(self, call):
+        """run the coroutine `call` returns in the loop, and wait for it"""
+        with self._lock:
+            if self._closed:
+                raise ConnectionClosedError(
+                    'cannot execute command because the connection is '
+                    'closed')
+            fut = Future()
+            self._pending.add(fut)
+            fut.add_done_callback(self._forget)
+            self._loop.call_soon_threadsafe(self._submit, fut, call)
+        return fut.result()
+
+    def _forget(self, fut):
+        with self._lock:
+            self._pending.discard(fut)
+
+    def _submit(self, fut, call):
+        try:
+            waiter = asyncio.ensure_future(call(), loop=self._loop)
+        except Exception as e:
+            fut.set_exception(e)
+        else:
+            waiter.add_done_callback(partial(_copy_result, self, fut))
+
+    def execute(self, command, *args, body=None, deadline=None):
+        if deadline is None:
+            deadline = self._deadline
+        return self._call(partial(
+            self._client.execute, command, *args, body=body,
+            deadline=deadline))
+
+    def put_many(self, bodies, pri=CommandsMixin.DEFAULT_PRI, delay=0,
+                 ttr=CommandsMixin.DEFAULT_TTR):
+        """put all `bodies` in one write and return their ids"""
+        return self._call(partial(
+            self._client.put_many, list(bodies), pri, delay, ttr))
+
+    def close(self):
+        """close the connections and stop the loop's thread"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        try:
+            self._run(self._close())
+        finally:
+            self._stop()
+            # commands the loop stopped before answering
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            for fut in pending:
+                fut.cancel()
+
+    async def _close(self):
+        self._client.close()
+        await self._client.wait_closed()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,848 @@
+"""
+An in-process, beanstalkd compatible server for tests and load tests.
+
+:class:`FakeServer` speaks every command in :data:`aiobean.protocol.PROTOCOL`
+over a real socket, so anything built on
+:class:`aiobean.connection.Connection` can run against it without an
+external ``beanstalkd`` binary::
+
+    async with FakeServer(loop=loop) as server:
+        conn = await create_connection(*server.address, loop=loop)
+
+Ready jobs live in a priority heap per tube; delayed jobs, reservation
+deadlines and reserve timeouts share a single timer. Heaps are cleaned up
+lazily: stale entries are skipped when they reach the top.
+
+It also runs as a process taking beanstalkd's ``-l``, ``-p`` and ``-z``
+options::
+
+    python -m aiobean.testing -p 11300
+"""
+import argparse
+import asyncio
+import heapq
+import itertools
+import os
+import socket
+import time
+from collections import OrderedDict, deque
+from aiobean.log import logger
+
+READY = 'ready'
+DELAYED = 'delayed'
+RESERVED = 'reserved'
+BURIED = 'buried'
+
+MAX_JOB_SIZE = 65535
+MAX_TUBE_NAME = 200
+URGENT_PRI = 1024
+SAFETY_MARGIN = 1.0  # seconds before a deadline when DEADLINE_SOON is sent
+
+_CRLF = b'\r\n'
+_NOT_FOUND = b'NOT_FOUND\r\n'
+_BAD_FORMAT = b'BAD_FORMAT\r\n'
+
+
+class _Job:
+    __slots__ = (
+        'id', 'pri', 'delay', 'ttr', 'body', 'tube', 'state', 'created',
+        'ready_at', 'deadline', 'owner', 'buried_seq',
+        'reserves', 'timeouts', 'releases', 'buries', 'kicks',
+    )
+
+    def __init__(self, id, pri, delay, ttr, body, tube, now):
+        self.id = id
+        self.pri = pri
+        self.delay = delay
+        self.ttr = ttr
+        self.body = body
+        self.tube = tube
+        self.state = None
+        self.created = now
+        self.ready_at = 0
+        self.deadline = 0
+        self.owner = None
+        self.buried_seq = 0
+        self.reserves = 0
+        self.timeouts = 0
+        self.releases = 0
+        self.buries = 0
+        self.kicks = 0
+
+
+class _Tube:
+    __slots__ = (
+        'name', 'ready', 'delayed', 'buried', 'counts', 'waiting',
+        'using', 'watching', 'total_jobs', 'cmd_delete', 'cmd_pause',
+        'pause', 'paused_until',
+    )
+
+    def __init__(self, name):
+        self.name = name
+        self.ready = []  # heap of (pri, id)
+        self.delayed = []  # heap of (ready_at, id)
+        self.buried = OrderedDict()  # id -> job, in the order buried
+        self.counts = dict.fromkeys((READY, DELAYED, RESERVED, BURIED), 0)
+        self.counts['urgent'] = 0
+        self.waiting = deque()  # clients blocked in reserve
+        self.using = 0
+        self.watching = 0
+        self.total_jobs = 0
+        self.cmd_delete = 0
+        self.cmd_pause = 0
+        self.pause = 0
+        self.paused_until = 0
+
+    @property
+    def unused(self):
+        return not (self.using or self.watching or any(
+            self.counts[s] for s in (READY, DELAYED, RESERVED, BURIED)))
+
+
+class _Client(asyncio.Protocol):
+
+    def __init__(self, server):
+        self._server = server
+        self.transport = None
+        self.using = None
+        self.watching = []
+        self.reserved = set()
+        self.waiting = False
+        self.wait_deadline = None
+        self.wait_seq = 0
+        self._buffer = bytearray()
+        self._out = []
+        self._put = None  # pending put header while waiting for its body
+
+    # asyncio callbacks
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._server._connect(self)
+
+    def connection_lost(self, exc):
+        self._server._disconnect(self)
+        self.transport = None
+
+    def data_received(self, data):
+        self._buffer += data
+        self.process()
+
+    # command processing
+
+    def process(self):
+        """Handle every complete command in the buffer, unless blocked."""
+        buf = self._buffer
+        pos = 0
+        while not self.waiting:
+            if self._put is not None:
+                size = self._put[-1]
+                if len(buf) - pos < size + 2:
+                    break
+                body = bytes(buf[pos:pos + size])
+                crlf = buf[pos + size:pos + size + 2]
+                pos += size + 2
+                header, self._put = self._put, None
+                if crlf != _CRLF:
+                    self.reply(b'EXPECTED_CRLF\r\n')
+                else:
+                    self._server._put(self, body, *header[:-1])
+                continue
+            eol = buf.find(b'\r\n', pos)
+            if eol < 0:
+                if len(buf) - pos > 224:
+                    pos = len(buf)
+                    self.reply(_BAD_FORMAT)
+                break
+            line = bytes(buf[pos:eol])
+            pos = eol + 2
+            self._server._dispatch(self, line)
+        if pos:
+            del buf[:pos]
+        self.flush()
+
+    def expect_body(self, pri, delay, ttr, size):
+        self._put = (pri, delay, ttr, size)
+
+    def reply(self, data):
+        self._out.append(data)
+
+    def flush(self):
+        if self._out and self.transport is not None:
+            self.transport.writelines(self._out)
+        self._out = []
+
+
+class FakeServer:
+    """A beanstalkd stand-in running on the current event loop."""
+
+    def __init__(self, host='127.0.0.1', port=0, loop=None,
+                 max_job_size=MAX_JOB_SIZE):
+        self._host = host
+        self._port = port
+        self._loop = loop or asyncio.get_event_loop()
+        self._server = None
+        self.max_job_size = max_job_size
+        self._started = time.time()
+        self._ids = itertools.count(1)
+        self._jobs = {}
+        self._tubes = OrderedDict()
+        self._clients = set()
+        self._timers = []  # heap of (when, seq, kind, ref)
+        self._timer_seq = itertools.count()
+        self._timer = None
+        self._timer_at = None
+        self._buried_seq = itertools.count()
+        self._cmd_counts = {}
+        self._total_jobs = 0
+        self._job_timeouts = 0
+        self._total_connections = 0
+        self._id = os.urandom(8).hex()
+        self._tube('default')
+
+    @property
+    def address(self):
+        return self._host, self._port
+
+    async def start(self):
+        self._server = await self._loop.create_server(
+            lambda: _Client(self), self._host, self._port)
+        sock = self._server.sockets[0]
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._port = sock.getsockname()[1]
+        logger.info('fake server listening on %s:%s', *self.address)
+        return self
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._server is not None:
+            self._server.close()
+        for client in list(self._clients):
+            if client.transport is not None:
+                client.transport.close()
+
+    async def wait_closed(self):
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+        await self.wait_closed()
+
+    # bookkeeping
+
+    def _now(self):
+        return self._loop.time()
+
+    def _tube(self, name):
+        tube = self._tubes.get(name)
+        if tube is None:
+            tube = self._tubes[name] = _Tube(name)
+        return tube
+
+    def _gc_tube(self, tube):
+        if tube.name != 'default' and tube.unused:
+            self._tubes.pop(tube.name, None)
+
+    def _connect(self, client):
+        self._clients.add(client)
+        self._total_connections += 1
+        client.using = self._tube('default')
+        client.using.using += 1
+        client.watching = [client.using]
+        client.using.watching += 1
+
+    def _disconnect(self, client):
+        self._clients.discard(client)
+        self._stop_waiting(client)
+        for job in [self._jobs[id] for id in client.reserved]:
+            self._make_ready(job)
+        client.reserved.clear()
+        client.using.using -= 1
+        self._gc_tube(client.using)
+        for tube in client.watching:
+            tube.watching -= 1
+            self._gc_tube(tube)
+        self._wake()
+
+    def _set_state(self, job, state):
+        tube = job.tube
+        if job.state is not None:
+            tube.counts[job.state] -= 1
+            if job.state == READY and job.pri < URGENT_PRI:
+                tube.counts['urgent'] -= 1
+        job.state = state
+        if state is not None:
+            tube.counts[state] += 1
+            if state == READY and job.pri < URGENT_PRI:
+                tube.counts['urgent'] += 1
+
+    def _make_ready(self, job):
+        if job.state == RESERVED and job.owner is not None:
+            job.owner.reserved.discard(job.id)
+        job.owner = None
+        self._set_state(job, READY)
+        heapq.heappush(job.tube.ready, (job.pri, job.id))
+
+    def _make_delayed(self, job, delay):
+        job.ready_at = self._now() + delay
+        job.delay = delay
+        self._set_state(job, DELAYED)
+        heapq.heappush(job.tube.delayed, (job.ready_at, job.id))
+        self._add_timer(job.ready_at, DELAYED, job)
+
+    def _make_buried(self, job):
+        self._set_state(job, BURIED)
+        job.buried_seq = next(self._buried_seq)
+        job.tube.buried[job.id] = job
+
+    def _remove(self, job):
+        tube = job.tube
+        if job.state == BURIED:
+            tube.buried.pop(job.id, None)
+        elif job.state == RESERVED and job.owner is not None:
+            job.owner.reserved.discard(job.id)
+        self._set_state(job, None)
+        del self._jobs[job.id]
+        self._gc_tube(tube)
+
+    def _peek_ready(self, tube):
+        heap = tube.ready
+        jobs = self._jobs
+        while heap:
+            pri, id = heap[0]
+            job = jobs.get(id)
+            if job is not None and job.state == READY and job.pri == pri \
+                    and job.tube is tube:
+                return job
+            heapq.heappop(heap)
+        return None
+
+    def _peek_delayed(self, tube):
+        heap = tube.delayed
+        jobs = self._jobs
+        while heap:
+            ready_at, id = heap[0]
+            job = jobs.get(id)
+            if job is not None and job.state == DELAYED \
+                    and job.ready_at == ready_at:
+                return job
+            heapq.heappop(heap)
+        return None
+
+    # timers
+
+    def _add_timer(self, when, kind, ref):
+        heapq.heappush(self._timers, (when, next(self._timer_seq), kind, ref))
+        if self._timer_at is None or when < self._timer_at:
+            self._arm(when)
+
+    def _arm(self, when):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_at = when
+        self._timer = self._loop.call_at(when, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = self._timer_at = None
+        now = self._now()
+        timers = self._timers
+        touched = set()
+        while timers and timers[0][0] <= now:
+            when, _, kind, ref = heapq.heappop(timers)
+            if kind == DELAYED:
+                if ref.state == DELAYED and ref.ready_at == when:
+                    self._make_ready(ref)
+            elif kind == RESERVED:
+                if ref.state == RESERVED and ref.deadline == when:
+                    owner = ref.owner
+                    ref.timeouts += 1
+                    self._job_timeouts += 1
+                    self._make_ready(ref)
+                    if owner is not None:
+                        touched.add(owner)
+            elif kind == 'soon':
+                client, seq = ref
+                if client.waiting and client.wait_seq == seq \
+                        and self._deadline_soon(client):
+                    self._stop_waiting(client)
+                    client.reply(b'DEADLINE_SOON\r\n')
+                    touched.add(client)
+            elif kind == 'wait':
+                client, seq = ref
+                if client.waiting and client.wait_seq == seq:
+                    self._stop_waiting(client)
+                    client.reply(b'TIMED_OUT\r\n')
+                    touched.add(client)
+            elif kind == 'pause':
+                if ref.paused_until == when:
+                    ref.paused_until = 0
+                    ref.pause = 0
+        self._wake(touched)
+        if timers:
+            self._arm(timers[0][0])
+
+    # reserving
+
+    def _deadline_soon(self, client):
+        now = self._now()
+        jobs = self._jobs
+        return any(jobs[id].deadline - now <= SAFETY_MARGIN
+                   for id in client.reserved)
+
+    def _next_for(self, client):
+        best = None
+        now = self._now()
+        for tube in client.watching:
+            if tube.paused_until and tube.paused_until > now:
+                continue
+            job = self._peek_ready(tube)
+            if job is not None and (
+                    best is None or (job.pri, job.id) < (best.pri, best.id)):
+                best = job
+        return best
+
+    def _reserve(self, client, job):
+        heapq.heappop(job.tube.ready)
+        self._set_state(job, RESERVED)
+        job.owner = client
+        job.reserves += 1
+        job.deadline = self._now() + job.ttr
+        client.reserved.add(job.id)
+        self._add_timer(job.deadline, RESERVED, job)
+        client.reply(b'RESERVED %d %d\r\n' % (job.id, len(job.body)))
+        client.reply(job.body)
+        client.reply(_CRLF)
+
+    def _start_waiting(self, client, timeout):
+        client.waiting = True
+        client.wait_seq += 1
+        for tube in client.watching:
+            tube.waiting.append(client)
+        if timeout is not None:
+            self._add_timer(
+                self._now() + timeout, 'wait', (client, client.wait_seq))
+        if client.reserved:
+            soon = min(self._jobs[id].deadline for id in client.reserved)
+            self._add_timer(
+                soon - SAFETY_MARGIN, 'soon', (client, client.wait_seq))
+
+    def _stop_waiting(self, client):
+        if client.waiting:
+            client.waiting = False
+            for tube in client.watching:
+                try:
+                    tube.waiting.remove(client)
+                except ValueError:
+                    pass
+
+    def _wake(self, touched=()):
+        """Hand ready jobs to blocked clients and resume their input."""
+        touched = set(touched)
+        for tube in list(self._tubes.values()):
+            while tube.waiting:
+                client = tube.waiting[0]
+                job = self._next_for(client)
+                if job is None:
+                    break
+                self._stop_waiting(client)
+                self._reserve(client, job)
+                touched.add(client)
+        for client in touched:
+            if client.transport is not None:
+                client.process()
+
+    # commands
+
+    def _dispatch(self, client, line):
+        name, *args = line.split() or [b'']
+        try:
+            command = _COMMANDS[name]
+        except KeyError:
+            client.reply(b'UNKNOWN_COMMAND\r\n')
+            return
+        self._cmd_counts[name] = self._cmd_counts.get(name, 0) + 1
+        try:
+            command(self, client, *args)
+        except (TypeError, ValueError):
+            client.reply(_BAD_FORMAT)
+
+    def _int(self, value, limit=2 ** 32):
+        value = int(value)
+        if value < 0 or value >= limit:
+            raise ValueError(value)
+        return value
+
+    def _pri(self, value):
+        # like beanstalkd's strtoul based parsing, priorities wrap at 2**32
+        return self._int(value, 2 ** 64) & 0xffffffff
+
+    def _name(self, value):
+        name = value.decode()
+        if len(name) > MAX_TUBE_NAME or name.startswith('-'):
+            raise ValueError(name)
+        return name
+
+    def cmd_put(self, client, pri, delay, ttr, size):
+        pri, delay, ttr, size = (
+            self._pri(pri), self._int(delay), self._int(ttr), self._int(size))
+        if size > self.max_job_size:
+            client.reply(b'JOB_TOO_BIG\r\n')
+            # the body still has to be skipped
+            client.expect_body(None, None, None, size)
+            return
+        client.expect_body(pri, delay, ttr, size)
+
+    def _put(self, client, body, pri, delay, ttr):
+        if pri is None:  # skipped oversized body
+            return
+        job = _Job(next(self._ids), pri, delay, max(ttr, 1), body,
+                   client.using, self._now())
+        self._jobs[job.id] = job
+        self._total_jobs += 1
+        job.tube.total_jobs += 1
+        if delay:
+            self._make_delayed(job, delay)
+        else:
+            self._make_ready(job)
+        client.reply(b'INSERTED %d\r\n' % job.id)
+        if job.tube.waiting:
+            self._wake()
+
+    def cmd_use(self, client, name):
+        tube = self._tube(self._name(name))
+        old, client.using = client.using, tube
+        tube.using += 1
+        old.using -= 1
+        self._gc_tube(old)
+        client.reply(b'USING ' + name + _CRLF)
+
+    def cmd_reserve(self, client, timeout=None):
+        if timeout is not None:
+            # beanstalkd stops parsing the timeout at the first non digit
+            timeout = self._int(timeout.split(b'.')[0] or b'0')
+        job = self._next_for(client)
+        if job is not None:
+            self._reserve(client, job)
+        elif self._deadline_soon(client):
+            client.reply(b'DEADLINE_SOON\r\n')
+        elif timeout == 0:
+            client.reply(b'TIMED_OUT\r\n')
+        else:
+            self._start_waiting(client, timeout)
+
+    def cmd_reserve_with_timeout(self, client, timeout):
+        self.cmd_reserve(client, timeout)
+
+    def _owned(self, client, id):
+        job = self._jobs.get(self._int(id, 2 ** 64))
+        if job is None or job.state != RESERVED or job.owner is not client:
+            return None
+        return job
+
+    def cmd_delete(self, client, id):
+        job = self._jobs.get(self._int(id, 2 ** 64))
+        if job is None or (job.state == RESERVED and job.owner is not client):
+            client.reply(_NOT_FOUND)
+            return
+        job.tube.cmd_delete += 1
+        self._remove(job)
+        client.reply(b'DELETED\r\n')
+
+    def cmd_release(self, client, id, pri, delay):
+        job = self._owned(client, id)
+        pri, delay = self._pri(pri), self._int(delay)
+        if job is None:
+            client.reply(_NOT_FOUND)
+            return
+        client.reserved.discard(job.id)
+        job.owner = None
+        job.releases += 1
+        job.pri = pri
+        if delay:
+            self._make_delayed(job, delay)
+        else:
+            self._make_ready(job)
+            self._wake()
+        client.reply(b'RELEASED\r\n')
+
+    def cmd_bury(self, client, id, pri):
+        job = self._owned(client, id)
+        pri = self._pri(pri)
+        if job is None:
+            client.reply(_NOT_FOUND)
+            return
+        client.reserved.discard(job.id)
+        job.owner = None
+        job.buries += 1
+        job.pri = pri
+        self._make_buried(job)
+        client.reply(b'BURIED\r\n')
+
+    def cmd_touch(self, client, id):
+        job = self._owned(client, id)
+        if job is None:
+            client.reply(_NOT_FOUND)
+            return
+        job.deadline = self._now() + job.ttr
+        self._add_timer(job.deadline, RESERVED, job)
+        client.reply(b'TOUCHED\r\n')
+
+    def cmd_watch(self, client, name):
+        tube = self._tube(self._name(name))
+        if tube not in client.watching:
+            client.watching.append(tube)
+            tube.watching += 1
+        client.reply(b'WATCHING %d\r\n' % len(client.watching))
+
+    def cmd_ignore(self, client, name):
+        tube = self._tubes.get(self._name(name))
+        if tube in client.watching:
+            if len(client.watching) == 1:
+                client.reply(b'NOT_IGNORED\r\n')
+                return
+            client.watching.remove(tube)
+            tube.watching -= 1
+            self._gc_tube(tube)
+        client.reply(b'WATCHING %d\r\n' % len(client.watching))
+
+    def _found(self, client, job):
+        if job is None:
+            client.reply(_NOT_FOUND)
+        else:
+            client.reply(b'FOUND %d %d\r\n' % (job.id, len(job.body)))
+            client.reply(job.body)
+            client.reply(_CRLF)
+
+    def cmd_peek(self, client, id):
+        self._found(client, self._jobs.get(self._int(id, 2 ** 64)))
+
+    def cmd_peek_ready(self, client):
+        self._found(client, self._peek_ready(client.using))
+
+    def cmd_peek_delayed(self, client):
+        self._found(client, self._peek_delayed(client.using))
+
+    def cmd_peek_buried(self, client):
+        buried = client.using.buried
+        self._found(client, next(iter(buried.values())) if buried else None)
+
+    def _kick(self, job):
+        job.kicks += 1
+        if job.state == BURIED:
+            job.tube.buried.pop(job.id)
+        self._make_ready(job)
+
+    def cmd_kick(self, client, bound):
+        bound = self._int(bound)
+        tube = client.using
+        kicked = 0
+        if tube.buried:
+            while kicked < bound and tube.buried:
+                self._kick(next(iter(tube.buried.values())))
+                kicked += 1
+        else:
+            while kicked < bound:
+                job = self._peek_delayed(tube)
+                if job is None:
+                    break
+                self._kick(job)
+                kicked += 1
+        client.reply(b'KICKED %d\r\n' % kicked)
+        if kicked:
+            self._wake()
+
+    def cmd_kick_job(self, client, id):
+        job = self._jobs.get(self._int(id, 2 ** 64))
+        if job is None or job.state not in (BURIED, DELAYED):
+            client.reply(_NOT_FOUND)
+            return
+        self._kick(job)
+        client.reply(b'KICKED\r\n')
+        self._wake()
+
+    def _yaml(self, client, items, sequence=False):
+        lines = ['---']
+        if sequence:
+            lines.extend('- {}'.format(item) for item in items)
+        else:
+            lines.extend('{}: {}'.format(*item) for item in items)
+        data = ('\n'.join(lines) + '\n').encode()
+        client.reply(b'OK %d\r\n' % len(data))
+        client.reply(data)
+        client.reply(_CRLF)
+
+    def cmd_stats_job(self, client, id):
+        job = self._jobs.get(self._int(id, 2 ** 64))
+        if job is None:
+            client.reply(_NOT_FOUND)
+            return
+        now = self._now()
+        if job.state == RESERVED:
+            left = job.deadline - now
+        elif job.state == DELAYED:
+            left = job.ready_at - now
+        else:
+            left = 0
+        self._yaml(client, [
+            ('id', job.id),
+            ('tube', job.tube.name),
+            ('state', job.state),
+            ('pri', job.pri),
+            ('age', int(now - job.created)),
+            ('delay', job.delay),
+            ('ttr', job.ttr),
+            ('time-left', max(int(left), 0)),
+            ('file', 0),
+            ('reserves', job.reserves),
+            ('timeouts', job.timeouts),
+            ('releases', job.releases),
+            ('buries', job.buries),
+            ('kicks', job.kicks),
+        ])
+
+    def cmd_stats_tube(self, client, name):
+        tube = self._tubes.get(self._name(name))
+        if tube is None:
+            client.reply(_NOT_FOUND)
+            return
+        left = max(tube.paused_until - self._now(), 0)
+        self._yaml(client, [
+            ('name', tube.name),
+            ('current-jobs-urgent', tube.counts['urgent']),
+            ('current-jobs-ready', tube.counts[READY]),
+            ('current-jobs-reserved', tube.counts[RESERVED]),
+            ('current-jobs-delayed', tube.counts[DELAYED]),
+            ('current-jobs-buried', tube.counts[BURIED]),
+            ('total-jobs', tube.total_jobs),
+            ('current-using', tube.using),
+            ('current-waiting', len(tube.waiting)),
+            ('current-watching', tube.watching),
+            ('pause', tube.pause),
+            ('cmd-delete', tube.cmd_delete),
+            ('cmd-pause-tube', tube.cmd_pause),
+            ('pause-time-left', int(left)),
+        ])
+
+    def cmd_stats(self, client):
+        counts = dict.fromkeys((READY, DELAYED, RESERVED, BURIED), 0)
+        counts['urgent'] = 0
+        for tube in self._tubes.values():
+            for state, count in tube.counts.items():
+                counts[state] += count
+        cmds = self._cmd_counts
+        usage = os.times()
+        items = [
+            ('current-jobs-urgent', counts['urgent']),
+            ('current-jobs-ready', counts[READY]),
+            ('current-jobs-reserved', counts[RESERVED]),
+            ('current-jobs-delayed', counts[DELAYED]),
+            ('current-jobs-buried', counts[BURIED]),
+        ]
+        items.extend(
+            ('cmd-' + name.decode(), cmds.get(name, 0)) for name in (
+                b'put', b'peek', b'peek-ready', b'peek-delayed',
+                b'peek-buried', b'reserve', b'reserve-with-timeout',
+                b'delete', b'release', b'use', b'watch', b'ignore', b'bury',
+                b'kick', b'touch', b'stats', b'stats-job', b'stats-tube',
+                b'list-tubes', b'list-tube-used', b'list-tubes-watched',
+                b'pause-tube',
+            ))
+        items.extend([
+            ('job-timeouts', self._job_timeouts),
+            ('total-jobs', self._total_jobs),
+            ('max-job-size', self.max_job_size),
+            ('current-tubes', len(self._tubes)),
+            ('current-connections', len(self._clients)),
+            ('current-producers', 0),
+            ('current-workers', 0),
+            ('current-waiting', sum(c.waiting for c in self._clients)),
+            ('total-connections', self._total_connections),
+            ('pid', os.getpid()),
+            ('version', '"aiobean-fake"'),
+            ('rusage-utime', '{:.6f}'.format(usage.user)),
+            ('rusage-stime', '{:.6f}'.format(usage.system)),
+            ('uptime', int(time.time() - self._started)),
+            ('binlog-oldest-index', 0),
+            ('binlog-current-index', 0),
+            ('binlog-records-migrated', 0),
+            ('binlog-records-written', 0),
+            ('binlog-max-size', 10485760),
+            ('draining', 'false'),
+            ('id', self._id),
+            ('hostname', socket.gethostname()),
+        ])
+        self._yaml(client, items)
+
+    def cmd_list_tubes(self, client):
+        self._yaml(client, self._tubes, sequence=True)
+
+    def cmd_list_tube_used(self, client):
+        client.reply(b'USING %s\r\n' % client.using.name.encode())
+
+    def cmd_list_tubes_watched(self, client):
+        self._yaml(
+            client, [tube.name for tube in client.watching], sequence=True)
+
+    def cmd_pause_tube(self, client, name, delay):
+        tube = self._tubes.get(self._name(name))
+        delay = self._int(delay)
+        if tube is None:
+            client.reply(_NOT_FOUND)
+            return
+        tube.cmd_pause += 1
+        tube.pause = delay
+        tube.paused_until = self._now() + delay if delay else 0
+        if delay:
+            self._add_timer(tube.paused_until, 'pause', tube)
+        else:
+            self._wake()
+        client.reply(b'PAUSED\r\n')
+
+    def cmd_quit(self, client):
+        client.flush()
+        client.transport.close()
+
+
+_COMMANDS = {
+    name.replace('_', '-').encode(): getattr(FakeServer, 'cmd_' + name)
+    for name in (
+        'put', 'use', 'reserve', 'reserve_with_timeout', 'delete', 'release',
+        'bury', 'touch', 'watch', 'ignore', 'peek', 'peek_ready',
+        'peek_delayed', 'peek_buried', 'kick', 'kick_job', 'stats_job',
+        'stats_tube', 'stats', 'list_tubes', 'list_tube_used',
+        'list_tubes_watched', 'pause_tube', 'quit',
+    )
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='a fake beanstalkd')
+    parser.add_argument('-l', dest='host', default='127.0.0.1',
+                        help='address to listen on')
+    parser.add_argument('-p', dest='port', type=int, default=11300,
+                        help='port to listen on')
+    parser.add_argument('-z', dest='max_job_size', type=int,
+                        default=MAX_JOB_SIZE, help='maximum job size')
+    args = parser.parse_args(argv)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = FakeServer(args.host, args.port, loop, args.max_job_size)
+    loop.run_until_complete(server.start())
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
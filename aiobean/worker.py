@@ -0,0 +1,197 @@
+import asyncio
+from asyncio import CancelledError
+from aiobean.log import logger
+from aiobean.protocol import CommandsMixin, DeadlineSoon
+
+RELEASE = 'release'
+BURY = 'bury'
+_DEADLINE_SOON_BACKOFF = 0.1
+
+
+class Worker:
+    """
+    Reserves jobs from `tubes` over `connections` and runs up to
+    `concurrency` handlers at once::
+
+        async def handler(id, body):
+            ...
+
+        worker = Worker(handler, [conn1, conn2], tubes=['emails'],
+                        concurrency=20, loop=loop)
+        loop.call_later(60, worker.close)
+        await worker.run()
+
+    A job is deleted when its handler returns. When the handler raises,
+    the job is released with `failure_pri` and `failure_delay`, or buried
+    with `failure_pri` if `failure` is ``'bury'``.
+
+    With a :class:`~aiobean.lease.LeaseManager` as `leases`, jobs are
+    touched while their handlers run, so handlers may take longer than
+    the jobs' TTR.
+
+    Reserves use ``reserve-with-timeout`` so that the worker notices
+    :meth:`close` within `reserve_timeout` seconds, rounded up to a whole
+    second as beanstalkd takes no less. Note that acks share
+    the connection with the pending reserve, so on an idle tube an ack can
+    wait up to `reserve_timeout` too.
+    """
+
+    def __init__(self, handler, connections, tubes=('default',),
+                 concurrency=1, reserve_timeout=1, failure=RELEASE,
+                 failure_pri=CommandsMixin.DEFAULT_PRI, failure_delay=0,
+                 leases=None, loop=None):
+        if failure not in (RELEASE, BURY):
+            raise ValueError('failure must be {!r} or {!r}'.format(
+                RELEASE, BURY))
+        self._handler = handler
+        self._conns = list(connections)
+        self._tubes = list(tubes)
+        self._concurrency = concurrency
+        self._reserve_timeout = reserve_timeout
+        self._failure = failure
+        self._failure_pri = failure_pri
+        self._failure_delay = failure_delay
+        self._leases = leases
+        self._loop = loop or asyncio.get_event_loop()
+        self._semaphore = None
+        self._loops = {}  # connection -> its reserve loop
+        self._idle = set()  # connections waiting for a free handler slot
+        self._tasks = set()
+        self._closing = False
+        self._shutdown_timeout = None
+
+    @property
+    def active(self):
+        """number of handlers running right now"""
+        return len(self._tasks)
+
+    async def run(self):
+        """
+        Process jobs until :meth:`close` is called, then wait for the
+        handlers still running.
+        """
+        self._semaphore = asyncio.Semaphore(
+            self._concurrency, loop=self._loop)
+        for conn in self._conns:
+            await self._watch(conn)
+        self._loops = {
+            conn: asyncio.ensure_future(
+                self._reserve_loop(conn), loop=self._loop)
+            for conn in self._conns
+        }
+        try:
+            await asyncio.wait(self._loops.values(), loop=self._loop)
+        finally:
+            for task in self._loops.values():
+                task.cancel()
+            await self._drain()
+        for task in self._loops.values():
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+    def close(self, timeout=None):
+        """
+        Stop reserving jobs. Handlers still running after `timeout`
+        seconds are cancelled, and their jobs released with
+        `failure_pri` and no delay, whatever `failure` is.
+        """
+        self._closing = True
+        self._shutdown_timeout = timeout
+        # loops waiting for a handler to finish can stop right away; the
+        # others stop once their pending reserve returns
+        for conn in self._idle:
+            self._loops[conn].cancel()
+
+    async def _watch(self, conn):
+        pipe = conn.pipeline()
+        for tube in self._tubes:
+            pipe.watch(tube)
+        if 'default' not in self._tubes:
+            pipe.ignore('default')
+        for result in await pipe.send():
+            if isinstance(result, Exception):
+                raise result
+
+    async def _reserve_loop(self, conn):
+        while not self._closing:
+            self._idle.add(conn)
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self._idle.discard(conn)
+            if self._closing:
+                self._semaphore.release()
+                break
+            try:
+                job = await conn.reserve(self._reserve_timeout)
+            except DeadlineSoon:
+                # a job we hold is about to time out; touch it, or let its
+                # handler finish before asking for more
+                self._semaphore.release()
+                if self._leases is not None:
+                    await self._leases.deadline_soon(conn)
+                else:
+                    await asyncio.sleep(
+                        _DEADLINE_SOON_BACKOFF, loop=self._loop)
+                continue
+            except (Exception, CancelledError):
+                self._semaphore.release()
+                if conn.closed:
+                    logger.warning('worker: connection closed, stop reserving')
+                    return
+                raise
+            if job is None:
+                self._semaphore.release()
+                continue
+            if self._leases is not None:
+                # sent before the next reserve, so it is answered right away
+                self._leases.track(conn, job[0])
+            task = asyncio.ensure_future(
+                self._process(conn, *job), loop=self._loop)
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, conn, id, body):
+        try:
+            try:
+                await self._handler(id, body)
+            except CancelledError:
+                # shutting down, not a failure: released even with BURY,
+                # for another worker to take
+                self._unlease(conn, id)
+                await conn.release(id, self._failure_pri)
+                raise
+            except Exception:
+                logger.exception('worker: job %s failed', id)
+                self._unlease(conn, id)
+                await self._fail(conn, id)
+            else:
+                self._unlease(conn, id)
+                await conn.delete(id)
+        except CancelledError:
+            # an Exception before Python 3.8, not an ack failure
+            raise
+        except Exception:
+            logger.exception('worker: could not ack job %s', id)
+        finally:
+            self._semaphore.release()
+
+    def _unlease(self, conn, id):
+        if self._leases is not None:
+            self._leases.remove(conn, id)
+
+    def _fail(self, conn, id):
+        if self._failure == BURY:
+            return conn.bury(id, self._failure_pri)
+        return conn.release(id, self._failure_pri, self._failure_delay)
+
+    async def _drain(self):
+        if not self._tasks:
+            return
+        logger.info('worker: waiting for %d handlers', len(self._tasks))
+        done, pending = await asyncio.wait(
+            self._tasks, timeout=self._shutdown_timeout, loop=self._loop)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending, loop=self._loop)
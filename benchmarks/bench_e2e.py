@@ -0,0 +1,176 @@
+"""
+End to end ``put``/``reserve``/``delete`` over a loopback socket::
+
+    python benchmarks/bench_e2e.py  # starts a server on a free port
+    python benchmarks/bench_e2e.py --server 127.0.0.1:11300
+
+Every phase keeps `concurrency` commands in flight on one connection and
+reports ops/sec plus the p50/p99 latency of single commands.
+"""
+import argparse
+import asyncio
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from aiobean.connection import create_connection
+
+SIZES = (16, 256, 4096, 65535)
+NO_BEANSTALKD = 'beanstalkd is not installed, pass --fake to use ' \
+    'aiobean.testing instead'
+
+
+def percentile(samples, q):
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+async def _phase(name, size, command, count, concurrency, loop):
+    latencies = []
+
+    async def timed(index):
+        start = time.perf_counter()
+        result = await command(index)
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    results = []
+    start = time.perf_counter()
+    for batch in range(0, count, concurrency):
+        results.extend(await asyncio.gather(*[
+            timed(index)
+            for index in range(batch, min(count, batch + concurrency))
+        ], loop=loop))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return results, {
+        'bench': 'e2e.' + name,
+        'size': size,
+        'ops_per_sec': count / elapsed,
+        'ns_per_op': elapsed / count * 1e9,
+        'p50_ms': percentile(latencies, 0.5) * 1e3,
+        'p99_ms': percentile(latencies, 0.99) * 1e3,
+    }
+
+
+async def run_size(address, size, count, concurrency, loop):
+    conn = await create_connection(*address, loop=loop)
+    tube = 'bench-{}'.format(size)
+    await conn.use(tube)
+    await conn.watch(tube)
+    await conn.ignore('default')
+    body = b'x' * size
+    try:
+        ids, put = await _phase(
+            'put', size, lambda _: conn.put(body), count, concurrency, loop)
+        jobs, reserve = await _phase(
+            'reserve', size, lambda _: conn.reserve(0), count, concurrency,
+            loop)
+        _, delete = await _phase(
+            'delete', size, lambda index: conn.delete(jobs[index][0]), count,
+            concurrency, loop)
+    finally:
+        conn.close()
+        await conn.wait_closed()
+    assert sorted(job[0] for job in jobs) == sorted(ids)
+    return [put, reserve, delete]
+
+
+async def run(address, sizes=SIZES, count=10000, concurrency=100, loop=None):
+    results = []
+    for size in sizes:
+        results.extend(await run_size(address, size, count, concurrency, loop))
+    return results
+
+
+class Beanstalkd:
+    """
+    ``beanstalkd`` from $PATH on a free port, or with `fake` the fake
+    server of :mod:`aiobean.testing` in its own process
+    """
+
+    def __init__(self, fake=False):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.address = sock.getsockname()
+        sock.close()
+        if fake:
+            command = [sys.executable, '-m', 'aiobean.testing']
+        elif shutil.which('beanstalkd'):
+            command = ['beanstalkd']
+        else:
+            raise RuntimeError(NO_BEANSTALKD)
+        self._process = subprocess.Popen(command + [
+            '-l', self.address[0], '-p', str(self.address[1])])
+        for _ in range(500):
+            try:
+                socket.create_connection(self.address).close()
+                break
+            except OSError:
+                time.sleep(0.01)
+
+    def terminate(self):
+        self._process.terminate()
+        self._process.wait()
+
+
+def parse_address(value):
+    host, _, port = value.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def add_arguments(parser):
+    parser.add_argument('--server', type=parse_address,
+                        help='host:port of a beanstalkd to use')
+    parser.add_argument('--fake', action='store_true',
+                        help='run against aiobean.testing.FakeServer')
+    parser.add_argument('--count', type=int, default=10000,
+                        help='jobs per body size')
+    parser.add_argument('--concurrency', type=int, default=100,
+                        help='commands in flight')
+
+
+def server_kind(args):
+    """
+    what the benchmarks run against: ``'external'`` for ``--server``,
+    ``'fake'`` or ``'beanstalkd'``; None if beanstalkd is missing
+    """
+    if args.server is not None:
+        return 'external'
+    if args.fake:
+        return 'fake'
+    if shutil.which('beanstalkd'):
+        return 'beanstalkd'
+    return None
+
+
+def run_from_args(args, sizes=SIZES):
+    loop = asyncio.new_event_loop()
+    server = None
+    address = args.server
+    if address is None:
+        server = Beanstalkd(args.fake)
+        address = server.address
+    try:
+        return loop.run_until_complete(run(
+            address, sizes, args.count, args.concurrency, loop=loop))
+    finally:
+        if server is not None:
+            server.terminate()
+        loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='put/reserve/delete over a loopback socket')
+    add_arguments(parser)
+    args = parser.parse_args()
+    if server_kind(args) is None:
+        parser.error(NO_BEANSTALKD)
+    for result in run_from_args(args):
+        print('{bench:<12} {size:>6} {ops_per_sec:10.0f} ops/s  '
+              'p50 {p50_ms:7.3f} ms  p99 {p99_ms:7.3f} ms'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""
+Compare the precompiled command encoders with the generic
+``encode_command`` generator::
+
+    python benchmarks/bench_encode.py
+"""
+import timeit
+from aiobean.protocol import ENCODERS, encode_command
+
+BODY = b'x' * 100
+CASES = [
+    ('put', (2 ** 31, 0, 300, len(BODY)), BODY),
+    ('delete', (123456,), None),
+    ('release', (123456, 2 ** 31, 0), None),
+    ('reserve', (), None),
+]
+
+
+def main(number=200000):
+    for command, args, body in CASES:
+        encoder = ENCODERS[command]
+        generic = timeit.timeit(
+            lambda: list(encode_command(command, *args, body=body)),
+            number=number)
+        compiled = timeit.timeit(
+            lambda: encoder(*args, body=body), number=number)
+        print('{:<10} generic {:6.0f} ns  compiled {:6.0f} ns  x{:.1f}'.format(
+            command, generic / number * 1e9, compiled / number * 1e9,
+            generic / compiled))
+
+
+if __name__ == '__main__':
+    main()
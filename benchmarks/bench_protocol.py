@@ -0,0 +1,125 @@
+"""
+Throughput of the protocol layer alone, no sockets involved::
+
+    python benchmarks/bench_protocol.py
+
+Covers command encoding, response heads and bodies, the incremental parser
+and the YAML of ``stats*`` responses, for job bodies of every size in
+:data:`SIZES`.
+"""
+import timeit
+from aiobean.protocol import (
+    ENCODERS, ProtocolParser, _parse_yml, encode_command, handle_head,
+    handle_response,
+)
+
+SIZES = (16, 256, 4096, 65535)
+
+STATS_JOB = (
+    b'---\nid: 1234\ntube: default\nstate: reserved\npri: 1024\nage: 12\n'
+    b'delay: 0\nttr: 60\ntime-left: 47\nfile: 0\nreserves: 1\ntimeouts: 0\n'
+    b'releases: 0\nburies: 0\nkicks: 0\n'
+)
+STATS = b'---\n' + b''.join(
+    '{}: {}\n'.format(key, index).encode() for index, key in enumerate([
+        'current-jobs-urgent', 'current-jobs-ready', 'current-jobs-reserved',
+        'current-jobs-delayed', 'current-jobs-buried', 'cmd-put', 'cmd-peek',
+        'cmd-peek-ready', 'cmd-peek-delayed', 'cmd-peek-buried',
+        'cmd-reserve', 'cmd-reserve-with-timeout', 'cmd-delete',
+        'cmd-release', 'cmd-use', 'cmd-watch', 'cmd-ignore', 'cmd-bury',
+        'cmd-kick', 'cmd-touch', 'cmd-stats', 'cmd-stats-job',
+        'cmd-stats-tube', 'cmd-list-tubes', 'cmd-list-tube-used',
+        'cmd-list-tubes-watched', 'cmd-pause-tube', 'job-timeouts',
+        'total-jobs', 'max-job-size', 'current-tubes', 'current-connections',
+        'current-producers', 'current-workers', 'current-waiting',
+        'total-connections', 'pid', 'uptime', 'binlog-oldest-index',
+        'binlog-current-index', 'binlog-records-migrated',
+        'binlog-records-written', 'binlog-max-size',
+    ])
+) + b'version: "1.10"\nrusage-utime: 0.148000\nhostname: bench\n'
+LIST_TUBES = b'---\n' + b''.join(
+    '- tube-{}\n'.format(index).encode() for index in range(50))
+# responses per feed in the parser benchmark
+BATCH = 100
+
+
+def measure(name, func, size=None, number=10000, repeat=3):
+    """best of `repeat` runs of `func` called `number` times"""
+    best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    return {
+        'bench': name,
+        'size': size,
+        'ns_per_op': best * 1e9,
+        'ops_per_sec': 1 / best,
+    }
+
+
+def bench_encode(size):
+    body = b'x' * size
+    encoder = ENCODERS['put']
+    args = (2 ** 31, 0, 300, size)
+    return [
+        measure('encode_command.put', size=size,
+                func=lambda: list(encode_command('put', *args, body=body))),
+        measure('encode.put', size=size,
+                func=lambda: encoder(*args, body=body)),
+    ]
+
+
+def bench_responses(size):
+    body = b'x' * size
+    head = 'RESERVED 1234 {}'.format(size).encode()
+    headers = [b'1234', str(size).encode()]
+    return [
+        measure('handle_head.reserved', size=size,
+                func=lambda: handle_head(head)),
+        measure('handle_response.reserved', size=size,
+                func=lambda: handle_response(
+                    'reserve', b'RESERVED', headers, body)),
+    ]
+
+
+def bench_parser(size):
+    response = 'RESERVED 1234 {}\r\n'.format(size).encode() + \
+        b'x' * size + b'\r\n'
+    data = response * BATCH
+    number = max(10, 2000000 // len(data))
+
+    def feed():
+        ProtocolParser().feed(data)
+    result = measure('parser.feed', feed, size=size, number=number)
+    # per response rather than per batch
+    result['ns_per_op'] /= BATCH
+    result['ops_per_sec'] *= BATCH
+    return [result]
+
+
+def bench_yaml():
+    return [
+        measure('parse_yml.' + name, number=2000,
+                func=lambda body=body: _parse_yml([], body))
+        for name, body in [
+            ('stats-job', STATS_JOB), ('stats', STATS),
+            ('list-tubes', LIST_TUBES),
+        ]
+    ]
+
+
+def run(sizes=SIZES):
+    results = []
+    for size in sizes:
+        results.extend(bench_encode(size))
+        results.extend(bench_responses(size))
+        results.extend(bench_parser(size))
+    results.extend(bench_yaml())
+    return results
+
+
+def main():
+    for result in run():
+        print('{bench:<28} {size!s:>6} {ns_per_op:10.0f} ns '
+              '{ops_per_sec:12.0f} ops/s'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Run every benchmark and write the results as JSON, to compare commits::
+
+    python benchmarks/run.py --output before.json
+    git checkout my-branch
+    python benchmarks/run.py --output after.json --compare before.json
+
+Results are keyed by (bench, size); ``--compare`` prints the change in
+ops/sec of each against the baseline file.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import bench_e2e
+import bench_protocol
+
+
+def metadata(server=None):
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        # what the end to end benchmarks ran against, if they ran
+        'server': server,
+    }
+
+
+def compare(results, baseline):
+    before = {(r['bench'], r['size']): r for r in baseline['results']}
+    for result in results:
+        old = before.get((result['bench'], result['size']))
+        if old is None:
+            continue
+        change = result['ops_per_sec'] / old['ops_per_sec'] - 1
+        print('{:<28} {!s:>6} {:12.0f} -> {:12.0f} ops/s {:+7.1%}'.format(
+            result['bench'], result['size'], old['ops_per_sec'],
+            result['ops_per_sec'], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='run all benchmarks')
+    bench_e2e.add_arguments(parser)
+    parser.add_argument('--no-e2e', action='store_true',
+                        help='skip the end to end benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=bench_protocol.SIZES,
+                        help='job body sizes in bytes')
+    parser.add_argument('--output', help='write the JSON here, not stdout')
+    parser.add_argument('--compare', help='JSON of an earlier run')
+    args = parser.parse_args()
+
+    server = None
+    if not args.no_e2e:
+        server = bench_e2e.server_kind(args)
+        if server is None:
+            parser.error(bench_e2e.NO_BEANSTALKD)
+    results = bench_protocol.run(args.sizes)
+    if not args.no_e2e:
+        results.extend(bench_e2e.run_from_args(args, args.sizes))
+    report = {'meta': metadata(server), 'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -17,7 +17,10 @@ setup(
     extras_require={
         'yml': [
             'PyYAML',
-        ]
+        ],
+        'msgpack': [
+            'msgpack',
+        ],
     },
     license="BSD license",
     zip_safe=False,
@@ -1,10 +1,30 @@
+import os
 import pytest
+import shutil
+import socket
+import sys
 from subprocess import Popen
 import time
 
 from aiobean.log import logger
 
 
+# set AIOBEAN_FAKE_SERVER=1 to test against the stand-in of aiobean.testing
+# rather than beanstalkd; without either, tests needing a server are skipped
+if os.environ.get('AIOBEAN_FAKE_SERVER'):
+    BEANSTALKD = [sys.executable, '-m', 'aiobean.testing']
+elif shutil.which('beanstalkd'):
+    BEANSTALKD = ['beanstalkd']
+else:
+    BEANSTALKD = None
+
+
+def pytest_report_header(config):
+    if BEANSTALKD is None:
+        return 'server: none, install beanstalkd or set AIOBEAN_FAKE_SERVER=1'
+    return 'server: {}'.format(' '.join(BEANSTALKD))
+
+
 class Server:
 
     def __init__(self, port):
@@ -20,7 +40,16 @@ class Server:
         return self._process is not None
 
     def start(self):
-        self._process = Popen(['beanstalkd', '-p', str(self._port)])
+        if BEANSTALKD is None:
+            pytest.skip('beanstalkd is not installed')
+        self._process = Popen(BEANSTALKD + ['-p', str(self._port)])
+        # wait until it accepts connections
+        for _ in range(500):
+            try:
+                socket.create_connection(self.address).close()
+                break
+            except OSError:
+                time.sleep(0.01)
         logger.debug('%s started', self)
 
     def terminate(self):
@@ -43,6 +72,15 @@ class Server:
 def server(unused_tcp_port):
     s = Server(unused_tcp_port)
     s.start()
-    time.sleep(0.01)
     yield s
     s.terminate()
+
+
+@pytest.fixture
+def servers(unused_tcp_port_factory):
+    ss = [Server(unused_tcp_port_factory()) for _ in range(3)]
+    for s in ss:
+        s.start()
+    yield ss
+    for s in ss:
+        s.terminate()
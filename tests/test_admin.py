@@ -0,0 +1,149 @@
+import asyncio
+from aiobean.connection import create_connection
+from aiobean.admin import (
+    BURIED, DELAYED, READY, drain_buried, kick_ramp, purge_tube)
+import pytest
+
+
+pytestmark = pytest.mark.asyncio(forbid_global_loop=True)
+
+
+@pytest.fixture
+def conns(server, event_loop):
+    conns = [event_loop.run_until_complete(create_connection(
+        *server.address, loop=event_loop)) for _ in range(2)]
+    yield conns
+    for conn in conns:
+        conn.close()
+        event_loop.run_until_complete(conn.wait_closed())
+
+
+async def fill(conn, tube, ready=0, delayed=0, buried=0, other=0):
+    """put jobs in `tube`, interleaved with `other` jobs in another tube"""
+    await conn.use(tube)
+    await conn.watch(tube)
+    for _ in range(buried):
+        await conn.put(b'buried')
+        job = await conn.reserve(timeout=0)
+        await job.bury()
+    await conn.put_many([b'ready'] * ready)
+    await conn.put_many([b'delayed'] * delayed, delay=3600)
+    await conn.use('other')
+    await conn.put_many([b'other'] * other)
+
+
+async def counts(conn, tube):
+    try:
+        stats = await conn.stats_tube(tube)
+    except Exception:
+        return {}
+    return {state: stats['current-jobs-' + state]
+            for state in (READY, DELAYED, BURIED)
+            if stats['current-jobs-' + state]}
+
+
+async def test_purge(conns, event_loop):
+    conn = conns[0]
+    await fill(conn, 'purged', ready=300, delayed=200, buried=100)
+    await fill(conn, 'purged', ready=50, other=100)
+    reports = []
+    progress = await purge_tube(
+        conns, 'purged', states=[READY, BURIED], window=16,
+        progress=reports.append, loop=event_loop)
+    assert progress.done == 450
+    assert progress.failed == 0
+    assert progress.remaining == 0
+    assert reports[-1] == progress
+    assert len(reports) < 50  # well under a round per job
+    assert await counts(conn, 'purged') == {DELAYED: 200}
+    assert await counts(conn, 'other') == {READY: 100}
+    progress = await purge_tube(conns[1], 'purged', loop=event_loop)
+    assert progress.done == 200
+    assert await counts(conn, 'purged') == {}
+
+
+async def test_purge_rate(conns, event_loop):
+    await fill(conns[0], 'slow', ready=30)
+    start = event_loop.time()
+    await purge_tube(conns, 'slow', window=4, max_window=4, rate=100,
+                     loop=event_loop)
+    assert event_loop.time() - start >= 0.2
+
+
+async def test_drain_buried(conns, event_loop):
+    conn = conns[0]
+    await fill(conn, 'drained', ready=10, buried=40, other=20)
+    drained = []
+
+    async def handler(job):
+        if job.id % 10 == 0:
+            raise ValueError(job.id)
+        assert job.body == b'buried'
+        drained.append(job.id)
+
+    progress = await drain_buried(conns, 'drained', handler, window=8,
+                                  max_window=64, loop=event_loop)
+    failed = progress.failed
+    assert 0 < failed < 10
+    assert progress.done == len(drained) == 40 - failed
+    assert progress.remaining == failed
+    assert await counts(conn, 'drained') == {READY: 10, BURIED: failed}
+
+
+async def test_drain_buried_cancelled(conns, event_loop):
+    conn = conns[0]
+    await fill(conn, 'drained', buried=2)
+
+    async def handler(job):
+        raise asyncio.CancelledError
+
+    progress = await drain_buried(conns, 'drained', handler, loop=event_loop)
+    # not drained, so kept
+    assert progress.done == 0
+    assert progress.failed == 2
+    assert await counts(conn, 'drained') == {BURIED: 2}
+
+
+async def test_kick_ramp(conns, event_loop):
+    conn = conns[0]
+    await fill(conn, 'kicked', delayed=20, buried=20)
+    reports = []
+    progress = await kick_ramp(conns, 'kicked', rate=400, ramp=0.1,
+                               total=30, interval=0.01,
+                               progress=reports.append, loop=event_loop)
+    assert progress.done == 30
+    assert progress.remaining == 10
+    assert len(reports) > 2  # kicked over several rounds
+    assert await counts(conn, 'kicked') == {READY: 30, DELAYED: 10}
+
+
+async def test_kick_ramp_state(conns, event_loop):
+    conn = conns[0]
+    await fill(conn, 'kicked', delayed=20, buried=20)
+    progress = await kick_ramp(conns, 'kicked', rate=1000, state=DELAYED,
+                               interval=0.01, loop=event_loop)
+    assert progress.done == 20
+    assert await counts(conn, 'kicked') == {READY: 20, BURIED: 20}
+    with pytest.raises(ValueError):
+        await kick_ramp(conns, 'kicked', rate=1, state=READY,
+                        loop=event_loop)
+
+
+async def test_kick_ramp_max_ready(conns, event_loop):
+    conn = conns[0]
+    await fill(conn, 'kicked', buried=20)
+
+    async def consume():
+        await conn.watch('kicked')
+        for _ in range(20):
+            await asyncio.sleep(0.01, loop=event_loop)
+            stats = await conn.stats_tube('kicked')
+            assert stats['current-jobs-ready'] <= 5
+            job = await conn.reserve()
+            await job.delete()
+
+    consumer = asyncio.ensure_future(consume(), loop=event_loop)
+    progress = await kick_ramp(conns[1], 'kicked', rate=10000, max_ready=5,
+                               interval=0.005, loop=event_loop)
+    await asyncio.wait_for(consumer, 5, loop=event_loop)
+    assert progress.done == 20
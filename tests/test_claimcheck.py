@@ -0,0 +1,149 @@
+import asyncio
+import os
+import time
+from aiobean.claimcheck import ClaimCheck, FileBlobStore, LazyBody
+from aiobean.codec import Codec
+from aiobean.connection import ConnectionClosedError, create_connection
+from aiobean.pool import create_pool
+from aiobean.protocol import CommandFailed
+from aiobean.sync import Client
+from aiobean.testing import FakeServer
+import pytest
+
+
+@pytest.fixture
+def store(tmpdir):
+    return FileBlobStore(str(tmpdir.join('blobs')))
+
+
+def test_file_blob_store(store):
+    key = store.put(b'blob')
+    assert bytes(store.open(key)) == b'blob'
+    assert store.open(store.put(b'')) == b''
+    store.delete(key)
+    store.delete(key)
+    with pytest.raises(FileNotFoundError):
+        store.open(key)
+    with pytest.raises(ValueError):
+        store.open('../etc/passwd')
+
+
+def test_encode_decode(store):
+    claims = ClaimCheck(store, threshold=10)
+    assert claims.encode(b'small') == b'small'
+    reference = claims.encode(b'x' * 100)
+    assert reference.startswith(b'aiobean-claim:')
+    body = claims.decode(reference)
+    assert isinstance(body, LazyBody)
+    assert body._buffer is None  # nothing read yet
+    assert body.data == b'x' * 100
+    assert len(body) == 100
+    body.close()
+    assert bytes(body) == b'x' * 100
+    assert claims.decode(memoryview(b'small')) == b'small'
+
+
+def test_codec(store):
+    claims = ClaimCheck(store, threshold=100,
+                        codec=Codec('json', compress_threshold=None))
+    assert claims.decode(claims.encode([1])) == [1]
+    with claims.decode(claims.encode(list(range(100)))) as body:
+        assert body.load() == list(range(100))
+
+
+async def wait_empty(directory, event_loop):
+    """blobs are deleted in a thread"""
+    for _ in range(100):
+        if not os.listdir(directory):
+            return
+        await asyncio.sleep(0.01, loop=event_loop)
+    assert os.listdir(directory) == []
+
+
+@pytest.mark.asyncio(forbid_global_loop=True)
+async def test_connection(server, event_loop, store):
+    claims = ClaimCheck(store, threshold=1000)
+    conn = await create_connection(
+        *server.address, loop=event_loop, codec=claims)
+    big = os.urandom(100000)  # above beanstalkd's max-job-size
+    id = await conn.put(big)
+    small = await conn.put(b'small')
+    assert len(os.listdir(store._directory)) == 1
+    job_id, body = await conn.reserve()
+    assert job_id == id
+    assert await body.map(loop=event_loop) == big
+    del body  # the blob goes anyway
+    await conn.delete(id)
+    await wait_empty(store._directory, event_loop)
+    assert await conn.reserve() == (small, b'small')
+    await conn.delete(small)
+    conn.close()
+    await conn.wait_closed()
+    # never sent
+    with pytest.raises(ConnectionClosedError):
+        await conn.put(big)
+    await wait_empty(store._directory, event_loop)
+
+
+@pytest.mark.asyncio(forbid_global_loop=True)
+async def test_put_rejected(event_loop, store):
+    claims = ClaimCheck(store, threshold=1000)
+    async with FakeServer(loop=event_loop, max_job_size=10) as fake:
+        conn = await create_connection(
+            *fake.address, loop=event_loop, codec=claims)
+        with pytest.raises(CommandFailed):
+            await conn.put(b'x' * 1000)  # the reference is too big
+        await wait_empty(store._directory, event_loop)
+        conn.close()
+        await conn.wait_closed()
+
+
+def test_blocking_client(server, store):
+    claims = ClaimCheck(store, threshold=1000)
+    with Client(*server.address, codec=claims) as client:
+        id = client.put(b'x' * 1000)
+        job = client.reserve()
+        assert job.id == id
+        assert bytes(job.body) == b'x' * 1000
+        job.body.close()
+        job.delete()
+        assert os.listdir(store._directory) == []
+
+
+class SlowStore(FileBlobStore):
+
+    def put(self, data):
+        time.sleep(0.05)
+        return super().put(data)
+
+
+@pytest.mark.asyncio(forbid_global_loop=True)
+async def test_order(server, event_loop, tmpdir):
+    store = SlowStore(str(tmpdir.join('blobs')))
+    claims = ClaimCheck(store, threshold=100)
+    conn = await create_connection(
+        *server.address, loop=event_loop, codec=claims)
+    # nothing awaited in between: the big put keeps its place
+    futs = [conn.use('a'), conn.put(b'x' * 1000), conn.use('b'),
+            conn.put(b'y')]
+    _, big, _, small = await asyncio.gather(*futs, loop=event_loop)
+    assert (await conn.stats_job(big))['tube'] == 'a'
+    assert (await conn.stats_job(small))['tube'] == 'b'
+    pool = await create_pool(*server.address, size=1, loop=event_loop,
+                             codec=claims)
+    big, small = await asyncio.gather(
+        pool.put(b'x' * 1000, tube='a'), pool.put(b'y', tube='b'),
+        loop=event_loop)
+    assert (await conn.stats_job(big))['tube'] == 'a'
+    assert (await conn.stats_job(small))['tube'] == 'b'
+    pool.close()
+    await pool.wait_closed()
+    # closed before the blob is stored: never sent, and the blob goes
+    blobs = set(os.listdir(store._directory))
+    fut = conn.put(b'x' * 1000)
+    conn.close()
+    with pytest.raises(ConnectionClosedError):
+        await fut
+    await conn.wait_closed()
+    await asyncio.sleep(0.2, loop=event_loop)
+    assert set(os.listdir(store._directory)) == blobs
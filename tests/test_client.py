@@ -0,0 +1,98 @@
+import asyncio
+from aiobean.client import create_client
+import pytest
+
+
+pytestmark = pytest.mark.asyncio(forbid_global_loop=True)
+
+
+@pytest.fixture
+def client(server, event_loop):
+    client = event_loop.run_until_complete(create_client(
+        *server.address, max_reserving=3, max_idle=1, loop=event_loop))
+    yield client
+    client.close()
+    event_loop.run_until_complete(client.wait_closed())
+
+
+async def test_reserve_does_not_block(client, event_loop):
+    reserve = client.reserve()
+    await asyncio.sleep(0.1, loop=event_loop)
+    # answered while the reserve waits
+    stats = await asyncio.wait_for(client.stats(), 1, loop=event_loop)
+    assert stats['current-waiting'] == 1
+    id = await client.put(b'job')
+    assert await asyncio.wait_for(reserve, 5, loop=event_loop) == (
+        id, b'job')
+    assert client.reserving == 1
+    await client.delete(id)  # on the connection holding the job
+    assert (await client.stats())['current-jobs-reserved'] == 0
+    # the connection is reused
+    await client.put(b'again')
+    job = await client.reserve()
+    assert client.reserving == 1
+    assert job.conn is client
+    await job.release(pri=5)
+    job = await client.reserve(timeout=0)
+    assert (await job.stats())['pri'] == 5
+    await job.bury()
+    assert (await client.stats_job(job.id))['state'] == 'buried'
+
+
+async def test_dedicated_connections(client, event_loop):
+    reserves = [client.reserve() for _ in range(5)]
+    await asyncio.sleep(0.1, loop=event_loop)
+    assert client.reserving == 3  # max_reserving
+    ids = [await client.put(b'job') for _ in range(5)]
+    done, pending = await asyncio.wait(
+        reserves, timeout=0.5, loop=event_loop)
+    # the others wait for a connection, until a job is acked
+    assert len(done) == 3
+    for fut in done:
+        await client.delete(fut.result()[0])
+    done, _ = await asyncio.wait(pending, timeout=5, loop=event_loop)
+    assert len(done) == 2
+    for fut in done:
+        await client.delete(fut.result()[0])
+    stats = await client.stats()
+    assert stats['total-jobs'] == len(ids)
+    assert stats['current-jobs-ready'] == stats['current-jobs-reserved'] == 0
+    assert client.reserving == 1  # max_idle
+
+
+async def test_cancelled_reserve(client, event_loop):
+    with pytest.raises(asyncio.TimeoutError):
+        await client.reserve(deadline=0.1)
+    assert client.reserving == 0
+    id = await client.put(b'job', pri=7)
+    assert await client.reserve(timeout=1) == (id, b'job')
+
+
+async def test_reserve_nothing(client, event_loop):
+    errors = []
+    event_loop.set_exception_handler(lambda loop, context: errors.append(
+        context))
+    try:
+        assert await client.reserve(timeout=0) is None
+        await asyncio.sleep(0, loop=event_loop)  # done callbacks ran
+    finally:
+        event_loop.set_exception_handler(None)
+    assert not errors
+    assert not client._owners
+    # on a dedicated connection, given back for the next reserve
+    assert await client.reserve(timeout=1) is None
+    assert not client._owners
+    assert client.reserving == 1
+    assert list(client._free) == list(client._dedicated)
+    assert await client.reserve(timeout=1) is None
+    assert client.reserving == 1
+
+
+async def test_session(client):
+    assert await client.use('foo') == 'foo'
+    assert await client.watch('foo') == 2
+    assert await client.ignore('default') == 1
+    id = await client.put(b'job')
+    assert (await client.stats_job(id))['tube'] == 'foo'
+    assert await client.reserve() == (id, b'job')
+    assert await client.watched() == ['foo']
@@ -0,0 +1,80 @@
+from aiobean.codec import HAVE_MSGPACK, Codec, CodecError
+from aiobean.connection import create_connection
+import pytest
+
+
+PAYLOAD = {'user': 42, 'tags': ['a', 'b'], 'text': 'x' * 2000}
+# magic and version
+PREFIX = b'\x00aiob\x01'
+
+
+@pytest.mark.parametrize('serializer', [
+    'json', 'pickle',
+    pytest.param('msgpack', marks=pytest.mark.skipif(
+        not HAVE_MSGPACK, reason='msgpack is not available')),
+])
+def test_roundtrip(serializer):
+    codec = Codec(serializer, compress_threshold=1024)
+    small = codec.encode({'user': 42})
+    assert small[6] & 0xf0 == 0
+    big = codec.encode(PAYLOAD)
+    assert big[6] & 0xf0 == 0x10  # compressed
+    assert len(big) < 200
+    # decoding follows the header, not the codec's settings
+    assert Codec('pickle').decode(big) == PAYLOAD
+    assert codec.decode(memoryview(small)) == {'user': 42}
+
+
+def test_raw():
+    codec = Codec('raw', compress_threshold=None)
+    assert codec.encode(b'job') == PREFIX + b'\x00job'
+    assert codec.decode(PREFIX + b'\x00job') == b'job'
+    # bodies put without a codec
+    assert codec.decode(b'plain') == b'plain'
+    assert codec.decode(b'\xbe\x01{') == b'\xbe\x01{'
+    assert codec.decode(b'\x00aiob') == b'\x00aiob'
+    assert codec.decode(b'') == b''
+    with pytest.raises(TypeError):
+        codec.encode('text')
+
+
+def test_incompressible():
+    codec = Codec('raw', compress_threshold=10)
+    body = bytes(range(256))
+    assert codec.encode(body) == PREFIX + b'\x00' + body
+
+
+def test_errors():
+    codec = Codec()
+    with pytest.raises(ValueError):
+        Codec('yaml')
+    with pytest.raises(CodecError):
+        codec.decode(PREFIX + b'\x0f')
+    with pytest.raises(CodecError):
+        codec.decode(PREFIX + b'\x11not zlib')
+    with pytest.raises(CodecError):
+        codec.decode(b'\x00aiob\x02\x01{}')  # from a later version
+
+
+@pytest.mark.asyncio(forbid_global_loop=True)
+async def test_connection(server, event_loop):
+    codec = Codec('json', compress_threshold=1024)
+    conn = await create_connection(
+        *server.address, loop=event_loop, codec=codec)
+    id = await conn.put(PAYLOAD)
+    assert (await conn.stats_job(id))['state'] == 'ready'
+    assert await conn.peek(id) == (id, PAYLOAD)
+    assert await conn.put_many([1, [2]]) == [id + 1, id + 2]
+    assert await conn.reserve() == (id, PAYLOAD)
+    await conn.delete(id)
+    assert await conn.reserve() == (id + 1, 1)
+    raw = await create_connection(*server.address, loop=event_loop)
+    bad = await raw.put(PREFIX + b'\x01{')
+    await conn.delete(id + 1)
+    await conn.delete(id + 2)
+    with pytest.raises(CodecError) as e:
+        await conn.reserve()
+    assert e.value.id == bad
+    for c in (conn, raw):
+        c.close()
+        await c.wait_closed()
@@ -1,14 +1,16 @@
 import asyncio
-from aiobean.connection import create_connection, ConnectionClosedError
-from aiobean.protocol import DeadlineSoon
+from aiobean.connection import (
+    create_connection, ConnectionClosedError, ResponseProtocol,
+)
+from aiobean.protocol import CommandFailed, DeadlineSoon
 import pytest
 
 
 pytestmark = pytest.mark.asyncio(forbid_global_loop=True)
 
 
-@pytest.fixture
-def conn_factory(server, event_loop):
+@pytest.fixture(params=[False, True], ids=['stream', 'buffered'])
+def conn_factory(server, event_loop, request):
 
     class ConnContext:
 
@@ -17,7 +19,7 @@ def conn_factory(server, event_loop):
 
         async def __aenter__(self):
             self._conn = await create_connection(
-                *server.address, loop=event_loop)
+                *server.address, loop=event_loop, buffered=request.param)
             return self._conn
 
         async def __aexit__(self, exc_type, exc, tb):
@@ -111,7 +113,7 @@ async def test_worker(conn_factory):
             assert await producer.tubes() == ['default', tube]
 
             # nothing is ready in the default tube
-            assert not await worker.reserve(0.1)
+            assert not await worker.reserve(0)
 
             # work in test tube
             await worker.watch(tube)
@@ -129,7 +131,7 @@ async def test_worker(conn_factory):
             # delete when finished
             assert await worker.reserve() == (jid, b'test')
             await worker.delete(jid)
-            assert not await worker.reserve(0.1)  # no job anymore
+            assert not await worker.reserve(0)  # no job anymore
 
             # bury
             jid = await producer.put(b'bury')
@@ -138,7 +140,7 @@ async def test_worker(conn_factory):
             await worker.peek_buried()
             # kick
             assert await producer.kick(1) == 1
-            assert (await worker.reserve(0.1))[0] == jid
+            assert (await worker.reserve(0))[0] == jid
             await worker.delete(jid)
             # bury it again to test bury-job
             jid = await producer.put(b'bury2')
@@ -173,3 +175,258 @@ async def test_stats(conn_factory):
         # can get tube status
         tube_stats = await conn.stats_tube()
         assert tube_stats['name'] == 'default'
+
+
+async def test_pipeline(conn_factory):
+    async with conn_factory() as conn:
+        pipe = conn.pipeline()
+        assert pipe.put(b'a') == 0
+        assert pipe.put(b'b') == 1
+        pipe.delete(2**31)  # not found
+        pipe.stats()
+        assert len(pipe) == 4
+        first, second, not_found, stats = await pipe.send()
+        assert second == first + 1
+        assert isinstance(not_found, CommandFailed)
+        assert 'version' in stats
+        assert not len(pipe)
+        assert await pipe.send() == []
+
+
+async def test_pipeline_closed(conn_factory, event_loop):
+    async with conn_factory() as conn:
+        pipe = conn.pipeline()
+        pipe.stats()
+        pipe.reserve()  # waits for a job that never comes
+        send = asyncio.ensure_future(pipe.send(), loop=event_loop)
+        while len(conn._queue) != 1:  # sent, and stats answered
+            await asyncio.sleep(0.01, loop=event_loop)
+        conn.close()
+        stats, reserve = await send
+        assert 'version' in stats
+        assert isinstance(reserve, ConnectionClosedError)
+
+
+async def test_put_many_delete_many(conn_factory):
+    async with conn_factory() as conn:
+        ids = await conn.put_many([b'job'] * 100)
+        assert len(set(ids)) == 100
+        assert await conn.delete_many(ids) == [None] * 100
+        assert not await conn.peek_ready()
+
+
+async def test_flow_control(server, event_loop):
+    conn = await create_connection(
+        *server.address, loop=event_loop, max_inflight=2, write_limit=1024)
+    try:
+        sends = [
+            asyncio.ensure_future(conn.send('put', 0, 0, 10, 2, body=b'hi'),
+                                  loop=event_loop)
+            for _ in range(10)
+        ]
+        await asyncio.sleep(0, loop=event_loop)
+        assert len(conn._queue) <= 2
+        ids = await asyncio.gather(*sends, loop=event_loop)
+        assert len(set(ids)) == 10
+        # pipelines are written in chunks of at most max_inflight commands
+        assert len(await conn.put_many([b'hi'] * 5)) == 5
+    finally:
+        conn.close()
+        await conn.wait_closed()
+    with pytest.raises(ConnectionClosedError):
+        await conn.wait_writable()
+
+
+async def test_flow_control_concurrent_senders(event_loop):
+    reading = asyncio.Event(loop=event_loop)
+
+    async def handle(reader, writer):
+        await reading.wait()  # the client's write buffer fills up meanwhile
+        id = 0
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            await reader.readexactly(int(line.split()[-1]) + 2)  # the body
+            id += 1
+            writer.write(b'INSERTED %d\r\n' % id)
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0,
+                                        loop=event_loop)
+    address = server.sockets[0].getsockname()
+    conn = await create_connection(
+        *address, loop=event_loop, max_inflight=200, write_limit=1024)
+    inflight = []
+    execute = conn.execute
+
+    def counting_execute(*args, **kwargs):
+        fut = execute(*args, **kwargs)
+        inflight.append(len(conn._queue))
+        return fut
+
+    conn.execute = counting_execute
+    try:
+        body = b'x' * 2 ** 16  # more than the socket buffers take
+        sends = [
+            asyncio.ensure_future(
+                conn.send('put', 0, 0, 10, len(body), body=body),
+                loop=event_loop)
+            for _ in range(400)
+        ]
+        await asyncio.sleep(0.1, loop=event_loop)
+        reading.set()
+        ids = await asyncio.wait_for(
+            asyncio.gather(*sends, loop=event_loop), 10, loop=event_loop)
+        assert sorted(ids) == list(range(1, 401))
+        assert max(inflight) <= 200
+    finally:
+        conn.close()
+        await conn.wait_closed()
+        server.close()
+        await server.wait_closed()
+
+
+async def test_execute_later(conn_factory, event_loop):
+    async with conn_factory() as conn:
+        ready = event_loop.create_future()
+        later = conn._execute_later('use', ready)
+        use = conn.use('now')  # held back behind the first one
+        await asyncio.sleep(0.05, loop=event_loop)
+        assert not use.done()
+        ready.set_result((('later',), None))
+        assert await later == 'later'
+        assert await use == 'now'
+        assert await conn.used() == 'now'
+        failed = event_loop.create_future()
+        fut = conn._execute_later('use', failed)
+        put = conn.put(b'job')
+        failed.set_exception(ValueError())
+        with pytest.raises(ValueError):
+            await fut
+        # nothing was sent for it
+        assert (await conn.stats_job(await put))['tube'] == 'now'
+
+
+async def test_empty_body(conn_factory):
+    async with conn_factory() as conn:
+        jid = await conn.put(b'')
+        assert await conn.peek(jid) == (jid, b'')
+        assert await conn.reserve(0) == (jid, b'')
+        await conn.delete(jid)
+        # the connection reads on after the empty bodies
+        assert 'version' in await conn.stats()
+
+
+@pytest.mark.parametrize('buffered', [False, True])
+async def test_malformed_response(event_loop, buffered):
+
+    async def handle(reader, writer):
+        await reader.readline()
+        writer.write(b'RESERVED 1 many\r\n')
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0,
+                                        loop=event_loop)
+    conn = await create_connection(*server.sockets[0].getsockname(),
+                                   loop=event_loop, buffered=buffered)
+    errors = []
+    event_loop.set_exception_handler(lambda loop, context: errors.append(
+        context))
+    try:
+        with pytest.raises(ValueError):
+            await asyncio.wait_for(conn.stats(), 5, loop=event_loop)
+        await asyncio.wait_for(conn.wait_closed(), 5, loop=event_loop)
+        assert conn.closed
+        # closed by the connection, not by the loop on an error
+        assert not errors
+    finally:
+        event_loop.set_exception_handler(None)
+        conn.close()
+        server.close()
+        await server.wait_closed()
+
+
+async def test_big_body(conn_factory):
+    body = bytes(range(250)) * 260  # doesn't fit the rest of the buffer
+    async with conn_factory() as conn:
+        jid = await conn.put(body)
+        assert await conn.peek(jid) == (jid, body)
+
+
+async def wait_ready(conn, id, event_loop):
+    while (await conn.stats_job(id))['state'] != 'ready':
+        await asyncio.sleep(0.01, loop=event_loop)
+
+
+async def test_cancelled_reserve(conn_factory, event_loop):
+    async with conn_factory() as conn, conn_factory() as producer:
+        reserve = conn.reserve()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(reserve, 0.1, loop=event_loop)
+        assert reserve.cancelled()
+        jid = await producer.put(b'job', pri=7)
+        # the connection survives, and gives the job back
+        assert await conn.stats()
+        await asyncio.wait_for(wait_ready(producer, jid, event_loop), 5,
+                               loop=event_loop)
+        stats = await producer.stats_job(jid)
+        assert stats['pri'] == 7
+        assert stats['releases'] == 1
+        assert not conn.closed
+
+
+async def test_deadline(conn_factory):
+    async with conn_factory() as conn:
+        with pytest.raises(asyncio.TimeoutError):
+            await conn.reserve(timeout=1, deadline=0.05)
+        # behind the TIMED_OUT response, which is dropped
+        assert (await conn.stats(deadline=5))['cmd-reserve-with-timeout']
+        assert not conn.closed
+        with pytest.raises(ValueError):
+            conn.pipeline().stats(deadline=1)
+
+
+async def test_job(conn_factory):
+    async with conn_factory() as conn:
+        await conn.put(b'job', pri=3, ttr=20)
+        job = await conn.reserve()
+        assert job.conn is conn
+        stats = await job.stats()
+        assert (stats['pri'], stats['ttr']) == (3, 20)
+        assert await job.stats() is stats
+        assert (await conn.stats())['cmd-stats-job'] == 1
+        await job.release(pri=4)
+        job = await conn.reserve()
+        assert (await job.stats())['pri'] == 4
+        await job.touch()
+        await job.bury()
+        assert (await job.stats())['state'] == 'buried'
+        await conn.kick_job(job.id)
+        job = await conn.reserve()
+        await job.delete()
+        assert (await conn.stats())['current-jobs-reserved'] == 0
+
+
+def test_response_protocol(event_loop):
+    responses = []
+    protocol = ResponseProtocol(event_loop, buffer_size=32)
+    protocol.set_handler(lambda *response: responses.append(response))
+    data = (
+        b'INSERTED 1\r\n'
+        b'RESERVED 1 3\r\nabc\r\n'
+        b'OK 40\r\n' + b'x' * 40 + b'\r\n'
+        b'DELETED\r\n'
+    )
+    # heads and bodies split at every possible position
+    for byte in data:
+        buf = protocol.get_buffer(-1)
+        buf[0] = byte
+        protocol.buffer_updated(1)
+    assert [(status, headers) for status, headers, _ in responses] == [
+        (b'INSERTED', [b'1']),
+        (b'RESERVED', [b'1', b'3']),
+        (b'OK', [b'40']),
+        (b'DELETED', []),
+    ]
+    assert [body for _, _, body in responses] == [
+        None, b'abc', b'x' * 40, None]
@@ -0,0 +1,141 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from aiobean.connection import create_connection
+from aiobean.funnel import Funnel, FunnelError, FunnelProducer, _claimed
+import pytest
+
+
+pytestmark = pytest.mark.asyncio(forbid_global_loop=True)
+
+
+def produce(path, count):
+    with FunnelProducer(path) as producer:
+        return [producer.put(b'job', tube='funnel', timeout=10)
+                for _ in range(count)]
+
+
+@pytest.fixture
+def conn(server, event_loop):
+    conn = event_loop.run_until_complete(
+        create_connection(*server.address, loop=event_loop))
+    yield conn
+    conn.close()
+    event_loop.run_until_complete(conn.wait_closed())
+
+
+@pytest.fixture
+def funnel(conn, event_loop, tmpdir):
+    funnel = Funnel(conn, str(tmpdir.join('funnel')), producers=4,
+                    ring_size=256, responses=4, loop=event_loop)
+    funnel.start()
+    yield funnel
+    funnel.close()
+    event_loop.run_until_complete(funnel.wait_closed())
+
+
+async def test_put(funnel, conn, event_loop):
+    def put():
+        with FunnelProducer(funnel.path) as producer:
+            assert producer.slot == 0
+            id = producer.put(b'hello', pri=5, delay=0, ttr=30, tube='a')
+            # more than the ring and responses hold, wrapping around
+            ids = producer.put_many([b'x' * 40] * 20, tube='b')
+            return id, ids
+
+    id, ids = await event_loop.run_in_executor(None, put)
+    assert await conn.peek(id) == (id, b'hello')
+    stats = await conn.stats_job(id)
+    assert (stats['tube'], stats['pri'], stats['ttr']) == ('a', 5, 30)
+    assert ids == list(range(id + 1, id + 21))
+    assert (await conn.stats_job(ids[-1]))['tube'] == 'b'
+
+
+async def test_ring_too_small(funnel, event_loop):
+    with FunnelProducer(funnel.path) as producer:
+        with pytest.raises(ValueError):
+            producer.put(b'x' * 300)
+
+
+async def test_no_funnel(funnel, conn, event_loop, tmpdir):
+    funnel.close()
+    await funnel.wait_closed()
+    with pytest.raises(FileNotFoundError):
+        FunnelProducer(funnel.path)
+    path = str(tmpdir.join('stopped'))
+    stopped = Funnel(conn, path, producers=1, loop=event_loop)
+    with FunnelProducer(path) as producer:
+        with pytest.raises(FunnelError):
+            FunnelProducer(path)  # no slot left
+        with pytest.raises(FunnelError):
+            producer.put(b'never answered', timeout=0.05)
+    await stopped.wait_closed()
+
+
+async def die(funnel):
+    """stop `funnel` as if its process was killed"""
+    funnel._task.cancel()
+    await asyncio.wait([funnel._task], loop=funnel._loop)
+    funnel._map.close()
+    os.close(funnel._fd)
+    _claimed.discard(funnel._key)
+
+
+async def test_closed(funnel, conn, event_loop):
+    with pytest.raises(FunnelError):
+        Funnel(conn, funnel.path, loop=event_loop)  # already running
+    with FunnelProducer(funnel.path) as producer:
+        funnel.close()
+        await funnel.wait_closed()
+        start = time.monotonic()
+        with pytest.raises(FunnelError):
+            producer.put(b'job')
+        assert time.monotonic() - start < 1
+
+
+async def test_restart(funnel, conn, event_loop):
+    with FunnelProducer(funnel.path) as producer:
+        funnel._task.cancel()
+        # taken by the funnel, then never answered
+        lost = producer._publish(b'lost', 'default', 0, 0, 10, None)
+        funnel._collect(producer.slot, [])
+        waiting = producer._publish(b'waiting', 'default', 0, 0, 10, None)
+        await die(funnel)
+        restarted = Funnel(conn, funnel.path, producers=4, ring_size=256,
+                           responses=4, loop=event_loop)
+        assert restarted.generation == funnel.generation + 1
+        restarted.start()
+        try:
+            with pytest.raises(FunnelError):
+                producer._result(lost, None)
+            id = await event_loop.run_in_executor(
+                None, producer._result, waiting, time.monotonic() + 5)
+            assert await conn.peek(id) == (id, b'waiting')
+            id = await event_loop.run_in_executor(
+                None, producer.put, b'after')
+            assert await conn.peek(id) == (id, b'after')
+            await die(restarted)
+            # another layout: the file is replaced, not truncated
+            other = Funnel(conn, funnel.path, producers=2, loop=event_loop)
+            with pytest.raises(FunnelError):
+                producer.put(b'job')
+            with FunnelProducer(funnel.path) as new:
+                assert new._ring_size == 2 ** 16
+            await other.wait_closed()
+        finally:
+            restarted.close()
+            await restarted.wait_closed()
+
+
+async def test_processes(funnel, conn, event_loop):
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(3) as pool:
+        results = await event_loop.run_in_executor(
+            None, pool.starmap, produce, [(funnel.path, 30)] * 3)
+    ids = [id for result in results for id in result]
+    assert len(set(ids)) == 90
+    stats = await conn.stats_tube('funnel')
+    assert stats['total-jobs'] == 90
+    # the funnel's, which the test shares
+    assert (await conn.stats())['current-connections'] == 1
@@ -0,0 +1,100 @@
+import asyncio
+from aiobean.connection import create_connection
+from aiobean.lease import LeaseManager
+from aiobean.worker import Worker
+import pytest
+
+
+pytestmark = pytest.mark.asyncio(forbid_global_loop=True)
+
+
+@pytest.fixture
+def conn(server, event_loop):
+    conn = event_loop.run_until_complete(
+        create_connection(*server.address, loop=event_loop))
+    yield conn
+    conn.close()
+    event_loop.run_until_complete(conn.wait_closed())
+
+
+async def test_touch(conn, event_loop):
+    leases = LeaseManager(loop=event_loop)
+    await conn.put(b'job', ttr=2)
+    id, _ = await conn.reserve()
+    leases.add(conn, id, ttr=2)
+    assert (conn, id) in leases
+    # without touches the job would have been released after 2 seconds
+    await asyncio.sleep(3, loop=event_loop)
+    assert (await conn.stats_job(id))['state'] == 'reserved'
+    assert leases.remove(conn, id)
+    assert not leases
+    await conn.delete(id)
+    leases.close()
+
+
+async def test_track(conn, event_loop):
+    leases = LeaseManager(loop=event_loop)
+    await conn.put(b'job', ttr=5)
+    id, _ = await conn.reserve()
+    await leases.track(conn, id)
+    assert (conn, id) in leases
+    # a lease of a job the connection no longer holds is dropped
+    await conn.delete(id)
+    await leases.deadline_soon(conn)
+    assert not leases
+    leases.close()
+
+
+async def test_touch_fails(conn, event_loop):
+    errors = []
+    event_loop.set_exception_handler(lambda loop, context: errors.append(
+        context))
+    leases = LeaseManager(ratio=0.1, loop=event_loop)
+    await conn.put(b'job', ttr=2)
+    id, _ = await conn.reserve()
+    pipeline = conn.pipeline
+
+    class BrokenPipeline:
+        def touch(self, id):
+            pass
+
+        async def send(self):
+            raise RuntimeError('broken')
+
+    conn.pipeline = BrokenPipeline
+    try:
+        leases.add(conn, id, ttr=2)
+        await asyncio.sleep(0.5, loop=event_loop)
+        # kept, and touched once the connection works again
+        assert (conn, id) in leases
+        conn.pipeline = pipeline
+        await asyncio.sleep(2, loop=event_loop)
+        assert (await conn.stats_job(id))['state'] == 'reserved'
+    finally:
+        event_loop.set_exception_handler(None)
+    assert not errors
+    leases.close()
+    await conn.delete(id)
+
+
+async def test_worker_leases(conn, server, event_loop):
+    worker_conn = await create_connection(*server.address, loop=event_loop)
+    leases = LeaseManager(loop=event_loop)
+    jid = await conn.put(b'slow', ttr=2)
+    done = []
+
+    async def handler(id, body):
+        await asyncio.sleep(3, loop=event_loop)
+        done.append(id)
+        worker.close()
+
+    worker = Worker(handler, [worker_conn], reserve_timeout=1,
+                    leases=leases, loop=event_loop)
+    await asyncio.wait_for(worker.run(), 10, loop=event_loop)
+    # processed once, despite running past its TTR
+    assert done == [jid]
+    assert not await conn.peek(jid)
+    assert not leases
+    leases.close()
+    worker_conn.close()
+    await worker_conn.wait_closed()
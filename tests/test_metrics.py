@@ -0,0 +1,63 @@
+import math
+from aiobean.connection import create_connection
+from aiobean.metrics import Histogram, Metrics
+import pytest
+
+
+pytestmark = pytest.mark.asyncio(forbid_global_loop=True)
+
+
+def test_histogram():
+    histogram = Histogram(low=1, buckets=4)
+    for value in (0.5, 1.5, 3, 3, 100):
+        histogram.record(value)
+    assert list(histogram.counts) == [1, 1, 2, 1]
+    assert histogram.upper_bound(3) == math.inf
+    assert histogram.percentile(0.5) == 4
+    assert histogram.percentile(1) == 100
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == 5
+    assert snapshot['max'] == 100
+    assert snapshot['buckets'][0] == (1, 1)
+    assert Histogram().percentile(0.99) == 0
+
+
+@pytest.mark.parametrize('value,index', [
+    (0, 0), (1, 0), (1.001, 1), (2, 1), (2.001, 2), (4, 2), (8, 3),
+    (16, 4), (16.5, 5), (32, 5), (1000, 5),
+])
+def test_histogram_edges(value, index):
+    histogram = Histogram(low=1, buckets=6)
+    histogram.record(value)
+    assert histogram.counts[index] == 1
+    # within the bounds the bucket reports
+    assert value <= histogram.upper_bound(index)
+    assert index == 0 or value > histogram.upper_bound(index - 1)
+
+
+@pytest.mark.parametrize('buffered', [False, True])
+async def test_metrics(server, event_loop, buffered):
+    metrics = Metrics()
+    conn = await create_connection(
+        *server.address, loop=event_loop, buffered=buffered, metrics=metrics)
+    id = await conn.put(b'job')
+    await conn.delete_many([id, id])
+    await conn.peek(id)
+    snapshot = metrics.snapshot(reset=True)
+    assert snapshot['latency']['put']['count'] == 1
+    assert snapshot['latency']['delete']['count'] == 2
+    assert snapshot['statuses'] == {'NOT_FOUND': 2}
+    assert snapshot['bytes_sent'] == len(
+        b'put 4294967296 0 300 3\r\njob\r\n'
+        b'delete 1\r\ndelete 1\r\npeek 1\r\n')
+    assert snapshot['bytes_received'] == len(
+        b'INSERTED 1\r\nDELETED\r\nNOT_FOUND\r\nNOT_FOUND\r\n')
+    assert snapshot['inflight'] == 0
+    assert snapshot['inflight_max'] == 2
+    conn.stats()
+    conn.close()
+    await conn.wait_closed()
+    snapshot = metrics.snapshot()
+    assert snapshot['lost'] == 1
+    assert snapshot['inflight'] == 0
+    assert 'put' not in snapshot['latency']
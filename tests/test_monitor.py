@@ -0,0 +1,59 @@
+import asyncio
+from aiobean.connection import create_connection
+from aiobean.monitor import StatsMonitor
+import pytest
+
+
+pytestmark = pytest.mark.asyncio(forbid_global_loop=True)
+
+
+@pytest.fixture
+def conn(server, event_loop):
+    conn = event_loop.run_until_complete(
+        create_connection(*server.address, loop=event_loop))
+    yield conn
+    conn.close()
+    event_loop.run_until_complete(conn.wait_closed())
+
+
+async def test_single_flight(conn, event_loop):
+    sent = []
+    execute = conn.execute
+
+    def counting_execute(command, *args, **kwargs):
+        sent.append(command)
+        return execute(command, *args, **kwargs)
+
+    conn.execute = counting_execute
+    monitor = StatsMonitor(conn, ttl=10, loop=event_loop)
+    results = await asyncio.gather(
+        *[monitor.stats_tube() for _ in range(10)], loop=event_loop)
+    assert all(stats is results[0] for stats in results)
+    # cached afterwards
+    assert await monitor.stats_tube() is results[0]
+    assert sent.count('stats-tube') == 1
+    assert (await monitor.stats())['current-jobs-ready'] == 0
+    assert await monitor.tubes() == ['default']
+    assert sent.count('stats') == 1
+    assert sent.count('list-tubes') == 1
+
+
+async def test_ttl(conn, event_loop):
+    monitor = StatsMonitor(conn, ttl=0.05, loop=event_loop)
+    before = await monitor.stats_tube()
+    await conn.put(b'job')
+    assert await monitor.stats_tube() is before
+    await asyncio.sleep(0.1, loop=event_loop)
+    assert (await monitor.stats_tube())['current-jobs-ready'] == 1
+
+
+async def test_refresh(conn, event_loop):
+    await conn.use('foo')
+    await conn.put(b'job')
+    monitor = StatsMonitor(conn, loop=event_loop)
+    monitor.start(interval=0.05)
+    await asyncio.sleep(0.02, loop=event_loop)
+    stats = monitor.all_tube_stats()
+    assert set(stats) == {'default', 'foo'}
+    assert stats['foo']['current-jobs-ready'] == 1
+    monitor.stop()
@@ -0,0 +1,90 @@
+import asyncio
+from aiobean.pool import create_pool, PoolClosedError
+import pytest
+
+
+pytestmark = pytest.mark.asyncio(forbid_global_loop=True)
+
+
+@pytest.fixture
+def pool_factory(server, event_loop):
+
+    class PoolContext:
+
+        def __init__(self, size=2):
+            self._size = size
+            self._pool = None
+
+        async def __aenter__(self):
+            self._pool = await create_pool(
+                *server.address, size=self._size, loop=event_loop)
+            return self._pool
+
+        async def __aexit__(self, exc_type, exc, tb):
+            self._pool.close()
+            await self._pool.wait_closed()
+
+    return PoolContext
+
+
+async def test_put(pool_factory):
+    async with pool_factory() as pool:
+        ids = await asyncio.gather(*[
+            pool.put(b'job', tube='tube-{}'.format(i % 3))
+            for i in range(30)
+        ])
+        assert len(set(ids)) == 30
+        async with pool.get() as conn:
+            for i in range(3):
+                stats = await conn.stats_tube('tube-{}'.format(i))
+                assert stats['current-jobs-ready'] == 10
+
+
+async def test_tube_affinity(pool_factory):
+    async with pool_factory() as pool:
+        async with pool.get('foo') as conn:
+            assert await conn.used() == 'foo'
+        # the connection already using the tube is preferred
+        async with pool.get('foo') as again:
+            assert again is conn
+            async with pool.get('bar') as other:
+                assert other is not conn
+                assert await other.used() == 'bar'
+
+
+async def test_acquire_waits(pool_factory, event_loop):
+    async with pool_factory(size=1) as pool:
+        conn = await pool.acquire()
+        waiting = asyncio.ensure_future(pool.acquire('foo'), loop=event_loop)
+        await asyncio.sleep(0.01, loop=event_loop)
+        assert not waiting.done()
+        pool.release(conn)
+        assert await waiting is conn
+        assert await conn.used() == 'foo'
+        pool.release(conn)
+
+
+async def test_refill_concurrently(pool_factory, event_loop):
+    async with pool_factory(size=3) as pool:
+        for conn in pool._conns:
+            conn.close()  # lost
+        acquires = [asyncio.ensure_future(pool.acquire(), loop=event_loop)
+                    for _ in range(6)]
+        done, pending = await asyncio.wait(
+            acquires, timeout=1, loop=event_loop)
+        assert len(done) == 3
+        assert len(pool._conns) == 3
+        for fut in done:
+            pool.release(fut.result())
+        conns = await asyncio.gather(*pending, loop=event_loop)
+        assert len(set(conns)) == 3
+        assert len(pool._conns) == 3
+        for conn in conns:
+            pool.release(conn)
+
+
+async def test_closed(pool_factory):
+    async with pool_factory() as pool:
+        pool.close()
+        with pytest.raises(PoolClosedError):
+            await pool.put(b'job')
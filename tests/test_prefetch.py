@@ -0,0 +1,89 @@
+import asyncio
+from aiobean.connection import create_connection
+from aiobean.prefetch import Prefetcher
+import pytest
+
+
+pytestmark = pytest.mark.asyncio(forbid_global_loop=True)
+
+
+@pytest.fixture
+def connections(server, event_loop):
+    conns = []
+
+    async def factory(count=1):
+        for _ in range(count):
+            conns.append(await create_connection(
+                *server.address, loop=event_loop))
+        return conns[-count:]
+
+    yield factory
+    for conn in conns:
+        conn.close()
+        event_loop.run_until_complete(conn.wait_closed())
+
+
+async def test_prefetch(connections, event_loop):
+    producer, *conns = await connections(3)
+    ids = await producer.put_many([b'job'] * 20, pri=10)
+    prefetcher = Prefetcher(conns, size=8, depth=4, poll_interval=0.1,
+                            loop=event_loop)
+    prefetcher.start()
+    got = []
+    for _ in range(10):
+        id, body = await prefetcher.get()
+        got.append(id)
+        await prefetcher.delete(id)
+    await asyncio.sleep(0.05, loop=event_loop)
+    # the buffer stays bounded
+    assert len(prefetcher) <= 8
+    stats = await producer.stats_tube()
+    assert stats['current-jobs-reserved'] <= 8
+    prefetcher.close()
+    assert await prefetcher.get() is None
+    await prefetcher.wait_closed()
+    stats = await producer.stats_tube()
+    assert stats['current-jobs-reserved'] == 0
+    assert stats['current-jobs-ready'] == 10
+    assert set(got) < set(ids)
+    # given back with the priority they had
+    assert (await producer.peek_ready())[0] not in got
+    assert (await producer.stats_job(ids[-1]))['pri'] == 10
+
+
+async def test_max_age(connections, event_loop):
+    producer, conn = await connections(2)
+    old = await producer.put(b'old', pri=5)
+    prefetcher = Prefetcher([conn], max_age=0.05, poll_interval=0.1,
+                            loop=event_loop)
+    prefetcher.start()
+    while not len(prefetcher):
+        await asyncio.sleep(0.01, loop=event_loop)
+    await asyncio.sleep(0.1, loop=event_loop)
+    # too old to hand out; given back, as often as it got too old, and
+    # reserved again
+    assert await prefetcher.get() == (old, b'old')
+    stats = await producer.stats_job(old)
+    assert stats['releases'] >= 1
+    assert stats['pri'] == 5
+    prefetcher.close()
+    await prefetcher.wait_closed()
+
+
+async def test_ttr(connections, event_loop):
+    producer, conn = await connections(2)
+    id = await producer.put(b'job', pri=5, ttr=2)
+    prefetcher = Prefetcher([conn], poll_interval=1, loop=event_loop)
+    prefetcher.start()
+    while not len(prefetcher):
+        await asyncio.sleep(0.01, loop=event_loop)
+    # given back a second before its TTR is up, not left to time out
+    await asyncio.sleep(1.3, loop=event_loop)
+    stats = await producer.stats_job(id)
+    assert stats['releases'] >= 1
+    assert stats['timeouts'] == 0
+    assert stats['pri'] == 5
+    assert await prefetcher.get() == (id, b'job')
+    await prefetcher.delete(id)
+    prefetcher.close()
+    await prefetcher.wait_closed()
@@ -1,6 +1,6 @@
 from aiobean.protocol import (
-    CommandFailed, InvalidCommand, PYYAML, UnexpectedResponse,
-    encode_command, handle_head, handle_response,
+    CommandFailed, CommandsMixin, InvalidCommand, Job, PYYAML, ProtocolParser,
+    UnexpectedResponse, encode, encode_command, handle_head, handle_response,
     _parse_body, _parse_int, _parse_str, _parse_yml,
 )
 import pytest
@@ -24,11 +24,47 @@ def test_encode_command():
 def test_invalid_command():
     with pytest.raises(InvalidCommand):
         _encode_command('blah')
+    with pytest.raises(InvalidCommand):
+        encode('blah')
+
+
+@pytest.mark.parametrize('args,kwargs', [
+    [('reserve',), {}],
+    [('peek', 10), {}],
+    [('use', 'tube'), {}],
+    [('pause-tube', 'tube', 10), {}],
+    [('put', 10, 0, 10, 2), {'body': b'ab'}],
+    [('put', 10, 0, 10, 2), {'body': memoryview(b'ab')}],
+    # arguments not matching the precompiled format
+    [('peek', '10'), {}],
+])
+def test_encode(args, kwargs):
+    assert b''.join(encode(*args, **kwargs)) == \
+        b''.join(_encode_command(*args, **kwargs))
+
+
+def test_reserve_timeout():
+    class Commands(CommandsMixin):
+        def execute(self, command, *args, deadline=None):
+            return (command,) + args
+
+    commands = Commands()
+    assert commands.reserve() == ('reserve',)
+    assert commands.reserve(0) == ('reserve-with-timeout', 0)
+    assert commands.reserve(2) == ('reserve-with-timeout', 2)
+    # whole seconds only: rounded up, not down to a busy poll
+    assert commands.reserve(0.1) == ('reserve-with-timeout', 1)
 
 
-def test_body_type():
+def test_encode_body_zero_copy():
+    body = bytearray(b'ab')
+    assert encode('put', 10, 0, 10, 2, body=body)[1] is body
+
+
+@pytest.mark.parametrize('encoder', [_encode_command, encode])
+def test_body_type(encoder):
     with pytest.raises(TypeError) as exc_info:
-        _encode_command('put', body='body')
+        encoder('put', 10, 0, 10, 4, body='body')
     exc_info.match('must be a byte-like object')
 
 
@@ -46,6 +82,46 @@ def test_handle_head():
         assert handle_head(line)[2] == 10
 
 
+_responses = (
+    b'INSERTED 1\r\n'
+    b'RESERVED 1 3\r\nabc\r\n'
+    b'OK 40\r\n' + b'x' * 40 + b'\r\n'
+    b'DELETED\r\n'
+    b'RESERVED 2 0\r\n\r\n'  # an empty job
+    b'FOUND 2 0\r\n\r\n'
+    b'DELETED\r\n'
+)
+_events = [
+    (b'INSERTED', [b'1'], None),
+    (b'RESERVED', [b'1', b'3'], b'abc'),
+    (b'OK', [b'40'], b'x' * 40),
+    (b'DELETED', [], None),
+    (b'RESERVED', [b'2', b'0'], b''),
+    (b'FOUND', [b'2', b'0'], b''),
+    (b'DELETED', [], None),
+]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 5, 13, len(_responses)])
+def test_parser_feed(chunk_size):
+    parser = ProtocolParser(buffer_size=32)
+    events = []
+    for i in range(0, len(_responses), chunk_size):
+        events.extend(parser.feed(_responses[i:i + chunk_size]))
+    assert events == _events
+    # the 40 bytes body does not fit and is handed out without a copy
+    assert isinstance(events[2][2], memoryview)
+    # nothing left over; the parser can be reused
+    assert parser.feed(_responses) == _events
+
+
+def test_parser_buffer():
+    parser = ProtocolParser()
+    buf = parser.get_buffer()
+    buf[:len(_responses)] = _responses
+    assert parser.buffer_updated(len(_responses)) == _events
+
+
 def test_handle_reponse():
     # ok response
     assert handle_response('put', b'INSERTED', [b'10'], None) == 10
@@ -75,6 +151,52 @@ def test_parser(parser, args, expected):
     assert parser(*args) == expected
 
 
+def test_job():
+    job = Job(10, b'body')
+    id, body = job
+    assert (id, body) == (10, b'body')
+    assert job == (10, b'body') and (10, b'body') == job
+    assert job != (11, b'body') and job != 10
+    assert job == Job(10, b'body')
+    assert (job[0], job[-1], len(job)) == (10, b'body', 2)
+    with pytest.raises(TypeError):
+        hash(job)
+    with pytest.raises(AttributeError):
+        job.tube = 'default'  # no __dict__
+
+
+_stats_body = b'''---
+current-jobs-urgent: 0
+version: "1.10"
+rusage-utime: 0.012000
+draining: false
+id: 9e6a4a0f5d6c4f21
+hostname: huston
+os: #1 SMP Debian 4.9.0
+'''
+
+
+def test_parse_yml_types():
+    assert _parse_yml([], _stats_body) == {
+        'current-jobs-urgent': 0,
+        'version': '1.10',
+        'rusage-utime': 0.012,
+        'draining': False,
+        'id': '9e6a4a0f5d6c4f21',
+        'hostname': 'huston',
+        'os': '#1 SMP Debian 4.9.0',
+    }
+    assert _parse_yml([], b'---\n- default\n- 2017\n') == ['default', 2017]
+    assert _parse_yml([], memoryview(b'---\n')) == {}
+
+
+@pytest.mark.skipif(not PYYAML, reason='pyyaml is not available')
+def test_parse_yml_fallback():
+    # nested structures are not part of the subset
+    assert _parse_yml([], b'---\na:\n  b: 1\n') == {'a': {'b': 1}}
+
+
 @pytest.mark.skipif(PYYAML, reason='only run when pyyaml is not available')
-def test_parse_yml_without_pyyaml():
-    assert _parse_yml([], _yml_body) == _yml_body.decode()
+def test_parse_yml_fallback_without_pyyaml():
+    body = b'---\na:\n  b: 1\n'
+    assert _parse_yml([], body) == body.decode()
@@ -0,0 +1,94 @@
+import asyncio
+from aiobean.connection import create_connection, ConnectionClosedError
+from aiobean.reconnect import create_reconnecting_connection
+import pytest
+
+
+pytestmark = pytest.mark.asyncio(forbid_global_loop=True)
+
+
+@pytest.fixture
+def conn(server, event_loop):
+    conn = event_loop.run_until_complete(create_reconnecting_connection(
+        *server.address, loop=event_loop, min_backoff=0.01, max_backoff=0.1))
+    yield conn
+    conn.close()
+    event_loop.run_until_complete(conn.wait_closed())
+
+
+async def restart(server, conn, event_loop):
+    server.terminate()
+    while conn.connected:
+        await asyncio.sleep(0.01, loop=event_loop)
+    server.start()
+
+
+async def test_replay_session(server, conn, event_loop):
+    await conn.use('foo')
+    await conn.watch('bar')
+    await conn.ignore('default')
+    await restart(server, conn, event_loop)
+    # sent while disconnected
+    id = await conn.put(b'job')
+    assert conn.reconnects == 1
+    assert await conn.used() == 'foo'
+    assert await conn.watched() == ['bar']
+    assert (await conn.stats_job(id))['tube'] == 'foo'
+
+
+async def test_retry_reserve(server, conn, event_loop):
+    reserve = conn.reserve()
+    await asyncio.sleep(0.05, loop=event_loop)
+    await restart(server, conn, event_loop)
+    producer = await create_connection(*server.address, loop=event_loop)
+    id = await producer.put(b'job')
+    assert await asyncio.wait_for(reserve, 5, loop=event_loop) == (id, b'job')
+    producer.close()
+    await producer.wait_closed()
+
+
+async def test_cancelled_reserve(server, conn, event_loop):
+    with pytest.raises(asyncio.TimeoutError):
+        await conn.reserve(deadline=0.1)
+    producer = await create_connection(*server.address, loop=event_loop)
+    id = await producer.put(b'job', pri=7)
+    while (await producer.stats_job(id))['state'] != 'ready':
+        await asyncio.sleep(0.01, loop=event_loop)
+    stats = await producer.stats_job(id)
+    assert (stats['pri'], stats['releases']) == (7, 1)
+    producer.close()
+    await producer.wait_closed()
+
+
+async def test_unsafe_command(server, conn, event_loop):
+    await restart(server, conn, event_loop)
+    await conn.stats()
+    # a delete written just before the connection is lost
+    delete = conn.delete(1)
+    conn._conn.close()
+    with pytest.raises(ConnectionClosedError):
+        await delete
+    assert await conn.stats()
+
+
+async def test_pipeline_lost(server, conn, event_loop):
+    await restart(server, conn, event_loop)
+    await conn.stats()
+    pipe = conn.pipeline()
+    pipe.stats()  # sent again
+    pipe.delete(1)  # fails
+    send = asyncio.ensure_future(pipe.send(), loop=event_loop)
+    await asyncio.sleep(0, loop=event_loop)
+    conn._conn.close()
+    stats, delete = await asyncio.wait_for(send, 5, loop=event_loop)
+    assert 'version' in stats
+    assert isinstance(delete, ConnectionClosedError)
+
+
+async def test_close(conn):
+    reserve = conn.reserve()
+    conn.close()
+    with pytest.raises(asyncio.CancelledError):
+        await reserve
+    with pytest.raises(ConnectionClosedError):
+        conn.put(b'job')
@@ -0,0 +1,116 @@
+import asyncio
+from collections import Counter
+from aiobean.sharding import create_sharded_client, ShardedClient, JobId
+import pytest
+
+
+pytestmark = pytest.mark.asyncio(forbid_global_loop=True)
+
+
+@pytest.fixture
+def client_factory(servers, event_loop):
+    clients = []
+
+    async def factory(**kwargs):
+        client = await create_sharded_client(
+            [s.address for s in servers], loop=event_loop, **kwargs)
+        clients.append(client)
+        return client
+
+    yield factory
+    for client in clients:
+        client.close()
+        event_loop.run_until_complete(client.wait_closed())
+
+
+def test_consistent_hashing():
+    servers = [('10.0.0.{}'.format(i), 11300) for i in range(4)]
+    keys = ['user:{}'.format(i) for i in range(1000)]
+    before = ShardedClient(servers[:3])
+    after = ShardedClient(servers)
+    assert before.shard_for('user:1') == before.shard_for(b'user:1')
+    spread = Counter(before.shard_for(key) for key in keys)
+    assert min(spread.values()) > 200
+    moved = [key for key in keys
+             if before.shard_for(key) != after.shard_for(key)]
+    # only keys taken over by the new server move
+    assert all(after.shard_for(key) == 3 for key in moved)
+    assert len(moved) < 400
+
+
+async def test_put_by_key(client_factory):
+    client = await client_factory()
+    shards = {(await client.put(b'job', key='user:42')).shard
+              for _ in range(5)}
+    assert shards == {client.shard_for('user:42')}
+
+
+async def test_round_robin(client_factory):
+    client = await client_factory()
+    await client.use('foo')
+    ids = [await client.put(b'job') for _ in range(6)]
+    assert Counter(id.shard for id in ids) == {0: 2, 1: 2, 2: 2}
+    stats = await client.stats_job(ids[0])
+    assert stats['tube'] == 'foo'
+
+
+async def test_reserve_fan_in(client_factory, event_loop):
+    client = await client_factory()
+    await client.watch('foo')
+    assert await client.reserve(timeout=0) is None
+    await client.use('foo')
+    ids = set()
+    for _ in range(6):
+        ids.add(await client.put(b'job'))
+    got = []
+    while len(got) < 6:
+        job_id, body = await client.reserve(timeout=1)
+        assert isinstance(job_id, JobId)
+        got.append(job_id)
+        if len(got) == 1:
+            await client.release(job_id, delay=10)
+        else:
+            await client.delete(job_id)
+    assert set(got) == ids
+    assert (await client.stats_job(got[0]))['state'] == 'delayed'
+
+
+async def test_concurrent_reserves(client_factory, event_loop):
+    client = await client_factory()
+    reserves = [asyncio.ensure_future(client.reserve(), loop=event_loop)
+                for _ in range(2)]
+    await asyncio.sleep(0.1, loop=event_loop)
+    ids = {await client.put(b'job') for _ in range(2)}
+    jobs = await asyncio.wait_for(
+        asyncio.gather(*reserves, loop=event_loop), 5, loop=event_loop)
+    assert {job_id for job_id, _ in jobs} == ids
+
+
+async def test_unclaimed_job_released(client_factory, event_loop):
+    client = await client_factory(poll_interval=1)
+    reserve = asyncio.ensure_future(client.reserve(), loop=event_loop)
+    await asyncio.sleep(0.1, loop=event_loop)
+    ids = await asyncio.gather(
+        client.put(b'job', pri=7), client.put(b'job', pri=7),
+        loop=event_loop)
+    job_id, _ = await asyncio.wait_for(reserve, 5, loop=event_loop)
+    other, = set(ids) - {job_id}
+    await asyncio.sleep(0.1, loop=event_loop)
+    assert (await client.stats_job(other))['state'] == 'reserved'
+    await asyncio.sleep(1.2, loop=event_loop)  # kept for poll_interval
+    stats = await client.stats_job(other)
+    assert stats['state'] == 'ready'
+    assert stats['pri'] == 7
+    assert not client._ready
+
+
+async def test_least_loaded(client_factory, event_loop):
+    client = await client_factory(balance='least-loaded')
+    ids = await asyncio.gather(
+        *[client.put(b'job') for _ in range(6)], loop=event_loop)
+    assert len({id.shard for id in ids}) == 3
+
+
+def test_invalid_balance():
+    with pytest.raises(ValueError):
+        ShardedClient([], balance='random')
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import time
+from aiobean.connection import create_connection
+from aiobean.supervisor import ProcessPoolHandler, Supervisor
+from aiobean.worker import Worker
+import pytest
+
+
+pytestmark = pytest.mark.asyncio(forbid_global_loop=True)
+
+
+def crunch(id, body):
+    if body.startswith(b'crash:'):
+        marker = body[len(b'crash:'):].decode()
+        if not os.path.exists(marker):
+            open(marker, 'w').close()
+            os._exit(1)
+    elif body == b'slow':
+        time.sleep(30)
+    return os.getpid()
+
+
+@pytest.fixture
+def conn(server, event_loop):
+    conn = event_loop.run_until_complete(
+        create_connection(*server.address, loop=event_loop))
+    yield conn
+    conn.close()
+    event_loop.run_until_complete(conn.wait_closed())
+
+
+async def wait_for(predicate, event_loop, timeout=20):
+    deadline = event_loop.time() + timeout
+    while not await predicate():
+        assert event_loop.time() < deadline
+        await asyncio.sleep(0.05, loop=event_loop)
+
+
+async def test_supervisor(server, conn, event_loop, tmpdir):
+    marker = str(tmpdir.join('crashed'))
+    await conn.put_many([b'job'] * 20 + ['crash:{}'.format(marker).encode()])
+    supervisor = Supervisor(
+        crunch, server.address, processes=2, min_backoff=0.01,
+        shutdown_timeout=0.5, check_interval=0.05,
+        worker_kwargs={'reserve_timeout': 1}, loop=event_loop)
+    running = asyncio.ensure_future(supervisor.run(), loop=event_loop)
+
+    async def done():
+        stats = await conn.stats_tube()
+        return stats['total-jobs'] == 21 and not (
+            stats['current-jobs-ready'] or stats['current-jobs-reserved'])
+    await wait_for(done, event_loop)
+    assert os.path.exists(marker)
+
+    async def restarted():
+        return supervisor.alive == 2
+    await wait_for(restarted, event_loop)
+    assert supervisor.restarts == 1
+
+    # a handler still running at shutdown gets its job released
+    slow = await conn.put(b'slow')
+
+    async def reserved():
+        return (await conn.stats_job(slow))['state'] == 'reserved'
+    await wait_for(reserved, event_loop)
+    supervisor.close()
+    await asyncio.wait_for(running, 20, loop=event_loop)
+    assert supervisor.alive == 0
+    stats = await conn.stats_job(slow)
+    assert stats['state'] == 'ready'
+    assert stats['releases'] == 1
+
+
+async def test_process_pool_handler(server, conn, event_loop):
+    ids = await conn.put_many([b'job'] * 4)
+    consumer = await create_connection(*server.address, loop=event_loop)
+    handler = ProcessPoolHandler(crunch, max_workers=2, loop=event_loop)
+    pids = []
+
+    async def wrapped(id, body):
+        pids.append(await handler(id, body))
+        if len(pids) == len(ids):
+            worker.close()
+
+    worker = Worker(wrapped, [consumer], concurrency=2, reserve_timeout=1,
+                    loop=event_loop)
+    await asyncio.wait_for(worker.run(), 20, loop=event_loop)
+    handler.close()
+    assert os.getpid() not in pids
+    assert (await conn.stats_tube())['current-jobs-ready'] == 0
+    consumer.close()
+    await consumer.wait_closed()
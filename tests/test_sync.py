@@ -0,0 +1,95 @@
+import asyncio
+import threading
+from concurrent.futures import CancelledError
+from aiobean.codec import Codec
+from aiobean.connection import ConnectionClosedError
+from aiobean.sync import Client
+import pytest
+
+
+@pytest.fixture
+def client(server):
+    with Client(*server.address, max_reserving=4) as client:
+        yield client
+
+
+def test_commands(client):
+    id = client.put(b'job', pri=5)
+    assert client.stats_job(id)['pri'] == 5
+    job = client.reserve()
+    assert job == (id, b'job')
+    assert job.stats()['pri'] == 5
+    job.delete()
+    with pytest.raises(asyncio.TimeoutError):
+        client.reserve(timeout=1, deadline=0.05)
+    assert client.reserve(timeout=1) is None
+    assert client.put_many([b'a', b'b']) == [id + 1, id + 2]
+
+
+def test_threads(client):
+    ids = []
+
+    def produce():
+        for _ in range(50):
+            ids.append(client.put(b'job'))
+
+    def consume():
+        for _ in range(50):
+            id, body = client.reserve()
+            client.delete(id)
+
+    threads = [threading.Thread(target=target)
+               for target in [produce, consume] * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert len(set(ids)) == 200
+    stats = client.stats()
+    assert stats['current-jobs-ready'] == stats['current-jobs-reserved'] == 0
+    # two shared connections and at most four reserving ones
+    assert stats['current-connections'] <= 6
+
+
+def test_close(server):
+    client = Client(*server.address, codec=Codec())
+    id = client.put({'hello': 'world'})
+    assert client.peek(id) == (id, {'hello': 'world'})
+    errors = []
+
+    def reserve():
+        try:
+            client.reserve()
+        except CancelledError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=reserve)
+    client.reserve()  # leaves the tube empty
+    thread.start()
+    thread.join(0.1)
+    client.close()
+    thread.join(5)
+    assert len(errors) == 1
+    with pytest.raises(ConnectionClosedError):
+        client.stats()
+
+
+def test_close_before_submit(server):
+    client = Client(*server.address)
+    errors = []
+
+    def stats():
+        try:
+            client.stats()
+        except CancelledError as e:
+            errors.append(e)
+
+    # as if the loop stopped before taking the command
+    client._submit = lambda fut, call: None
+    thread = threading.Thread(target=stats)
+    thread.start()
+    thread.join(0.1)
+    client.close()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert len(errors) == 1
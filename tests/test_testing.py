@@ -0,0 +1,83 @@
+import asyncio
+from aiobean.connection import create_connection
+from aiobean.protocol import CommandFailed, DeadlineSoon
+from aiobean.testing import FakeServer
+import pytest
+
+
+pytestmark = pytest.mark.asyncio(forbid_global_loop=True)
+
+
+@pytest.fixture
+def conn(event_loop):
+    server = FakeServer(loop=event_loop)
+    event_loop.run_until_complete(server.start())
+    conn = event_loop.run_until_complete(
+        create_connection(*server.address, loop=event_loop))
+    yield conn
+    conn.close()
+    event_loop.run_until_complete(conn.wait_closed())
+    server.close()
+    event_loop.run_until_complete(server.wait_closed())
+
+
+async def test_priority_and_delay(conn, event_loop):
+    low = await conn.put(b'low', pri=10)
+    high = await conn.put(b'high', pri=1)
+    delayed = await conn.put(b'delayed', pri=0, delay=1)
+    assert await conn.reserve(0) == (high, b'high')
+    assert await conn.reserve(0) == (low, b'low')
+    assert await conn.reserve(0) is None
+    assert (await conn.stats_job(delayed))['state'] == 'delayed'
+    assert await conn.reserve(2) == (delayed, b'delayed')
+
+
+async def test_ttr(conn, event_loop):
+    id = await conn.put(b'job', ttr=1)
+    assert await conn.reserve(0) == (id, b'job')
+    with pytest.raises(DeadlineSoon):
+        await conn.reserve()
+    await asyncio.sleep(1.1, loop=event_loop)
+    stats = await conn.stats_job(id)
+    assert stats['state'] == 'ready'
+    assert stats['timeouts'] == 1
+    with pytest.raises(CommandFailed):
+        await conn.delete(id + 1)
+
+
+async def test_bury_kick(conn):
+    id = await conn.put(b'job')
+    await conn.reserve(0)
+    await conn.bury(id, 5)
+    assert await conn.peek_buried() == (id, b'job')
+    assert (await conn.stats_tube())['current-jobs-buried'] == 1
+    assert await conn.kick(10) == 1
+    assert await conn.peek_ready() == (id, b'job')
+    assert (await conn.stats_job(id))['pri'] == 5
+
+
+async def test_pause_tube(conn, event_loop):
+    await conn.use('paused')
+    await conn.watch('paused')
+    id = await conn.put(b'job')
+    await conn.pause_tube('paused', 1)
+    assert await conn.reserve(0) is None
+    assert (await conn.stats_tube('paused'))['pause'] == 1
+    assert await conn.reserve(2) == (id, b'job')
+
+
+async def test_stats(conn):
+    await conn.put(b'job')
+    stats = await conn.stats()
+    assert stats['current-jobs-ready'] == 1
+    assert stats['cmd-put'] == 1
+    assert stats['current-connections'] == 1
+    await conn.use('foo')
+    assert await conn.tubes() == ['default', 'foo']
+    assert await conn.watched() == ['default']
+
+
+async def test_throughput(conn):
+    ids = await conn.put_many([b'x'] * 10000)
+    assert len(set(ids)) == 10000
+    assert (await conn.stats())['total-jobs'] == 10000
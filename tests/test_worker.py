@@ -0,0 +1,90 @@
+import asyncio
+from aiobean.connection import create_connection
+from aiobean.worker import Worker
+import pytest
+
+
+pytestmark = pytest.mark.asyncio(forbid_global_loop=True)
+
+
+@pytest.fixture
+def connections(server, event_loop):
+    conns = []
+
+    async def factory(count=1):
+        for _ in range(count):
+            conns.append(await create_connection(
+                *server.address, loop=event_loop))
+        return conns[-count:]
+
+    yield factory
+    for conn in conns:
+        conn.close()
+        event_loop.run_until_complete(conn.wait_closed())
+
+
+async def test_worker(connections, event_loop):
+    producer, *conns = await connections(3)
+    await producer.use('jobs')
+    ids = await producer.put_many([b'ok'] * 10 + [b'fail', b'bury'])
+    done = []
+
+    async def handler(id, body):
+        await asyncio.sleep(0.01, loop=event_loop)
+        if body != b'ok':
+            raise ValueError(body)
+        done.append(id)
+        if len(done) == 10:
+            worker.close()
+
+    worker = Worker(handler, conns, tubes=['jobs'], concurrency=4,
+                    reserve_timeout=1, failure_delay=10, loop=event_loop)
+    await asyncio.wait_for(worker.run(), 5, loop=event_loop)
+    assert sorted(done) == ids[:10]
+    stats = await producer.stats_tube('jobs')
+    # failed jobs are released, and delayed
+    assert stats['current-jobs-delayed'] == 2
+    assert stats['current-jobs-ready'] == 0
+    assert worker.active == 0
+
+
+async def test_failure_bury(connections, event_loop):
+    producer, conn = await connections(2)
+    jid = await producer.put(b'fail')
+
+    async def handler(id, body):
+        worker.close()
+        raise ValueError(body)
+
+    worker = Worker(handler, [conn], failure='bury', reserve_timeout=1,
+                    loop=event_loop)
+    await asyncio.wait_for(worker.run(), 5, loop=event_loop)
+    assert await producer.peek_buried() == (jid, b'fail')
+
+
+@pytest.mark.parametrize('failure', ['release', 'bury'])
+async def test_shutdown_timeout(connections, event_loop, failure):
+    producer, conn = await connections(2)
+    jid = await producer.put(b'slow')
+    started = asyncio.Event(loop=event_loop)
+
+    async def handler(id, body):
+        started.set()
+        await asyncio.sleep(10, loop=event_loop)
+
+    worker = Worker(handler, [conn], reserve_timeout=1, failure=failure,
+                    failure_delay=10, loop=event_loop)
+    running = asyncio.ensure_future(worker.run(), loop=event_loop)
+    await started.wait()
+    tasks = list(worker._tasks)
+    worker.close(timeout=0.1)
+    await asyncio.wait_for(running, 5, loop=event_loop)
+    # cancelled, not taken for a failed handler
+    assert all(task.cancelled() for task in tasks)
+    # the cancelled job went back to the ready queue
+    assert (await producer.stats_job(jid))['state'] == 'ready'
+
+
+def test_invalid_failure():
+    with pytest.raises(ValueError):
+        Worker(None, [], failure='drop')